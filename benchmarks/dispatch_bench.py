@@ -0,0 +1,72 @@
+"""
+Compares the cost of fanning out one message to N subscribers using
+the old per-message linked list walk (with one iscoroutinefunction call
+per subscriber) against the precompiled dispatch plans used by Multiplexer.
+
+Usage: python -m benchmarks.dispatch_bench
+"""
+import asyncio
+import logging
+import time
+from redismpx.internal import Callbacks
+from redismpx.multiplexer import _build_plan
+
+def on_message(channel, message):
+	pass
+
+async def list_walk(fn_boxes, channel, message):
+	for fn_box in fn_boxes:
+		try:
+			if asyncio.iscoroutinefunction(fn_box.on_message):
+				await fn_box.on_message(channel, message)
+			else:
+				fn_box.on_message(channel, message)
+		except Exception as e:
+			logging.warning(f"on_message function threw exception: {e}")
+
+async def plan_dispatch(plan, channel, message):
+	sync_fns, async_fns, _, _ = plan
+	for fn in sync_fns:
+		try:
+			fn(channel, message)
+		except Exception as e:
+			logging.warning(f"on_message function threw exception: {e}")
+	for fn in async_fns:
+		try:
+			await fn(channel, message)
+		except Exception as e:
+			logging.warning(f"on_message function threw exception: {e}")
+
+async def measure(fn, target, total_calls):
+	messages = max(1, total_calls // target[1])
+	start = time.perf_counter()
+	for _ in range(messages):
+		await fn(target[0], b"channel", b"message")
+	elapsed = time.perf_counter() - start
+	return messages / elapsed
+
+async def run(subscribers=(1, 100, 10_000), total_calls=1_000_000):
+	results = []
+	for n in subscribers:
+		fn_boxes = [Callbacks(on_message) for _ in range(n)]
+		plan = _build_plan(fn_boxes)
+
+		before = await measure(list_walk, (fn_boxes, n), total_calls)
+		after = await measure(plan_dispatch, (plan, n), total_calls)
+		results.append({
+			"subscribers": n,
+			"list_walk_msgs_per_sec": before,
+			"plan_msgs_per_sec": after,
+			"speedup": after / before,
+		})
+	return results
+
+def main():
+	for r in asyncio.run(run()):
+		print(f"{r['subscribers']:>6} subscribers: "
+			f"list walk {r['list_walk_msgs_per_sec']:>12.0f} msg/s, "
+			f"plan {r['plan_msgs_per_sec']:>12.0f} msg/s, "
+			f"x{r['speedup']:.2f}")
+
+if __name__ == "__main__":
+	main()
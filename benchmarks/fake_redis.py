@@ -0,0 +1,254 @@
+"""
+A minimal in-process Redis Pub/Sub server for benchmarks.
+
+It understands SUBSCRIBE, PSUBSCRIBE, SSUBSCRIBE (and their UNSUBSCRIBE
+counterparts), PUBLISH, SPUBLISH and PING, which is all a Multiplexer
+needs, and lets the benchmark publish messages directly, optionally
+at a controlled rate, without going through a client connection.
+
+Usage:
+
+	server = FakeRedis()
+	address = await server.start()
+	mpx = Multiplexer(address)
+	...
+	await server.publish_at(b"channel", b"payload", rate=10_000, count=50_000)
+	server.close()
+
+Nodes sharing a SlotMap behave like a Redis Cluster for sharded Pub/Sub:
+they answer CLUSTER SLOTS, reply MOVED to SSUBSCRIBE and SPUBLISH for
+slots they don't own, and force-unsubscribe the channels of a slot that
+moves away, see `FakeRedis.move_slot`.
+"""
+import asyncio
+import time
+from aioredis.parser import PyReader
+from redismpx.internal.glob import compile_glob
+from redismpx.internal.slots import SLOT_COUNT, key_slot
+
+try:
+	from hiredis import Reader
+except ImportError:
+	Reader = PyReader
+
+class Client:
+	def __init__(self, writer):
+		self.writer = writer
+		# Replies to the commands of the current read, sent with one write.
+		self.replies = []
+		self.channels = set()
+		self.shard_channels = set()
+		self.patterns = {}
+
+	@property
+	def subscriptions(self):
+		return len(self.channels) + len(self.shard_channels) + len(self.patterns)
+
+class SlotMap:
+	"""Which node address owns each hash slot of a fake cluster."""
+
+	def __init__(self):
+		self.owners = [None] * SLOT_COUNT
+
+	def assign(self, start, end, address):
+		self.owners[start:end + 1] = [address] * (end - start + 1)
+
+	def ranges(self):
+		"""The owned slots as (start, end, address) ranges, like CLUSTER SLOTS."""
+		ranges = []
+		for slot, address in enumerate(self.owners):
+			if address is None:
+				continue
+			if ranges and ranges[-1][2] == address and ranges[-1][1] == slot - 1:
+				ranges[-1][1] = slot
+			else:
+				ranges.append([slot, slot, address])
+		return ranges
+
+class FakeRedis:
+	def __init__(self, slot_map=None):
+		self.clients = set()
+		self.server = None
+		self.address = None
+		self.commands = 0
+		self.slot_map = slot_map
+
+	async def start(self, host="127.0.0.1", port=0):
+		"""Starts listening and returns the (host, port) address to connect to."""
+		self.server = await asyncio.start_server(self._serve, host, port)
+		self.address = self.server.sockets[0].getsockname()[:2]
+		return self.address
+
+	def move_slot(self, slot, address):
+		"""
+		Gives `slot` to the node at `address`. Our connections subscribed
+		to channels of that slot get a forced SUNSUBSCRIBE, like Redis
+		sends after a slot migration.
+		"""
+		self.slot_map.owners[slot] = address
+		for client in self.clients:
+			for channel in [ch for ch in client.shard_channels if key_slot(ch) == slot]:
+				client.shard_channels.discard(channel)
+				client.writer.write(_encode([b"sunsubscribe", channel, client.subscriptions]))
+
+	def close(self):
+		for client in list(self.clients):
+			client.writer.close()
+		if self.server is not None:
+			self.server.close()
+
+	def subscribers(self, channel):
+		"""How many connections would receive a message sent to `channel`."""
+		return sum(1 for client in self.clients if self._matches(client, channel))
+
+	def subscriptions(self):
+		"""How many channels and patterns all connections are subscribed to."""
+		return sum(client.subscriptions for client in self.clients)
+
+	def publish(self, channel, message, sharded=False):
+		"""
+		Sends `message` to every connection subscribed to `channel`, like
+		PUBLISH (or SPUBLISH when `sharded` is set) would, and returns the
+		number of receivers.
+		"""
+		if sharded:
+			frame = _encode([b"smessage", channel, message])
+			receivers = [c for c in self.clients if channel in c.shard_channels]
+			for client in receivers:
+				client.writer.write(frame)
+			return len(receivers)
+
+		count = 0
+		frame = None
+		for client in self.clients:
+			if channel in client.channels:
+				if frame is None:
+					frame = _encode([b"message", channel, message])
+				client.writer.write(frame)
+				count += 1
+			for pattern, matcher in client.patterns.items():
+				if matcher(channel):
+					client.writer.write(_encode([b"pmessage", pattern, channel, message]))
+					count += 1
+		return count
+
+	async def publish_at(self, channel, message, rate=None, count=1, sharded=False, tick=0.001):
+		"""
+		Publishes `count` messages to `channel`, at `rate` messages per
+		second or as fast as the connections drain when `rate` is None.
+		`message` can be a function that gets called with the message
+		index and returns the payload, e.g. to embed a timestamp.
+		Returns how long publishing took.
+		"""
+		make = message if callable(message) else (lambda i: message)
+		start = time.perf_counter()
+		sent = 0
+		while sent < count:
+			if rate is None:
+				due = min(count, sent + 1000)
+			else:
+				await asyncio.sleep(tick)
+				due = min(count, int((time.perf_counter() - start) * rate))
+			for i in range(sent, due):
+				self.publish(channel, make(i), sharded)
+			sent = due
+			await self.drain()
+		return time.perf_counter() - start
+
+	async def drain(self):
+		for client in list(self.clients):
+			try:
+				await client.writer.drain()
+			except ConnectionError:
+				pass
+
+	def _matches(self, client, channel):
+		if channel in client.channels or channel in client.shard_channels:
+			return True
+		return any(matcher(channel) for matcher in client.patterns.values())
+
+	async def _serve(self, reader, writer):
+		client = Client(writer)
+		self.clients.add(client)
+		parser = Reader()
+		try:
+			while True:
+				data = await reader.read(64 * 1024)
+				if not data:
+					break
+				parser.feed(data)
+				while True:
+					command = parser.gets()
+					if command is False:
+						break
+					self.commands += 1
+					self._execute(client, command)
+				if client.replies:
+					writer.write(b"".join(client.replies))
+					client.replies = []
+		except ConnectionError:
+			pass
+		finally:
+			self.clients.discard(client)
+			writer.close()
+
+	def _moved(self, name, args):
+		# Sharded commands only work on the node that owns the slot.
+		if self.slot_map is None or name not in (b"SSUBSCRIBE", b"SPUBLISH") or not args:
+			return None
+		slot = key_slot(args[0])
+		owner = self.slot_map.owners[slot]
+		if owner == self.address:
+			return None
+		return b"-MOVED %d %s:%d\r\n" % (slot, owner[0].encode(), owner[1])
+
+	def _execute(self, client, command):
+		name, args = command[0].upper(), command[1:]
+		write = client.replies.append
+		moved = self._moved(name, args)
+		if moved is not None:
+			write(moved)
+		elif name == b"CLUSTER" and args and args[0].upper() == b"SLOTS" and self.slot_map is not None:
+			write(_encode([[start, end, [host.encode(), port]]
+				for start, end, (host, port) in self.slot_map.ranges()]))
+		elif name in (b"SUBSCRIBE", b"SSUBSCRIBE", b"PSUBSCRIBE"):
+			for arg in args:
+				if name == b"SUBSCRIBE":
+					client.channels.add(arg)
+				elif name == b"SSUBSCRIBE":
+					client.shard_channels.add(arg)
+				else:
+					client.patterns[arg] = compile_glob(arg)
+				write(_encode([name.lower(), arg, client.subscriptions]))
+		elif name in (b"UNSUBSCRIBE", b"SUNSUBSCRIBE", b"PUNSUBSCRIBE"):
+			registry = {
+				b"UNSUBSCRIBE": client.channels,
+				b"SUNSUBSCRIBE": client.shard_channels,
+				b"PUNSUBSCRIBE": client.patterns,
+			}[name]
+			for arg in args or list(registry):
+				if isinstance(registry, dict):
+					registry.pop(arg, None)
+				else:
+					registry.discard(arg)
+				write(_encode([name.lower(), arg, client.subscriptions]))
+		elif name in (b"PUBLISH", b"SPUBLISH"):
+			write(b":%d\r\n" % self.publish(args[0], args[1], name == b"SPUBLISH"))
+		elif name == b"PING":
+			if client.subscriptions:
+				write(_encode([b"pong", args[0] if args else b""]))
+			else:
+				write(b"+PONG\r\n")
+		else:
+			write(b"-ERR unknown command '%s'\r\n" % name)
+
+def _encode(items):
+	out = [b"*%d\r\n" % len(items)]
+	for item in items:
+		if isinstance(item, list):
+			out.append(_encode(item))
+		elif isinstance(item, int):
+			out.append(b":%d\r\n" % item)
+		else:
+			out.append(b"$%d\r\n%s\r\n" % (len(item), item))
+	return b"".join(out)
@@ -0,0 +1,55 @@
+"""
+Measures the cost of collecting metrics by feeding batches of messages
+to a Multiplexer's dispatcher with metrics disabled and enabled.
+
+Usage: python -m benchmarks.metrics_bench
+"""
+import asyncio
+import time
+from redismpx import Multiplexer
+from redismpx.internal.parser import MESSAGE
+
+def on_message(channel, message):
+	pass
+
+async def measure(metrics, channels, subscribers, batches=2000, batch_size=64):
+	# Nothing listens on this port, the Multiplexer will keep trying to
+	# connect in the background while we call its dispatcher directly.
+	mpx = Multiplexer(("127.0.0.1", 1), read_batch=batch_size, metrics=metrics)
+	names = [b"channel:%d" % i for i in range(channels)]
+	for _ in range(subscribers):
+		sub = mpx.new_channel_subscription(on_message, None, None)
+		for name in names:
+			sub.add(name)
+	batch = [(MESSAGE, names[i % channels], b"x" * 100) for i in range(batch_size)]
+
+	start = time.perf_counter()
+	for _ in range(batches):
+		await mpx._process_batch(batch)
+	elapsed = time.perf_counter() - start
+	mpx.close()
+	return batches * batch_size / elapsed
+
+async def run(cases=((1, 1), (64, 1), (1, 100))):
+	results = []
+	for channels, subscribers in cases:
+		off = await measure(False, channels, subscribers)
+		on = await measure(True, channels, subscribers)
+		results.append({
+			"channels": channels,
+			"subscribers": subscribers,
+			"off_msgs_per_sec": off,
+			"on_msgs_per_sec": on,
+			"overhead": off / on - 1,
+		})
+	return results
+
+def main():
+	for r in asyncio.run(run()):
+		print(f"{r['channels']:>3} channels x {r['subscribers']:>3} subscribers: "
+			f"metrics off {r['off_msgs_per_sec']:>10.0f} msg/s, "
+			f"on {r['on_msgs_per_sec']:>10.0f} msg/s, "
+			f"overhead {r['overhead'] * 100:.1f}%")
+
+if __name__ == "__main__":
+	main()
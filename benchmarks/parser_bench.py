@@ -0,0 +1,92 @@
+"""
+Measures how many Pub/Sub frames per second each parser can turn into
+something the dispatcher can use, over recorded frame streams fed in
+16KiB reads. The generic parsers are followed by the string comparisons
+that dispatch used to do on their nested lists.
+
+Usage: python -m benchmarks.parser_bench
+"""
+import time
+from aioredis.parser import PyReader
+from redismpx.internal.parser import PyPubSubParser, HiredisPubSubParser, hiredis, MESSAGE, PMESSAGE
+
+READ_SIZE = 16 * 1024
+
+def bulk(value):
+	return b"$%d\r\n%s\r\n" % (len(value), value)
+
+def record(frames, payload_size):
+	"""Builds a stream of `frames` frames, one pmessage every four messages."""
+	payload = b"x" * payload_size
+	out = bytearray()
+	for i in range(frames):
+		channel = b"channel:%d" % (i % 100)
+		if i % 4 == 3:
+			out += b"*4\r\n" + bulk(b"pmessage") + bulk(b"channel:*") + bulk(channel) + bulk(payload)
+		else:
+			out += b"*3\r\n" + bulk(b"message") + bulk(channel) + bulk(payload)
+	return bytes(out)
+
+def chunks(stream):
+	return [stream[i:i + READ_SIZE] for i in range(0, len(stream), READ_SIZE)]
+
+def consume_generic(parser, reads):
+	count = 0
+	for data in reads:
+		parser.feed(data)
+		while True:
+			msg = parser.gets()
+			if msg is False:
+				break
+			if msg[0] == b"message" or msg[0] == b"smessage":
+				count += 1
+			elif msg[0] == b"pmessage":
+				count += 1
+	return count
+
+def consume_tagged(parser, reads):
+	count = 0
+	for data in reads:
+		parser.feed(data)
+		while True:
+			msg = parser.gets()
+			if msg is False:
+				break
+			kind = msg[0]
+			if kind == MESSAGE:
+				count += 1
+			elif kind == PMESSAGE:
+				count += 1
+	return count
+
+def run(frames=200_000, payload_sizes=(16, 256, 4096)):
+	parsers = [
+		("aioredis PyReader", PyReader, consume_generic),
+		("PyPubSubParser", PyPubSubParser, consume_tagged),
+	]
+	if hiredis is not None:
+		parsers.insert(1, ("hiredis.Reader", hiredis.Reader, consume_generic))
+		parsers.append(("HiredisPubSubParser", HiredisPubSubParser, consume_tagged))
+
+	results = []
+	for size in payload_sizes:
+		reads = chunks(record(frames, size))
+		for name, parser_cls, consume in parsers:
+			start = time.perf_counter()
+			count = consume(parser_cls(), reads)
+			elapsed = time.perf_counter() - start
+			assert count == frames
+			results.append({
+				"parser": name,
+				"payload_size": size,
+				"frames_per_sec": frames / elapsed,
+			})
+	return results
+
+def main():
+	for r in run():
+		print(f"{r['payload_size']:>5}B payloads, {r['parser']:<20} "
+			f"{r['frames_per_sec']:>12.0f} frames/s")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,118 @@
+"""
+Measures how many promises per second a PromiseSubscription can create,
+fulfil and expire with 10k, 100k and 1M promises outstanding at once.
+
+Usage: python -m benchmarks.promise_bench
+"""
+import asyncio
+import time
+from redismpx import PromiseSubscription
+
+class DetachedMultiplexer:
+	"""Stands in for a Multiplexer so that no Redis connection is needed."""
+
+	def new_pattern_subscription(self, pattern, on_message, on_disconnect, on_activation):
+		on_activation(pattern)
+		return self
+
+	def close(self):
+		pass
+
+async def bench_fulfil(n):
+	sub = PromiseSubscription(DetachedMultiplexer(), "bench-")
+	suffixes = [b"%d" % i for i in range(n)]
+
+	start = time.perf_counter()
+	futures = [sub.new_promise(suffix, 60) for suffix in suffixes]
+	created = time.perf_counter()
+	for suffix in suffixes:
+		sub.on_message(b"bench-" + suffix, b"ok")
+	fulfilled = time.perf_counter()
+
+	assert all(f.done() for f in futures)
+	sub.close()
+	return n / (created - start), n / (fulfilled - created)
+
+async def bench_expire(n, timeout=0.05):
+	sub = PromiseSubscription(DetachedMultiplexer(), "bench-")
+	# Only count the time spent inside the wheel's expiry callback.
+	spent = 0
+	expire = sub.wheel.on_expire
+	def timed_expire(expired):
+		nonlocal spent
+		start = time.perf_counter()
+		expire(expired)
+		spent += time.perf_counter() - start
+	sub.wheel.on_expire = timed_expire
+
+	futures = [sub.new_promise(b"%d" % i, timeout) for i in range(n)]
+	while sub.wheel.count > 0:
+		await asyncio.sleep(timeout)
+
+	assert all(f.done() for f in futures)
+	for f in futures:
+		f.exception()
+	sub.close()
+	return n / spent
+
+async def bench_fanout(n, rounds=20):
+	sub = PromiseSubscription(DetachedMultiplexer(), "bench-")
+	suffixes = [b"%d" % i for i in range(n)]
+	channels = [b"bench-" + suffix for suffix in suffixes]
+
+	def fulfil():
+		for channel in channels:
+			sub.on_message(channel, b"ok")
+
+	loop = asyncio.get_running_loop()
+	start = time.perf_counter()
+	for _ in range(rounds):
+		futures = [sub.new_promise(suffix, 60) for suffix in suffixes]
+		loop.call_soon(fulfil)
+		await asyncio.gather(*futures)
+	single = time.perf_counter() - start
+
+	start = time.perf_counter()
+	for _ in range(rounds):
+		futures = sub.new_promises(suffixes, 60)
+		loop.call_soon(fulfil)
+		await sub.wait_all(futures)
+	bulk = time.perf_counter() - start
+
+	sub.close()
+	return n * rounds / single, n * rounds / bulk
+
+async def run(sizes=(10_000, 100_000, 1_000_000), fanouts=(1_000, 10_000)):
+	results = []
+	for n in fanouts:
+		single, bulk = await bench_fanout(n)
+		results.append({
+			"fanout": n,
+			"gather_per_sec": single,
+			"bulk_per_sec": bulk,
+		})
+	for n in sizes:
+		create, fulfil = await bench_fulfil(n)
+		expire = await bench_expire(n)
+		results.append({
+			"outstanding": n,
+			"create_per_sec": create,
+			"fulfil_per_sec": fulfil,
+			"expire_per_sec": expire,
+		})
+	return results
+
+def main():
+	for r in asyncio.run(run()):
+		if "fanout" in r:
+			print(f"{r['fanout']:>8} fan-out:  "
+				f"new_promise+gather {r['gather_per_sec']:>10.0f}/s, "
+				f"new_promises+wait_all {r['bulk_per_sec']:>10.0f}/s")
+			continue
+		print(f"{r['outstanding']:>8} promises: "
+			f"create {r['create_per_sec']:>10.0f}/s, "
+			f"fulfil {r['fulfil_per_sec']:>10.0f}/s, "
+			f"expire {r['expire_per_sec']:>10.0f}/s")
+
+if __name__ == "__main__":
+	main()
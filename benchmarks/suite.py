@@ -0,0 +1,399 @@
+"""
+Runs the end-to-end benchmarks against an in-process fake Redis (see
+benchmarks/fake_redis.py) and prints the results as JSON, so that runs
+from different versions can be compared.
+
+Scenarios:
+
+- throughput: messages per second received through a Multiplexer.
+- fanout: cost of delivering each message to more and more subscribers.
+- rate: delivery latency while publishing at a fixed rate.
+- churn: subscribe and unsubscribe requests per second, confirmed by the server.
+- publish: PUBLISH throughput of a Publisher, one at a time, pipelined and
+  fire-and-forget.
+- loopback: latency from Multiplexer.publish to a subscriber of the same
+  Multiplexer, with and without loopback delivery.
+- promises: promise create, fulfil and expire throughput.
+- memory: bytes allocated per subscription, per channel and per
+  subscriber-channel pair (subscriptions holding 10 of 1000 shared channels).
+
+Every result has a `scenario`, the `params` it ran with and its `metrics`.
+Metrics ending in `_per_sec` (and `delivered_ratio`) are better when 
+higher, all others (latencies and sizes) are better when lower. The suite
+runs `--repeat` times and keeps the best value of each metric.
+
+Usage:
+
+	python -m benchmarks.suite [--quick] [--repeat 3] [--output results.json]
+	python -m benchmarks.suite --compare baseline.json [--tolerance 0.1]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import struct
+import sys
+import time
+import tracemalloc
+from redismpx import Multiplexer, Publisher, __version__
+from .fake_redis import FakeRedis
+from .promise_bench import bench_fulfil, bench_expire
+
+class Counter:
+	"""An on_message callback that sets `done` after `target` messages."""
+
+	def __init__(self, target):
+		self.count = 0
+		self.target = target
+		self.done = asyncio.Event()
+
+	def __call__(self, channel, message):
+		self.count += 1
+		if self.count >= self.target:
+			self.done.set()
+
+async def activated(mpx, subscribe):
+	"""Creates subscriptions with `subscribe(on_activation)` and waits for them to be active."""
+	pending = []
+
+	def on_activation(name):
+		pending.pop()
+		if not pending:
+			event.set()
+
+	event = asyncio.Event()
+	result = subscribe(on_activation, pending)
+	await asyncio.wait_for(event.wait(), 30)
+	return result
+
+def result(scenario, params, metrics):
+	return {"scenario": scenario, "params": params, "metrics": metrics}
+
+async def bench_throughput(address, server, messages, payload_size, read_batch):
+	mpx = Multiplexer(address, read_batch=read_batch)
+	counter = Counter(messages)
+
+	def subscribe(on_activation, pending):
+		pending.append(b"bench")
+		sub = mpx.new_channel_subscription(counter, None, on_activation)
+		sub.add(b"bench")
+	await activated(mpx, subscribe)
+
+	payload = b"x" * payload_size
+	start = time.perf_counter()
+	await server.publish_at(b"bench", payload, count=messages)
+	await counter.done.wait()
+	elapsed = time.perf_counter() - start
+	mpx.close()
+	return result("throughput", {"payload_size": payload_size, "read_batch": read_batch}, {
+		"msgs_per_sec": messages / elapsed,
+		"mb_per_sec": messages * payload_size / elapsed / 2**20,
+	})
+
+async def bench_fanout(address, server, subscribers, deliveries):
+	mpx = Multiplexer(address, read_batch=64)
+	messages = max(100, deliveries // subscribers)
+	counters = [Counter(messages) for _ in range(subscribers)]
+
+	def subscribe(on_activation, pending):
+		for counter in counters:
+			pending.append(b"bench")
+			mpx.new_channel_subscription(counter, None, on_activation).add(b"bench")
+	await activated(mpx, subscribe)
+
+	start = time.perf_counter()
+	await server.publish_at(b"bench", b"x" * 64, count=messages)
+	await counters[-1].done.wait()
+	elapsed = time.perf_counter() - start
+	mpx.close()
+	return result("fanout", {"subscribers": subscribers}, {
+		"msgs_per_sec": messages / elapsed,
+		"deliveries_per_sec": messages * subscribers / elapsed,
+	})
+
+async def bench_rate(address, server, rate, duration):
+	mpx = Multiplexer(address, read_batch=64)
+	latencies = []
+
+	def on_message(channel, message):
+		latencies.append(time.perf_counter() - struct.unpack("d", message)[0])
+
+	def subscribe(on_activation, pending):
+		pending.append(b"bench")
+		mpx.new_channel_subscription(on_message, None, on_activation).add(b"bench")
+	await activated(mpx, subscribe)
+
+	count = int(rate * duration)
+	await server.publish_at(b"bench", lambda i: struct.pack("d", time.perf_counter()),
+		rate=rate, count=count)
+	# Give the last messages some time to arrive.
+	deadline = time.perf_counter() + 5
+	while len(latencies) < count and time.perf_counter() < deadline:
+		await asyncio.sleep(0.01)
+	mpx.close()
+
+	latencies.sort()
+	return result("rate", {"rate": rate}, {
+		"delivered_ratio": len(latencies) / count,
+		"p50_latency_sec": _percentile(latencies, 0.5),
+		"p99_latency_sec": _percentile(latencies, 0.99),
+		"max_latency_sec": latencies[-1] if latencies else None,
+	})
+
+async def bench_churn(address, server, channels):
+	mpx = Multiplexer(address)
+	names = [b"churn:%d" % i for i in range(channels)]
+
+	start = time.perf_counter()
+	def subscribe(on_activation, pending):
+		pending.extend(names)
+		sub = mpx.new_channel_subscription(lambda c, m: None, None, on_activation)
+		for name in names:
+			sub.add(name)
+		return sub
+	sub = await activated(mpx, subscribe)
+	subscribed = time.perf_counter() - start
+
+	start = time.perf_counter()
+	for name in names:
+		sub.remove(name)
+	while server.subscriptions() > 0:
+		await asyncio.sleep(0.001)
+	unsubscribed = time.perf_counter() - start
+	mpx.close()
+	return result("churn", {"channels": channels}, {
+		"subscribe_per_sec": channels / subscribed,
+		"unsubscribe_per_sec": channels / unsubscribed,
+	})
+
+async def bench_publish(address, messages):
+	publisher = Publisher(address, pool_size=2)
+	payload = b"x" * 64
+
+	start = time.perf_counter()
+	for i in range(messages // 10):
+		await publisher.publish(b"pub:%d" % (i % 16), payload)
+	sequential = messages // 10 / (time.perf_counter() - start)
+
+	start = time.perf_counter()
+	for chunk in range(0, messages, 1000):
+		await asyncio.gather(*(publisher.publish(b"pub:%d" % (i % 16), payload)
+			for i in range(chunk, min(messages, chunk + 1000))))
+	pipelined = messages / (time.perf_counter() - start)
+
+	start = time.perf_counter()
+	for i in range(messages):
+		await publisher.publish(b"pub:%d" % (i % 16), payload, ack=False)
+	while publisher.pending > 0:
+		await asyncio.sleep(0.001)
+	fire_and_forget = messages / (time.perf_counter() - start)
+
+	publisher.close()
+	return result("publish", {"messages": messages}, {
+		"sequential_per_sec": sequential,
+		"pipelined_per_sec": pipelined,
+		"fire_and_forget_per_sec": fire_and_forget,
+	})
+
+async def bench_loopback(address, messages):
+	latencies = {}
+	for loopback in (False, True):
+		mpx = Multiplexer(address, loopback=loopback)
+		arrived = asyncio.Event()
+
+		def on_message(channel, message):
+			arrived.set()
+
+		def subscribe(on_activation, pending):
+			pending.append(b"loop")
+			mpx.new_channel_subscription(on_message, None, on_activation).add(b"loop")
+		await activated(mpx, subscribe)
+
+		samples = []
+		for _ in range(messages):
+			arrived.clear()
+			start = time.perf_counter()
+			await mpx.publish(b"loop", b"x" * 64)
+			await arrived.wait()
+			samples.append(time.perf_counter() - start)
+		mpx.close()
+		samples.sort()
+		latencies[loopback] = _percentile(samples, 0.5)
+
+	return result("loopback", {"messages": messages}, {
+		"redis_p50_latency_sec": latencies[False],
+		"loopback_p50_latency_sec": latencies[True],
+	})
+
+async def bench_promises(outstanding):
+	create, fulfil = await bench_fulfil(outstanding)
+	expire = await bench_expire(outstanding)
+	return result("promises", {"outstanding": outstanding}, {
+		"create_per_sec": create,
+		"fulfil_per_sec": fulfil,
+		"expire_per_sec": expire,
+	})
+
+async def bench_memory(address, subscriptions):
+	mpx = Multiplexer(address)
+	on_message = lambda c, m: None
+	subs = []
+
+	def measure(fn):
+		gc.collect()
+		before = tracemalloc.get_traced_memory()[0]
+		fn()
+		gc.collect()
+		return (tracemalloc.get_traced_memory()[0] - before) / subscriptions
+
+	tracemalloc.start()
+	try:
+		def channel_subs():
+			for i in range(subscriptions):
+				sub = mpx.new_channel_subscription(on_message, None, None)
+				sub.add(b"mem:%d" % i)
+				subs.append(sub)
+		def pattern_subs():
+			for i in range(subscriptions):
+				subs.append(mpx.new_pattern_subscription(b"pmem:%d:*" % i, on_message, None, None))
+		def channels():
+			sub = mpx.new_channel_subscription(on_message, None, None)
+			for i in range(subscriptions):
+				sub.add(b"chmem:%d" % i)
+			subs.append(sub)
+		shared = [f"room:{i}" for i in range(1000)]
+		def pairs():
+			for i in range(subscriptions):
+				sub = mpx.new_channel_subscription(on_message, None, None)
+				for j in range(10):
+					sub.add(shared[(i * 7 + j * 13) % len(shared)])
+				subs.append(sub)
+
+		per_channel_sub = measure(channel_subs)
+		per_pattern_sub = measure(pattern_subs)
+		per_channel = measure(channels)
+		# The shared channels already exist, so this only measures the
+		# subscriptions and their entries in the registry.
+		pairs()
+		per_pair = measure(pairs) / 10
+	finally:
+		tracemalloc.stop()
+	mpx.close()
+	return result("memory", {"subscriptions": subscriptions}, {
+		"channel_subscription_bytes": per_channel_sub,
+		"pattern_subscription_bytes": per_pattern_sub,
+		"channel_bytes": per_channel,
+		"pair_bytes": per_pair,
+	})
+
+async def run_once(quick):
+	scale = 10 if quick else 1
+	server = FakeRedis()
+	address = await server.start()
+	results = []
+	try:
+		for read_batch in (1, 64):
+			for payload_size in (16, 1024):
+				results.append(await bench_throughput(address, server,
+					200_000 // scale, payload_size, read_batch))
+		for subscribers in (1, 10, 100, 1000):
+			results.append(await bench_fanout(address, server, subscribers, 1_000_000 // scale))
+		for rate in (1_000, 10_000, 50_000):
+			results.append(await bench_rate(address, server, rate, 1 if quick else 3))
+		results.append(await bench_churn(address, server, 20_000 // scale))
+		results.append(await bench_publish(address, 200_000 // scale))
+		results.append(await bench_loopback(address, 5_000 // scale))
+		for outstanding in (10_000 // scale, 100_000 // scale):
+			results.append(await bench_promises(outstanding))
+		results.append(await bench_memory(address, 10_000 // scale))
+	finally:
+		server.close()
+	return results
+
+def run(quick=False, repeat=3):
+	runs = [asyncio.run(run_once(quick)) for _ in range(repeat)]
+	results = runs[0]
+	for other in runs[1:]:
+		for best, r in zip(results, other):
+			for name, value in r["metrics"].items():
+				if value is None or best["metrics"][name] is None:
+					continue
+				if _higher_is_better(name):
+					best["metrics"][name] = max(best["metrics"][name], value)
+				else:
+					best["metrics"][name] = min(best["metrics"][name], value)
+	return {
+		"meta": {
+			"redismpx": __version__,
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+			"quick": quick,
+			"repeat": repeat,
+		},
+		"results": results,
+	}
+
+def compare(baseline, current, tolerance):
+	"""
+	Prints how each metric changed from `baseline` to `current` and
+	returns the number of regressions larger than `tolerance`.
+	"""
+	def index(report):
+		return {(r["scenario"], json.dumps(r["params"], sort_keys=True)): r["metrics"]
+			for r in report["results"]}
+
+	old = index(baseline)
+	regressions = 0
+	for key, metrics in index(current).items():
+		for name, value in metrics.items():
+			before = old.get(key, {}).get(name)
+			if not before or value is None:
+				continue
+			change = value / before - 1
+			worse = -change if _higher_is_better(name) else change
+			flag = ""
+			if worse > tolerance:
+				flag = "  REGRESSION"
+				regressions += 1
+			print(f"{key[0]:<10} {key[1]:<28} {name:<28} {before:>14.6g} -> {value:>14.6g} "
+				f"({change * 100:+.1f}%){flag}")
+	return regressions
+
+def _higher_is_better(name):
+	return name.endswith("_per_sec") or name == "delivered_ratio"
+
+def _percentile(values, fraction):
+	if not values:
+		return None
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+	parser = argparse.ArgumentParser(description="redismpx benchmark suite")
+	parser.add_argument("--quick", action="store_true", help="run smaller workloads")
+	parser.add_argument("--repeat", type=int, default=3,
+		help="run the suite this many times and keep the best results (default: 3)")
+	parser.add_argument("--output", help="write the results to this file instead of stdout")
+	parser.add_argument("--compare", metavar="BASELINE",
+		help="compare the results with a previous run and exit with 1 on regressions")
+	parser.add_argument("--tolerance", type=float, default=0.1,
+		help="relative change considered a regression (default: 0.1)")
+	args = parser.parse_args()
+
+	report = run(args.quick, args.repeat)
+	text = json.dumps(report, indent=2)
+	if args.output:
+		with open(args.output, "w") as f:
+			f.write(text + "\n")
+	elif not args.compare:
+		print(text)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		if compare(baseline, report, args.tolerance):
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
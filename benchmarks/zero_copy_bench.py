@@ -0,0 +1,94 @@
+"""
+Compares delivering payloads as bytes copies (the default parsers) with
+delivering them as memoryviews over the received data (zero_copy=True)
+at several payload sizes. Each message is fanned out to 10 callbacks,
+data is fed in 256KiB reads like asyncio does, and frames are parsed
+in batches of 64 like a Multiplexer created with read_batch=64.
+
+Besides throughput, it reports the peak memory allocated while a batch
+is being dispatched.
+
+Usage: python -m benchmarks.zero_copy_bench
+"""
+import time
+import tracemalloc
+from redismpx.internal.parser import PyPubSubParser, ViewPubSubParser, HiredisPubSubParser, hiredis
+
+READ_SIZE = 256 * 1024
+BATCH = 64
+FANOUT = 10
+
+def record(frames, payload_size):
+	payload = b"x" * payload_size
+	frame = b"*3\r\n$7\r\nmessage\r\n$7\r\nchannel\r\n$%d\r\n%s\r\n" % (payload_size, payload)
+	stream = frame * frames
+	return [stream[i:i + READ_SIZE] for i in range(0, len(stream), READ_SIZE)]
+
+def on_message(channel, message):
+	len(message)
+
+def consume(parser, reads):
+	callbacks = [on_message] * FANOUT
+	release = getattr(parser, "release", None)
+	count = 0
+	for data in reads:
+		parser.feed(data)
+		while True:
+			batch = []
+			while len(batch) < BATCH:
+				msg = parser.gets()
+				if msg is False:
+					break
+				batch.append(msg)
+			if not batch:
+				break
+			for msg in batch:
+				for fn in callbacks:
+					fn(msg[1], msg[2])
+			count += len(batch)
+			if release is not None:
+				release(batch)
+	return count
+
+def peak_memory(parser_cls, reads):
+	tracemalloc.start()
+	consume(parser_cls(), reads)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return peak
+
+def run(payload_sizes=(1024, 16 * 1024, 64 * 1024, 256 * 1024), volume=256 * 1024 * 1024):
+	parsers = [
+		("bytes (PyPubSubParser)", PyPubSubParser),
+		("views (ViewPubSubParser)", ViewPubSubParser),
+	]
+	if hiredis is not None:
+		parsers.insert(1, ("bytes (HiredisPubSubParser)", HiredisPubSubParser))
+
+	results = []
+	for size in payload_sizes:
+		frames = volume // size
+		reads = record(frames, size)
+		small_reads = record(min(frames, 256), size)
+		for name, parser_cls in parsers:
+			start = time.perf_counter()
+			count = consume(parser_cls(), reads)
+			elapsed = time.perf_counter() - start
+			assert count == frames
+			results.append({
+				"mode": name,
+				"payload_size": size,
+				"msgs_per_sec": frames / elapsed,
+				"mb_per_sec": frames * size / elapsed / 2**20,
+				"peak_kb": peak_memory(parser_cls, small_reads) / 1024,
+			})
+	return results
+
+def main():
+	for r in run():
+		print(f"{r['payload_size'] // 1024:>4}KiB payloads, {r['mode']:<28} "
+			f"{r['msgs_per_sec']:>10.0f} msg/s {r['mb_per_sec']:>8.0f} MiB/s, "
+			f"peak {r['peak_kb']:>7.0f} KiB")
+
+if __name__ == "__main__":
+	main()
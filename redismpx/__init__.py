@@ -1,19 +1,47 @@
-from .multiplexer import Multiplexer, OnMessage, OnDisconnect, OnActivation
+from .multiplexer import Multiplexer, OnMessage, OnMessages, OnDisconnect, OnActivation, OnActivations
 from .channel import ChannelSubscription
 from .pattern import PatternSubscription
 from .promise import PromiseSubscription, InactiveSubscription
+from .sharded import ShardedMultiplexer
+from .cluster import ClusterMultiplexer
+from .publisher import Publisher
+from .agent import Agent
+from .delivery import Overflow, SubscriberOverflow
+from .decoding import Payload, Decoder, json_decoder, msgpack_decoder
+from .utils import Backoff
+from .metrics import Metrics, Histogram
+from .profiler import CallbackProfiler, SlowCallback
+from .internal import WriteStalled
 
 __version__ = "0.5.2"
 
 __all__ = [
 	'Multiplexer', 
+	'ShardedMultiplexer',
+	'ClusterMultiplexer',
+	'Publisher',
+	'Agent',
 	"OnMessage",
+	"OnMessages",
 	'OnDisconnect',
 	'OnActivation',
+	'OnActivations',
 	'ChannelSubscription', 
 	'PatternSubscription', 
 	'PromiseSubscription',
 	'InactiveSubscription',
+	'Overflow',
+	'SubscriberOverflow',
+	'Payload',
+	'Decoder',
+	'json_decoder',
+	'msgpack_decoder',
+	'Backoff',
+	'WriteStalled',
+	'Metrics',
+	'Histogram',
+	'CallbackProfiler',
+	'SlowCallback',
 ]
 
 
@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import logging
+import os
+from aioredis.parser import PyReader
+from .multiplexer import Multiplexer
+
+try:
+	from hiredis import Reader
+except ImportError:
+	Reader = PyReader
+
+class Agent:
+	"""
+	An Agent owns the Redis Pub/Sub connection of a whole host and
+	shares it with the worker processes running on it, which connect to
+	the Agent over a Unix socket. Each channel is received from Redis
+	once per host, no matter how many workers subscribe to it, and each
+	worker only receives the channels and patterns it subscribed to.
+
+	The Agent speaks the Redis Pub/Sub protocol, so workers keep using
+	a regular :class:`~redismpx.Multiplexer` (and all its subscription
+	types) created with the path of the socket instead of the address
+	of Redis. Workers can also publish through the Agent, with
+	:class:`~redismpx.Publisher` or :func:`~redismpx.Multiplexer.publish`.
+	Workers can only use SSUBSCRIBE when the Agent's Multiplexer uses
+	sharded Pub/Sub itself, like a :class:`~redismpx.ClusterMultiplexer`.
+
+	The Agent subscribes to Redis through the Multiplexer passed as
+	`multiplexer` (e.g. a :class:`~redismpx.ShardedMultiplexer`), or
+	through one it creates with the remaining connection options, which
+	by default batches reads and lingers on channels for 5 seconds so
+	that workers that restart don't cause subscription churn.
+
+	When the connection to Redis is lost, the Agent disconnects all
+	workers, so that their `on_disconnect` callbacks get called and
+	they resubscribe once it's back. Workers that fall behind by more
+	than `worker_buffer_limit` bytes get disconnected too, like Redis
+	does with slow Pub/Sub clients.
+
+	The Agent can also be run as a standalone process:
+	`python -m redismpx.agent --socket /run/redismpx.sock redis://localhost`
+
+	Usage example:
+
+	.. highlight:: python
+
+    .. code-block:: python
+
+		# In the agent process
+		agent = Agent("/run/redismpx.sock", "redis://localhost")
+		await agent.serve_forever()
+
+		# In each worker process
+		mpx = Multiplexer("/run/redismpx.sock")
+		channel_sub = mpx.new_channel_subscription(
+			my_on_message, my_on_disconnect, None)
+		channel_sub.add("hello-world")
+	"""
+
+	def __init__(self, path: str, *args, multiplexer=None,
+		worker_buffer_limit: int = 64 * 1024 * 1024, **kwargs):
+		if multiplexer is None:
+			kwargs.setdefault("read_batch", 64)
+			kwargs.setdefault("linger", 5)
+			multiplexer = Multiplexer(*args, **kwargs)
+		self.path = path
+		self.mpx = multiplexer
+		self.worker_buffer_limit = worker_buffer_limit
+		self.workers = set()
+		self.server = None
+		# The last batch of messages encoded for a channel, shared by all
+		# the workers subscribed to it (see _encode_messages).
+		self.encoded = (None, None, None)
+
+	async def start(self) -> None:
+		"""Starts accepting workers on the Unix socket."""
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		self.server = await asyncio.start_unix_server(self._serve, self.path)
+
+	async def serve_forever(self) -> None:
+		if self.server is None:
+			await self.start()
+		await self.server.serve_forever()
+
+	def close(self):
+		if self.server is not None:
+			self.server.close()
+			self.server = None
+			if os.path.exists(self.path):
+				os.unlink(self.path)
+		for worker in list(self.workers):
+			worker.close()
+		self.mpx.close()
+
+	async def _serve(self, reader, writer):
+		worker = _Worker(self, writer)
+		self.workers.add(worker)
+		parser = Reader()
+		try:
+			while not worker.closed:
+				data = await reader.read(64 * 1024)
+				if not data:
+					break
+				parser.feed(data)
+				publishes = []
+				while True:
+					command = parser.gets()
+					if command is False:
+						break
+					if command and command[0].upper() in (b"PUBLISH", b"SPUBLISH") and len(command) == 3:
+						publishes.append(asyncio.ensure_future(self._publish(command[1], command[2])))
+					else:
+						self._execute(worker, command)
+				# Replies to PUBLISH are sent in order, once all the ones
+				# received with this read have been forwarded.
+				for reply in publishes:
+					worker.send(await reply)
+		except Exception as e:
+			logging.debug(f"redismpx agent id({id(self)}): worker connection failed: {e}")
+		finally:
+			worker.close()
+
+	def _execute(self, worker, command):
+		if not command or not isinstance(command, list):
+			worker.send(b"-ERR invalid command\r\n")
+			return
+		name, args = command[0].upper(), command[1:]
+		if name in (b"SSUBSCRIBE", b"SUNSUBSCRIBE") and not getattr(self.mpx, "ssubscribe", False):
+			# Our subscriptions would use SUBSCRIBE, which doesn't
+			# receive what gets sent with SPUBLISH.
+			worker.send(b"-ERR %s requires an agent using sharded Pub/Sub\r\n" % name)
+		elif name in (b"SUBSCRIBE", b"SSUBSCRIBE"):
+			for channel in args:
+				worker.subscribe(name.lower(), channel)
+		elif name in (b"UNSUBSCRIBE", b"SUNSUBSCRIBE"):
+			for channel in args or list(worker.sub.channels):
+				worker.unsubscribe(name.lower(), channel)
+		elif name == b"PSUBSCRIBE":
+			for pattern in args:
+				worker.psubscribe(pattern)
+		elif name == b"PUNSUBSCRIBE":
+			for pattern in args or list(worker.patterns):
+				worker.punsubscribe(pattern)
+		elif name == b"PING":
+			worker.send(_encode([b"pong", args[0] if args else b""]))
+		else:
+			worker.send(b"-ERR unknown command '%s'\r\n" % name.replace(b"\r\n", b" "))
+
+	async def _publish(self, channel, message):
+		publish = getattr(self.mpx, "publish", None)
+		if publish is None:
+			return b"-ERR publishing is not supported by this agent\r\n"
+		try:
+			return b":%d\r\n" % await publish(channel, message, ack=True)
+		except Exception as e:
+			return b"-ERR %s\r\n" % str(e).replace("\r\n", " ").encode()
+
+	def _encode_messages(self, pattern, channel, payloads):
+		# Every worker subscribed to a channel gets called with the same
+		# list of payloads, so we only encode it once.
+		key, key_pattern, frames = self.encoded
+		if key is payloads and key_pattern == pattern:
+			return frames
+		if pattern is None:
+			header = b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n" % (len(channel), channel)
+		else:
+			header = b"*4\r\n$8\r\npmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n" % (
+				len(pattern), pattern, len(channel), channel)
+		frames = b"".join(b"%s$%d\r\n%s\r\n" % (header, len(p), p) for p in payloads)
+		self.encoded = (payloads, pattern, frames)
+		return frames
+
+class _Worker:
+	# The state of one worker connection: a ChannelSubscription holding
+	# all its channels and one PatternSubscription per pattern.
+	def __init__(self, agent, writer):
+		self.agent = agent
+		self.writer = writer
+		self.closed = False
+		self.subscribe_kind = b"subscribe"
+		self.sub = agent.mpx.new_channel_subscription(None, self._on_disconnect,
+			self._on_activation, on_messages=self._on_messages)
+		self.patterns = {}
+		# What Redis would count as subscribed: the channels and patterns
+		# confirmed by the upstream Multiplexer.
+		self.confirmed = set()
+
+	@property
+	def count(self):
+		return len(self.confirmed)
+
+	def send(self, data):
+		if self.closed:
+			return
+		self.writer.write(data)
+		if self.writer.transport.get_write_buffer_size() > self.agent.worker_buffer_limit:
+			logging.warning(f"redismpx agent id({id(self.agent)}): disconnecting a worker that fell behind")
+			self.close()
+
+	def subscribe(self, kind, channel):
+		self.subscribe_kind = kind
+		if channel in self.sub.channels:
+			self.send(_encode([kind, channel, self.count]))
+		else:
+			# Confirmed by _on_activation.
+			self.sub.add(channel)
+
+	def unsubscribe(self, kind, channel):
+		self.sub.remove(channel)
+		self.confirmed.discard((False, channel))
+		self.send(_encode([kind, channel, self.count]))
+
+	def psubscribe(self, pattern):
+		if pattern in self.patterns:
+			self.send(_encode([b"psubscribe", pattern, self.count]))
+			return
+
+		def on_messages(channel, payloads):
+			self.send(self.agent._encode_messages(pattern, channel, payloads))
+
+		def on_activation(name):
+			self.confirmed.add((True, pattern))
+			self.send(_encode([b"psubscribe", pattern, self.count]))
+
+		self.patterns[pattern] = self.agent.mpx.new_pattern_subscription(pattern, None,
+			self._on_disconnect, on_activation, on_messages=on_messages)
+
+	def punsubscribe(self, pattern):
+		psub = self.patterns.pop(pattern, None)
+		if psub is not None:
+			psub.close()
+		self.confirmed.discard((True, pattern))
+		self.send(_encode([b"punsubscribe", pattern, self.count]))
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.agent.workers.discard(self)
+		if not getattr(self.agent.mpx, "must_exit", False):
+			self.sub.close()
+			for psub in self.patterns.values():
+				psub.close()
+		self.patterns = {}
+		self.writer.close()
+
+	def _on_messages(self, channel, payloads):
+		self.send(self.agent._encode_messages(None, channel, payloads))
+
+	def _on_activation(self, channel):
+		if channel in self.sub.channels:
+			self.confirmed.add((False, channel))
+			self.send(_encode([self.subscribe_kind, channel, self.count]))
+
+	def _on_disconnect(self, error):
+		# Redis is gone, let the worker find out on its own. We get called
+		# while the Multiplexer walks its subscriptions, which we can't
+		# close right now.
+		asyncio.get_event_loop().call_soon(self.close)
+
+def _encode(items):
+	out = [b"*%d\r\n" % len(items)]
+	for item in items:
+		if isinstance(item, int):
+			out.append(b":%d\r\n" % item)
+		else:
+			out.append(b"$%d\r\n%s\r\n" % (len(item), item))
+	return b"".join(out)
+
+def main():
+	parser = argparse.ArgumentParser(description="Shares a Redis Pub/Sub connection with local workers.")
+	parser.add_argument("address", help="the Redis address, e.g. redis://localhost")
+	parser.add_argument("--socket", required=True, help="path of the Unix socket to listen on")
+	parser.add_argument("--read-batch", type=int, default=64, help="frames parsed per wakeup (default: 64)")
+	parser.add_argument("--linger", type=float, default=5,
+		help="seconds to stay subscribed to channels nobody wants anymore (default: 5)")
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO)
+
+	async def run():
+		agent = Agent(args.socket, args.address, read_batch=args.read_batch, linger=args.linger)
+		try:
+			await agent.serve_forever()
+		finally:
+			agent.close()
+
+	asyncio.run(run())
+
+if __name__ == "__main__":
+	main()
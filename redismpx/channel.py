@@ -1,6 +1,8 @@
-from typing import Union
+import asyncio
+from typing import Union, Iterable
 from .utils import as_bytes
-from .internal import ListNode
+from .internal import ListNode, Callbacks
+from .delivery import DeliveryQueue, ConflatingQueue, Overflow
 
 class ChannelSubscription:
 	"""
@@ -25,17 +27,60 @@ class ChannelSubscription:
 
 		# and remove them
 		channel_sub.remove("banana")
+
+		# or change many channels at once
+		channel_sub.set_channels(["hello-world", "apple", "kiwi"])
+
+	A ChannelSubscription created with a `loop` must only be used from
+	that loop.
 	"""
 
-	def __init__(self, multiplexer, on_message, on_disconnect, on_activation):
+	def __init__(self, multiplexer, on_message, on_disconnect, on_activation,
+		on_messages=None, queue_size=None, overflow=Overflow.BLOCK, loop=None, conflate=None,
+		on_activations=None):
+		profiler = getattr(multiplexer, "profiler", None)
+		if profiler is not None:
+			on_message = profiler.wrap(on_message, "on_message", self)
+			on_messages = profiler.wrap(on_messages, "on_messages", self)
+			on_disconnect = profiler.wrap(on_disconnect, "on_disconnect", self)
+			on_activation = profiler.wrap(on_activation, "on_activation", self)
+			on_activations = profiler.wrap(on_activations, "on_activations", self)
+		# Used as an ordered set, dicts take less memory than sets.
 		self.channels = {}
 		self.mpx = multiplexer
 		self.on_message = on_message
+		self.on_messages = on_messages
 		self.on_disconnect = on_disconnect
 		self.on_activation = on_activation
+		self.on_activations = on_activations
 		self.closed = False
-		self.subNode = ListNode(on_disconnect=self.on_disconnect)
-		self.mpx.subscriptions.prepend(self.subNode)
+		self.queue = None
+		if queue_size is not None:
+			self.queue = DeliveryQueue(on_message, queue_size, overflow, self._on_overflow)
+			self.on_message = self.queue.put
+		elif conflate is not None:
+			self.queue = ConflatingQueue(on_message, conflate)
+			self.on_message = self.queue.put
+		self.loop = loop
+		subnode_on_disconnect = self.on_disconnect
+		outbox = self.mpx._outbox(loop)
+		if outbox is not None:
+			if self.on_messages is not None:
+				self.on_messages = outbox.wrap(self.on_messages, "on_messages")
+			else:
+				self.on_messages = outbox.wrap(self.on_message, "on_message")
+			self.on_message = None
+			self.on_activation = outbox.wrap(self.on_activation, "on_activation")
+			self.on_activations = outbox.wrap(self.on_activations, "on_activations")
+			subnode_on_disconnect = outbox.wrap(self.on_disconnect, "on_disconnect")
+		# Registered under every channel of the subscription.
+		on_activation = self.on_activation
+		if self.on_activations is not None:
+			on_activation = _single_activation(self.on_activations)
+		self.fn_box = Callbacks(self.on_message, self.on_messages, on_activation,
+			self.on_activations)
+		self.subNode = ListNode(on_disconnect=subnode_on_disconnect, sub=self)
+		self.mpx._call(self.mpx.subscriptions.prepend, self.subNode)
 
 	def add(self, channel: Union[str, bytes]) -> None:
 		"""
@@ -50,9 +95,9 @@ class ChannelSubscription:
 		if channel in self.channels:
 			return
 
-		fn_box = ListNode(on_message=self.on_message, on_activation=self.on_activation)
-		self.channels[channel] = fn_box
-		self.mpx._add_channel(channel, fn_box)
+		channel = self.mpx._canonical_channel(channel)
+		self.mpx._call(self.mpx._add_channel, channel, self.fn_box)
+		self.channels[channel] = None
 
 	def remove(self, channel: Union[str, bytes]) -> None:
 		"""
@@ -67,17 +112,80 @@ class ChannelSubscription:
 
 		if channel not in self.channels:
 			return
-		fn_box = self.channels.pop(channel)
-		self.mpx._remove_channel(channel, fn_box)
+		del self.channels[channel]
+		self.mpx._call(self.mpx._remove_channel, channel, self.fn_box)
+
+	def add_many(self, channels: Iterable[Union[str, bytes]]) -> None:
+		"""
+		Adds many Pub/Sub channels to the subscription. Channels that 
+		are already active get reported with a single call to 
+		`on_activations` (or one call to `on_activation` each).
+
+		:param channels: Redis Pub/Sub channels
+		"""
+		if self.closed:
+			raise Exception("tried to use a closed ChannelSubscription")
+
+		new = {}
+		for channel in channels:
+			channel = as_bytes(channel)
+			if channel not in self.channels:
+				new[self.mpx._canonical_channel(channel)] = None
+		if not new:
+			return
+		self.mpx._call(self.mpx._add_channels, list(new), self.fn_box)
+		self.channels.update(new)
+
+	def remove_many(self, channels: Iterable[Union[str, bytes]]) -> None:
+		"""
+		Removes many Redis Pub/Sub channels from the subscription.
+
+		:param channels: Redis Pub/Sub channels
+		"""
+		if self.closed:
+			raise Exception("tried to use a closed ChannelSubscription")
+
+		removed = []
+		for channel in channels:
+			channel = as_bytes(channel)
+			if channel in self.channels:
+				del self.channels[channel]
+				removed.append(channel)
+		if removed:
+			self.mpx._call(self.mpx._remove_channels, removed, self.fn_box)
+
+	def set_channels(self, channels: Iterable[Union[str, bytes]]) -> None:
+		"""
+		Replaces the channels of the subscription with `channels`,
+		adding and removing only what differs. Like all subscription 
+		changes made during the same event loop iteration, this results
+		in at most one SUBSCRIBE and one UNSUBSCRIBE sent to Redis.
+
+		:param channels: Redis Pub/Sub channels
+		"""
+		if self.closed:
+			raise Exception("tried to use a closed ChannelSubscription")
+
+		wanted = {as_bytes(channel): None for channel in channels}
+		removed = [channel for channel in self.channels if channel not in wanted]
+		added = {}
+		for channel in wanted:
+			if channel not in self.channels:
+				added[self.mpx._canonical_channel(channel)] = None
+		if not removed and not added:
+			return
+		self.mpx._call(self.mpx._replace_channels, removed, list(added), self.fn_box)
+		for channel in removed:
+			del self.channels[channel]
+		self.channels.update(added)
 
 	def clear(self) -> None:
 		"""Removes all channels from the subscription"""
 		if self.closed:
 			raise Exception("tried to use a closed ChannelSubscription")
 
-		for k in self.channels:
-			fn_box = self.channels[k]
-			self.mpx._remove_channel(ch, fn_box)
+		if self.channels:
+			self.mpx._call(self.mpx._remove_channels, list(self.channels), self.fn_box)
 
 		self.channels = {}
 
@@ -87,5 +195,24 @@ class ChannelSubscription:
 			raise Exception("tried to use a closed ChannelSubscription")
 
 		self.clear()
-		self.subNode.remove_from_list()
+		self.mpx._call(self.subNode.remove_from_list)
 		self.closed = True
+		if self.queue is not None:
+			self.queue.close()
+
+	def _on_overflow(self, error):
+		if self.closed:
+			return
+		self.close()
+		if self.on_disconnect is not None:
+			asyncio.create_task(self.mpx._log_exeptions(self.on_disconnect, error))
+
+def _single_activation(on_activations):
+	# Activations confirmed by Redis arrive one channel at a time.
+	if asyncio.iscoroutinefunction(on_activations):
+		async def on_activation(channel):
+			await on_activations([channel])
+	else:
+		def on_activation(channel):
+			on_activations([channel])
+	return on_activation
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import aioredis
+from .internal import List, key_slot
+from .internal.slots import SLOT_COUNT
+from .sharded import ShardedMultiplexer
+from .metrics import resolve_metrics
+from .utils import Backoff
+
+# Options that must reach the short-lived connections used to
+# fetch the slot map, all other options go to the Multiplexers.
+_CONNECTION_OPTIONS = ("password", "ssl", "timeout")
+
+class ClusterMultiplexer(ShardedMultiplexer):
+	"""
+	A ClusterMultiplexer uses Redis Cluster sharded Pub/Sub (SSUBSCRIBE)
+	so that each message only travels through the node that owns its
+	channel, instead of being broadcast to the whole cluster.
+
+	It fetches the slot map from one of the startup nodes and keeps one
+	:class:`~redismpx.Multiplexer` per master node, subscribing each
+	channel on the node that owns its hash slot. When a slot migrates
+	(Redis replies with MOVED or force-unsubscribes the channel), the slot
+	map is refreshed and the affected channels are moved transparently.
+
+	Sharded Pub/Sub doesn't support patterns, so PatternSubscriptions
+	and PromiseSubscriptions use a regular Pub/Sub connection to the
+	first startup node.
+
+	Usage example:
+
+	.. highlight:: python
+
+    .. code-block:: python
+
+		mpx = ClusterMultiplexer([('10.0.0.1', 7000), ('10.0.0.2', 7000)])
+
+		channel_sub = mpx.new_channel_subscription(
+			my_on_message, my_on_disconnect, None)
+		channel_sub.add("{user:1}:inbox")
+	"""
+
+	# Channels always get subscribed with SSUBSCRIBE.
+	ssubscribe = True
+
+	def __init__(self, startup_nodes, **kwargs):
+		startup_nodes = list(startup_nodes)
+		if not startup_nodes:
+			raise ValueError("at least one startup node is required")
+		self.startup_nodes = startup_nodes
+		self.metrics = resolve_metrics(kwargs.get("metrics", True))
+		kwargs["metrics"] = self.metrics or False
+		# Our subscriptions wrap their callbacks, our shards only need
+		# to start the profiler.
+		self.profiler = kwargs.get("profiler")
+		self.connection_options = ((startup_nodes[0],), kwargs)
+		self.subscriptions = List(None)
+		self._watch_queues()
+		self._init_handoffs()
+		self.shards = []
+		self.pattern_shard = None
+		self.nodes = {}
+		self.slots = None
+		self.owners = {}
+		self.unrouted = {}
+		self.refreshing = None
+		self.must_exit = False
+		self._schedule_refresh()
+
+	def shard_for(self, channel: bytes):
+		"""Returns the Multiplexer that currently owns the given channel, if any."""
+		return self.owners.get(channel)
+
+	def close(self):
+		self.must_exit = True
+		if self.refreshing is not None:
+			self.refreshing.cancel()
+		super().close()
+
+	def _canonical_channel(self, channel):
+		owner = self.owners.get(channel)
+		if owner is None:
+			return channel
+		return owner._canonical_channel(channel)
+
+	def _check_write_limits(self, channels):
+		# Nodes we don't have a connection to yet have nothing buffered.
+		shards = set()
+		for channel in channels:
+			owner = self.owners.get(channel)
+			if owner is None and self.slots is not None:
+				owner = self.nodes.get(self.slots[key_slot(channel)])
+			if owner is not None:
+				shards.add(owner)
+		for shard in shards:
+			shard._check_write_limit()
+
+	def _add_channel(self, channel, fn_box, active=None):
+		owner = self.owners.get(channel)
+		if owner is None:
+			owner = self._node_for(channel)
+			if owner is None:
+				self.unrouted.setdefault(channel, []).append(fn_box)
+				return
+			self.owners[channel] = owner
+		owner._add_channel(channel, fn_box, active)
+
+	def _remove_channel(self, channel, fn_box):
+		owner = self.owners.get(channel)
+		if owner is None:
+			fn_boxes = self.unrouted[channel]
+			fn_boxes.remove(fn_box)
+			if not fn_boxes:
+				del self.unrouted[channel]
+			return
+		owner._remove_channel(channel, fn_box)
+		if channel not in owner.channels:
+			del self.owners[channel]
+
+	def _node_for(self, channel):
+		if self.slots is None:
+			return None
+		address = self.slots[key_slot(channel)]
+		if address is None:
+			return None
+		node = self.nodes.get(address)
+		if node is None:
+			args, kwargs = self.connection_options
+			node = self._new_shard(address, ssubscribe=True, **kwargs)
+			node.on_slot_migration = self._on_slot_migration
+			self.nodes[address] = node
+			self.shards.append(node)
+		return node
+
+	def _on_slot_migration(self, node, channel):
+		logging.info(f"redismpx id({id(self)}): slot migration detected on {node.connection_options[0]}")
+		self._schedule_refresh()
+
+	async def _on_shard_disconnect(self, shard, cause):
+		# The node might have failed over to a replica.
+		if shard is not self.pattern_shard:
+			self._schedule_refresh()
+		await super()._on_shard_disconnect(shard, cause)
+
+	def _schedule_refresh(self):
+		if self.must_exit:
+			return
+		if self.refreshing is None or self.refreshing.done():
+			self.refreshing = asyncio.create_task(self._refresh())
+
+	async def _refresh(self):
+		backoff = self.connection_options[1].get("backoff", Backoff)()
+		while not self.must_exit:
+			try:
+				self.slots = await self._fetch_slots()
+				break
+			except Exception as e:
+				logging.warning(f"redismpx id({id(self)}): unable to fetch the cluster slot map: {e}")
+				await backoff.wait()
+		self._reroute()
+
+	async def _fetch_slots(self):
+		_, kwargs = self.connection_options
+		options = {k: kwargs[k] for k in _CONNECTION_OPTIONS if k in kwargs}
+		error = None
+		for address in list(self.nodes) + self.startup_nodes:
+			try:
+				conn = await aioredis.create_connection(address, **options)
+			except Exception as e:
+				error = e
+				continue
+			try:
+				reply = await conn.execute(b"CLUSTER", b"SLOTS")
+			finally:
+				conn.close()
+				await conn.wait_closed()
+
+			host = address[0] if isinstance(address, (list, tuple)) else None
+			slots = [None] * SLOT_COUNT
+			for start, end, master, *_ in reply:
+				master_host = master[0].decode() or host
+				slots[start:end + 1] = [(master_host, master[1])] * (end - start + 1)
+			return slots
+		raise error
+
+	def _reroute(self):
+		unrouted = self.unrouted
+		self.unrouted = {}
+		for channel, fn_boxes in unrouted.items():
+			for fn_box in fn_boxes:
+				self._add_channel(channel, fn_box)
+
+		for channel, owner in list(self.owners.items()):
+			target = self._node_for(channel)
+			if target is owner:
+				continue
+			fn_boxes = list(owner.channels.get(channel, ()))
+			for fn_box in fn_boxes:
+				owner._remove_channel(channel, fn_box)
+			linger_handle = owner.lingering.get(channel)
+			if linger_handle is not None:
+				linger_handle.cancel()
+				owner._expire_channel(channel)
+			del self.owners[channel]
+			for fn_box in fn_boxes:
+				self._add_channel(channel, fn_box)
+
+		# Drop the connections to nodes that don't serve us anymore.
+		for address, node in list(self.nodes.items()):
+			if not node.channels:
+				node.close()
+				del self.nodes[address]
+				self.shards.remove(node)
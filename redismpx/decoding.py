@@ -0,0 +1,98 @@
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from .internal.parser import detach
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+Decoder = Callable[[bytes], Any]
+
+class Payload:
+	"""
+	A message received on a channel that has a decoder, see
+	:func:`~redismpx.Multiplexer.set_decoder`. All the subscriptions
+	that receive the same message get the same Payload, which decodes
+	it the first time `value` is read.
+
+	The decoded value is shared, so callbacks must not modify it.
+	"""
+	__slots__ = ("raw", "decoder", "_value")
+
+	_UNSET = object()
+
+	def __init__(self, raw: bytes, decoder: Decoder):
+		self.raw = raw
+		self.decoder = decoder
+		self._value = Payload._UNSET
+
+	@property
+	def value(self) -> Any:
+		"""The decoded message. Decoding errors are raised on each access."""
+		if self._value is Payload._UNSET:
+			self._value = self.decoder(self.raw)
+		return self._value
+
+	def __bytes__(self):
+		return self.raw
+
+	def __len__(self):
+		return len(self.raw)
+
+	def __repr__(self):
+		return f"Payload({self.raw!r})"
+
+def json_decoder(decompress: Optional[Callable[[bytes], bytes]] = None) -> Decoder:
+	"""
+	Returns a decoder for JSON messages, optionally decompressed first,
+	e.g. with `decompress=zlib.decompress`.
+	"""
+	if decompress is None:
+		return json.loads
+	return lambda raw: json.loads(decompress(raw))
+
+def msgpack_decoder(decompress: Optional[Callable[[bytes], bytes]] = None) -> Decoder:
+	"""
+	Returns a decoder for MessagePack messages, optionally decompressed
+	first. Requires the `msgpack` package.
+	"""
+	if msgpack is None:
+		raise ImportError("msgpack_decoder requires the msgpack package")
+	if decompress is None:
+		return msgpack.unpackb
+	return lambda raw: msgpack.unpackb(decompress(raw))
+
+class PayloadCache:
+	"""
+	Maps (decoder, message) to the Payload that wraps it, keeping the
+	most recent `size` entries, so that a message delivered both to a
+	channel and to a pattern that matches it gets decoded once.
+	"""
+
+	def __init__(self, size):
+		self.size = size
+		self.entries = OrderedDict()
+
+	def wrap(self, decoder, payloads):
+		wrapped = []
+		entries = self.entries
+		for raw in payloads:
+			raw = detach(raw)
+			if self.size == 0:
+				wrapped.append(Payload(raw, decoder))
+				continue
+			key = (decoder, raw)
+			payload = entries.get(key)
+			if payload is None:
+				payload = entries[key] = Payload(raw, decoder)
+				if len(entries) > self.size:
+					entries.popitem(last=False)
+			else:
+				entries.move_to_end(key)
+			wrapped.append(payload)
+		return wrapped
+
+	def clear(self):
+		self.entries.clear()
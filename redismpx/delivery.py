@@ -0,0 +1,257 @@
+import asyncio
+import enum
+import logging
+from collections import deque
+from .internal.parser import detach, detach_all
+
+class Overflow(enum.Enum):
+	"""
+	What a subscription's delivery queue does when a new message
+	arrives and the queue is already full.
+
+	- ``BLOCK``: the reader waits for the subscriber to make room.
+	- ``DROP_OLDEST``: the oldest queued message is discarded.
+	- ``DROP_NEWEST``: the incoming message is discarded.
+	- ``DISCONNECT``: the subscription gets closed and its `on_disconnect`
+	  callback receives a :class:`~redismpx.SubscriberOverflow` error.
+	"""
+	BLOCK = "block"
+	DROP_OLDEST = "drop_oldest"
+	DROP_NEWEST = "drop_newest"
+	DISCONNECT = "disconnect"
+
+class SubscriberOverflow(Exception):
+	pass
+
+class DeliveryQueue:
+	"""
+	A bounded per-subscription queue drained by its own consumer task,
+	so that the Multiplexer's reader only has to enqueue messages.
+	"""
+
+	def __init__(self, on_message, maxsize, overflow, on_overflow):
+		if maxsize < 1:
+			raise ValueError("queue_size must be at least 1")
+		self.on_message = on_message
+		self.is_async = asyncio.iscoroutinefunction(on_message)
+		self.maxsize = maxsize
+		self.overflow = Overflow(overflow)
+		self.on_overflow = on_overflow
+		self.items = deque()
+		self.dropped = 0
+		self.closed = False
+		self.not_empty = asyncio.Event()
+		self.not_full = asyncio.Event()
+		self.not_full.set()
+		self.task = asyncio.create_task(self._consume())
+
+	@property
+	def put(self):
+		"""The callable the Multiplexer should use in place of on_message."""
+		if self.overflow is Overflow.BLOCK:
+			return self.put_blocking
+		return self.put_nowait
+
+	def put_nowait(self, channel, message):
+		if self.closed:
+			return
+		message = detach(message)
+
+		if len(self.items) >= self.maxsize:
+			if self.overflow is Overflow.DROP_NEWEST:
+				self.dropped += 1
+				return
+			if self.overflow is Overflow.DROP_OLDEST:
+				self.items.popleft()
+				self.dropped += 1
+			elif self.overflow is Overflow.DISCONNECT:
+				self.close()
+				self.on_overflow(SubscriberOverflow(
+					f"delivery queue exceeded {self.maxsize} messages"))
+				return
+			else:
+				# BLOCK goes through put_blocking, but don't lose
+				# messages if someone calls put_nowait directly.
+				pass
+
+		self.items.append((channel, message))
+		if len(self.items) >= self.maxsize:
+			self.not_full.clear()
+		self.not_empty.set()
+
+	async def put_blocking(self, channel, message):
+		while len(self.items) >= self.maxsize and not self.closed:
+			await self.not_full.wait()
+		self.put_nowait(channel, message)
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.items.clear()
+		# Release any producer stuck on a full queue.
+		self.not_full.set()
+		self.task.cancel()
+
+	async def _consume(self):
+		while True:
+			while not self.items:
+				self.not_empty.clear()
+				await self.not_empty.wait()
+
+			channel, message = self.items.popleft()
+			self.not_full.set()
+			try:
+				if self.is_async:
+					await self.on_message(channel, message)
+				else:
+					self.on_message(channel, message)
+			except Exception as e:
+				logging.warning(f"redismpx id({id(self)}): on_message function threw exception: {e}")
+
+class ConflatingQueue:
+	"""
+	Keeps only the latest message of each channel and delivers them, 
+	in the order their channels first got a message, whenever the
+	subscriber is done with the previous ones and at least `interval`
+	seconds have passed since the last delivery. Messages that get 
+	replaced before being delivered are counted in `dropped`.
+	"""
+
+	def __init__(self, on_message, interval):
+		if interval < 0:
+			raise ValueError("conflate must not be negative")
+		self.on_message = on_message
+		self.is_async = asyncio.iscoroutinefunction(on_message)
+		self.interval = interval
+		self.items = {}
+		self.dropped = 0
+		self.closed = False
+		self.not_empty = asyncio.Event()
+		self.task = asyncio.create_task(self._consume())
+
+	def put(self, channel, message):
+		if self.closed:
+			return
+		message = detach(message)
+		if channel in self.items:
+			self.dropped += 1
+		self.items[channel] = message
+		self.not_empty.set()
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.items.clear()
+		self.task.cancel()
+
+	async def _consume(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			while not self.items:
+				self.not_empty.clear()
+				await self.not_empty.wait()
+
+			started = loop.time()
+			items, self.items = self.items, {}
+			for channel, message in items.items():
+				try:
+					if self.is_async:
+						await self.on_message(channel, message)
+					else:
+						self.on_message(channel, message)
+				except Exception as e:
+					logging.warning(f"redismpx id({id(self)}): on_message function threw exception: {e}")
+			
+			wait = self.interval - (loop.time() - started)
+			if wait > 0:
+				await asyncio.sleep(wait)
+
+class LoopOutbox:
+	"""
+	Delivers the callbacks of subscriptions owned by another event loop.
+	The Multiplexer's reader calls the functions returned by `wrap`,
+	which only record the call, and then hands all the calls recorded
+	during a read batch to the owning loop with one
+	`call_soon_threadsafe`, where a task runs them in order.
+	"""
+
+	def __init__(self, multiplexer, loop):
+		self.mpx = multiplexer
+		self.loop = loop
+		# Reader side: the calls recorded since the last flush.
+		self.items = []
+		# Owning loop side: the calls waiting to be run.
+		self.backlog = deque()
+		self.not_empty = None
+		self.task = None
+
+	def wrap(self, fn, kind):
+		"""
+		Returns a function that records calls to `fn` to be run on the
+		owning loop. For `on_message` and `on_messages` it has the
+		`on_messages` signature, so that the reader records each group
+		of messages once.
+		"""
+		if fn is None:
+			return None
+		is_async = asyncio.iscoroutinefunction(fn)
+		if kind == "on_message" or kind == "on_messages":
+			def forward(channel, payloads):
+				self.items.append((kind, fn, is_async, (channel, detach_all(payloads))))
+				self.mpx._schedule_handoff(self)
+		else:
+			def forward(*args):
+				self.items.append((kind, fn, is_async, args))
+				self.mpx._schedule_handoff(self)
+		return forward
+
+	def flush(self):
+		items, self.items = self.items, []
+		try:
+			self.loop.call_soon_threadsafe(self._receive, items)
+		except RuntimeError as e:
+			logging.warning(f"redismpx id({id(self.mpx)}): dropped {len(items)} callbacks for a closed event loop: {e}")
+
+	def close(self):
+		try:
+			self.loop.call_soon_threadsafe(self._close)
+		except RuntimeError:
+			pass
+
+	def _close(self):
+		self.backlog.clear()
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+
+	def _receive(self, items):
+		self.backlog.extend(items)
+		if self.task is None:
+			self.not_empty = asyncio.Event()
+			self.task = asyncio.ensure_future(self._consume())
+		self.not_empty.set()
+
+	async def _consume(self):
+		while True:
+			while not self.backlog:
+				self.not_empty.clear()
+				await self.not_empty.wait()
+
+			kind, fn, is_async, args = self.backlog.popleft()
+			if kind == "on_message":
+				channel, payloads = args
+				for payload in payloads:
+					await self._run(kind, fn, is_async, (channel, payload))
+			else:
+				await self._run(kind, fn, is_async, args)
+
+	async def _run(self, kind, fn, is_async, args):
+		try:
+			if is_async:
+				await fn(*args)
+			else:
+				fn(*args)
+		except Exception as e:
+			logging.warning(f"redismpx id({id(self.mpx)}): {kind} function threw exception: {e}")
@@ -1,2 +1,7 @@
-from .connection import Conn
-from .list import List, ListNode
\ No newline at end of file
+from .connection import Conn, WriteStalled
+from .list import List, ListNode
+from .callbacks import Callbacks
+from .table import ChannelTable
+from .ring import HashRing
+from .slots import key_slot
+from .wheel import TimingWheel
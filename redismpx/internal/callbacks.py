@@ -0,0 +1,23 @@
+class Callbacks:
+    """
+    The callbacks of one subscription. A ChannelSubscription registers
+    the same Callbacks under all its channels, so each subscriber-channel
+    pair only costs an entry in the channel's registry, a dict used as
+    an ordered set with O(1) removal.
+
+    `pattern`, `matcher`, `server_pattern` and `decode` are set by the
+    Multiplexer for pattern subscriptions, see Multiplexer._add_pattern.
+    """
+    __slots__ = ("on_message", "on_messages", "on_activation", "on_activations",
+        "pattern", "matcher", "server_pattern", "decode")
+
+    def __init__(self, on_message=None, on_messages=None, on_activation=None,
+            on_activations=None):
+        self.on_message = on_message
+        self.on_messages = on_messages
+        self.on_activation = on_activation
+        self.on_activations = on_activations
+        self.pattern = None
+        self.matcher = None
+        self.server_pattern = None
+        self.decode = None
@@ -1,5 +1,5 @@
+import asyncio
 from aioredis.abc import AbcConnection
-from aioredis.parser import Reader
 from aioredis.errors import (
     ConnectionClosedError,
     ConnectionForcedCloseError,
@@ -10,17 +10,29 @@ from aioredis.errors import (
     ReadOnlyError,
     MaxClientsError
 )
+from .parser import PubSubParser, ERROR
+
+
+class WriteStalled(Exception):
+    pass
 
 
 class Conn(AbcConnection):
+    """
+    A Pub/Sub-only connection. `parser` must produce the tagged frames
+    described in `internal.parser`, by default hiredis is used when
+    available, with a pure-Python parser as fallback.
+    """
+
     def __init__(self, reader, writer, *, address, encoding=None,
                      parser=None, loop=None):
         if parser is None:
-            parser = Reader
+            parser = PubSubParser
 
         self._reader = reader
         self._writer = writer
         self._address = address
+        self._drainer = None
         self._reader.set_parser(
             parser(protocolError=ProtocolError, replyError=ReplyError)
         )
@@ -28,17 +40,98 @@ class Conn(AbcConnection):
     def write_command(self, *args):
         self._writer.write(encode_command(*args))
 
-    def drain(self):
-        return self._writer.drain()
+    def write(self, data):
+        """Writes commands that were already encoded with encode_command."""
+        self._writer.write(data)
+
+    async def drain(self, stall_timeout=None):
+        """
+        Waits for the write buffer to drain (only blocks when it is
+        above the high water mark). Raises WriteStalled if that takes
+        longer than `stall_timeout` seconds.
+
+        Concurrent callers share a single wait on the writer: before
+        Python 3.10, StreamWriter.drain fails when awaited twice at once.
+        """
+        if self._drainer is None:
+            self._drainer = asyncio.ensure_future(self._drain())
+        # A caller timing out must not cancel the wait of the others.
+        waiter = asyncio.shield(self._drainer)
+        if stall_timeout is None:
+            await waiter
+            return
+        try:
+            await asyncio.wait_for(waiter, stall_timeout)
+        except asyncio.TimeoutError:
+            raise WriteStalled(
+                f"{self.buffered_bytes} bytes still buffered after {stall_timeout}s")
+
+    async def _drain(self):
+        try:
+            await self._writer.drain()
+        finally:
+            self._drainer = None
+
+    def set_write_limits(self, high=None, low=None):
+        self._writer.transport.set_write_buffer_limits(high, low)
+
+    @property
+    def write_limits(self):
+        """The (low, high) water marks of the write buffer."""
+        return self._writer.transport.get_write_buffer_limits()
+
+    @property
+    def buffered_bytes(self):
+        """How many bytes are waiting to be written to the socket."""
+        return self._writer.transport.get_write_buffer_size()
 
     async def read_message(self):
         while not self._reader.at_eof():
             obj = await self._reader.readobj()
             if (obj == b'' or obj is None) and self._reader.at_eof():
                 raise Exception("reached EOF") 
-            if isinstance(obj, MaxClientsError):
+            if obj[0] == ERROR and isinstance(obj[1], MaxClientsError):
                 raise MaxClientsError()
             yield obj
+            release = getattr(self._reader._parser, "release", None)
+            if release is not None:
+                release((obj,))
+        raise Exception("reached EOF") 
+
+    async def read_batches(self, budget):
+        """
+        Like read_message, but after each wakeup also parses every other
+        complete frame already buffered, up to `budget` frames per batch.
+        A full batch is followed by a yield to the event loop so that a
+        busy connection cannot starve other tasks.
+
+        Parsers that deliver payloads as views over their buffers expose
+        a `release` method, which gets called with each batch once the
+        consumer asks for the next one.
+        """
+        release = getattr(self._reader._parser, "release", None)
+        while not self._reader.at_eof():
+            obj = await self._reader.readobj()
+            if (obj == b'' or obj is None) and self._reader.at_eof():
+                raise Exception("reached EOF") 
+            if obj[0] == ERROR and isinstance(obj[1], MaxClientsError):
+                raise MaxClientsError()
+
+            batch = [obj]
+            parser = self._reader._parser
+            while len(batch) < budget:
+                obj = parser.gets()
+                if obj is False:
+                    break
+                if obj[0] == ERROR and isinstance(obj[1], MaxClientsError):
+                    raise MaxClientsError()
+                batch.append(obj)
+
+            yield batch
+            if release is not None:
+                release(batch)
+            if budget > 1 and len(batch) == budget:
+                await asyncio.sleep(0)
         raise Exception("reached EOF") 
 
     def execute(self, command, *args, **kwargs):
@@ -47,7 +140,9 @@ class Conn(AbcConnection):
         raise NotImplemented
 
     def close(self):
-        pass   
+        self._writer.close()
+        if self._drainer is not None:
+            self._drainer.cancel()
 
     async def wait_closed(self):
         raise NotImplemented
@@ -0,0 +1,173 @@
+import functools
+import re
+
+_SPECIAL = b'*?[\\'
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_glob(pattern: bytes):
+    """
+    Compiles a Redis glob-style pattern (the syntax used by PSUBSCRIBE)
+    into a function that returns a truthy value when a channel name
+    matches it, following the semantics of Redis' stringmatchlen.
+    """
+    return re.compile(_translate(pattern), re.DOTALL).fullmatch
+
+
+def _translate(pattern):
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i:i + 1]
+        i += 1
+        if c == b'*':
+            while pattern[i:i + 1] == b'*':
+                i += 1
+            out.append(b'.*')
+        elif c == b'?':
+            out.append(b'.')
+        elif c == b'\\' and i < n:
+            out.append(re.escape(pattern[i:i + 1]))
+            i += 1
+        elif c == b'[':
+            negate = pattern[i:i + 1] == b'^'
+            if negate:
+                i += 1
+            items = []
+            # An unterminated class extends to the end of the pattern.
+            while i < n and pattern[i:i + 1] != b']':
+                c = pattern[i:i + 1]
+                if c == b'\\' and i + 1 < n:
+                    items.append(re.escape(pattern[i + 1:i + 2]))
+                    i += 2
+                elif pattern[i + 1:i + 2] == b'-' and i + 2 < n and pattern[i + 2:i + 3] != b']':
+                    start, end = pattern[i:i + 1], pattern[i + 2:i + 3]
+                    if start > end:
+                        start, end = end, start
+                    items.append(re.escape(start) + b'-' + re.escape(end))
+                    i += 3
+                else:
+                    items.append(re.escape(c))
+                    i += 1
+            i += 1
+            if items:
+                out.append(b'[' + (b'^' if negate else b'') + b''.join(items) + b']')
+            else:
+                out.append(b'.' if negate else b'(?!)')
+        else:
+            out.append(re.escape(c))
+    return b''.join(out)
+
+
+def literal_prefix(pattern: bytes) -> bytes:
+    """Returns the literal text that every channel matched by `pattern` starts with."""
+    out = bytearray()
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == 92 and i + 1 < n:  # backslash
+            out.append(pattern[i + 1])
+            i += 2
+        elif c in _SPECIAL:
+            break
+        else:
+            out.append(c)
+            i += 1
+    return bytes(out)
+
+
+def prefix_pattern(pattern: bytes):
+    """
+    If `pattern` has the form `<literal prefix>*`, returns the prefix,
+    otherwise returns None.
+    """
+    prefix = literal_prefix(pattern)
+    stripped = pattern.rstrip(b'*')
+    if stripped == pattern or stripped.endswith(b'\\'):
+        return None
+    if literal_prefix(stripped) != prefix or _has_special(stripped):
+        return None
+    return prefix
+
+
+def _has_special(pattern):
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == 92:
+            i += 2
+            continue
+        if c in _SPECIAL:
+            return True
+        i += 1
+    return False
+
+
+def subsumes(broad: bytes, narrow: bytes) -> bool:
+    """
+    Returns True when every channel matched by `narrow` is also matched
+    by `broad`. The check is conservative: it only recognizes identical
+    patterns and `<prefix>*` patterns covering narrower ones.
+    """
+    if broad == narrow:
+        return True
+    prefix = prefix_pattern(broad)
+    if prefix is None:
+        return False
+    return literal_prefix(narrow).startswith(prefix)
+
+
+class PatternTrie:
+    """
+    A prefix trie of `<prefix>*` patterns, used to find which pattern
+    (if any) already covers a new one.
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, pattern: bytes) -> bool:
+        prefix = prefix_pattern(pattern)
+        if prefix is None:
+            return False
+        node = self._root
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node[None] = pattern
+        return True
+
+    def remove(self, pattern: bytes) -> None:
+        prefix = prefix_pattern(pattern)
+        if prefix is None:
+            return
+        path = [self._root]
+        for c in prefix:
+            node = path[-1].get(c)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].get(None) != pattern:
+            return
+        del path[-1][None]
+        # Prune the branches left empty.
+        for c, node in zip(reversed(prefix), reversed(path[:-1])):
+            if node[c]:
+                break
+            del node[c]
+
+    def find_cover(self, pattern: bytes):
+        """Returns the broadest stored pattern that strictly covers `pattern`."""
+        node = self._root
+        for c in literal_prefix(pattern):
+            cover = node.get(None)
+            if cover is not None and cover != pattern:
+                return cover
+            node = node.get(c)
+            if node is None:
+                return None
+        cover = node.get(None)
+        if cover is not None and cover != pattern and subsumes(cover, pattern):
+            return cover
+        return None
@@ -1,4 +1,6 @@
 class List:
+    __slots__ = ("_head",)
+
     def __init__(self, head: 'ListNode'):
         if head is not None:
             head._list = self
@@ -10,7 +12,7 @@ class List:
             self._head = node
         else:
             self._head._prev = node
-            node.next = self._head
+            node._next = self._head
             self._head = node
 
     def is_empty(self) -> bool:
@@ -20,12 +22,14 @@ class List:
         return ListIterator(self._head)
 
 class ListNode:
-    def __init__(self, **kwargs):
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
-            self._next = None
-            self._prev = None
-            self._list = None
+    __slots__ = ("on_disconnect", "sub", "_next", "_prev", "_list")
+
+    def __init__(self, on_disconnect=None, sub=None):
+        self.on_disconnect = on_disconnect
+        self.sub = sub
+        self._next = None
+        self._prev = None
+        self._list = None
 
     def remove_from_list(self) -> List:
         l = self._list
@@ -46,6 +50,8 @@ class ListNode:
         return l
 
 class ListIterator:
+    __slots__ = ("next",)
+
     def __init__(self, node):
         self.next = node
 
@@ -0,0 +1,473 @@
+from collections import deque
+from aioredis.errors import ProtocolError, ReplyError
+
+# Parsers turn the frames of a Pub/Sub connection into tagged tuples:
+#
+#   (MESSAGE, channel, payload)            message, smessage
+#   (PMESSAGE, pattern, channel, payload)  pmessage
+#   (SUBSCRIBE, channel)                   subscribe, ssubscribe
+#   (PSUBSCRIBE, pattern)                  psubscribe
+#   (SUNSUBSCRIBE, channel)                sunsubscribe
+#   (ERROR, error)                         error replies, as replyError instances
+#   (OTHER, reply)                         anything else, as parsed by a generic parser
+#
+# A parser follows the hiredis.Reader interface: `feed(data)` to add
+# data, `gets()` to obtain the next frame or False if none is complete.
+MESSAGE = 0
+PMESSAGE = 1
+SUBSCRIBE = 2
+PSUBSCRIBE = 3
+SUNSUBSCRIBE = 4
+ERROR = 5
+OTHER = 6
+
+_KINDS = {
+    b'message': MESSAGE,
+    b'smessage': MESSAGE,
+    b'pmessage': PMESSAGE,
+    b'subscribe': SUBSCRIBE,
+    b'ssubscribe': SUBSCRIBE,
+    b'psubscribe': PSUBSCRIBE,
+    b'sunsubscribe': SUNSUBSCRIBE,
+}
+
+# Headers of the push frames that carry messages, up to the first
+# byte of the bulk string that follows the message kind.
+_MESSAGE_HEADER = b'*3\r\n$7\r\nmessage\r\n$'
+_SMESSAGE_HEADER = b'*3\r\n$8\r\nsmessage\r\n$'
+_PMESSAGE_HEADER = b'*4\r\n$8\r\npmessage\r\n$'
+
+# Consumed bytes get discarded once they exceed this size.
+_COMPACT_THRESHOLD = 64 * 1024
+
+# Bridge buffers start at this size, at most _POOL_SIZE are kept around.
+_BRIDGE_SIZE = 64 * 1024
+_POOL_SIZE = 4
+
+# hiredis moves the unparsed part of its buffer after every reply, so
+# we feed it at most this many bytes at a time. Feeding it everything
+# that was read makes parsing quadratic when the reader falls behind.
+_HIREDIS_FEED_SIZE = 16 * 1024
+
+_INCOMPLETE = object()
+_UNUSUAL = object()
+_FAILURES = {-1: _INCOMPLETE, -2: _UNUSUAL}
+
+
+def tag_reply(reply, replyError=ReplyError):
+    """Converts a reply produced by a generic RESP parser into a tagged tuple."""
+    if type(reply) is list and reply:
+        kind = _KINDS.get(reply[0])
+        if kind is MESSAGE:
+            return (MESSAGE, reply[1], reply[2])
+        if kind is PMESSAGE:
+            return (PMESSAGE, reply[1], reply[2], reply[3])
+        if kind is not None:
+            return (kind, reply[1])
+    elif isinstance(reply, replyError):
+        return (ERROR, reply)
+    return (OTHER, reply)
+
+
+class PyPubSubParser:
+    """
+    A pure-Python parser specialized for Pub/Sub connections. Message
+    frames are recognized by their header and turned into tagged tuples
+    without building intermediate lists, everything else goes through
+    a generic RESP2 parser.
+    """
+
+    def __init__(self, protocolError=ProtocolError, replyError=ReplyError, encoding=None):
+        self.protocolError = protocolError
+        self.replyError = replyError
+        self._buf = bytearray()
+        self._pos = 0
+
+    def feed(self, data, o=0, l=-1):
+        if l == -1:
+            l = len(data) - o
+        self._buf += data[o:o + l] if o or l != len(data) else data
+
+    def gets(self):
+        buf = self._buf
+        pos = self._pos
+        end = len(buf)
+        if pos >= end:
+            if pos:
+                buf.clear()
+                self._pos = 0
+            return False
+
+        frame, pos = self._frame(buf, pos, end)
+        if frame is _INCOMPLETE:
+            return False
+        if pos >= _COMPACT_THRESHOLD:
+            del buf[:pos]
+            pos = 0
+        self._pos = pos
+        return frame
+
+    def _frame(self, buf, pos, end):
+        """
+        Parses the frame that starts at `pos` and ends before `end`.
+        Returns the frame and the position that follows it, or 
+        _INCOMPLETE and `pos` when more data is needed.
+        """
+        if buf.startswith(_MESSAGE_HEADER, pos, end):
+            frame, next_pos = self._message(buf, pos + len(_MESSAGE_HEADER), end)
+        elif buf.startswith(_PMESSAGE_HEADER, pos, end):
+            frame, next_pos = self._pmessage(buf, pos + len(_PMESSAGE_HEADER), end)
+        elif buf.startswith(_SMESSAGE_HEADER, pos, end):
+            frame, next_pos = self._message(buf, pos + len(_SMESSAGE_HEADER), end)
+        else:
+            frame = _UNUSUAL
+
+        if frame is _INCOMPLETE:
+            return _INCOMPLETE, pos
+        if frame is _UNUSUAL:
+            # Something unusual (e.g. a nil bulk string), let the
+            # generic parser deal with it.
+            reply, next_pos = self._parse(buf, pos, end)
+            if reply is _INCOMPLETE:
+                return _INCOMPLETE, pos
+            return tag_reply(reply, self.replyError), next_pos
+        return frame, next_pos
+
+    def _message(self, buf, pos, end):
+        # pos points right after the `$` of the channel's length.
+        ch_start, ch_stop = _bulk(buf, pos, end)
+        if ch_stop < 0:
+            return _FAILURES[ch_stop], 0
+        pos = ch_stop + 2
+        if pos >= end:
+            return _INCOMPLETE, 0
+        if buf[pos] != 36:
+            return _UNUSUAL, 0
+        start, stop = _bulk(buf, pos + 1, end)
+        if stop < 0:
+            return _FAILURES[stop], 0
+        return (MESSAGE, bytes(buf[ch_start:ch_stop]), self._payload(buf, start, stop)), stop + 2
+
+    def _pmessage(self, buf, pos, end):
+        pat_start, pat_stop = _bulk(buf, pos, end)
+        if pat_stop < 0:
+            return _FAILURES[pat_stop], 0
+        pos = pat_stop + 2
+        if pos >= end:
+            return _INCOMPLETE, 0
+        if buf[pos] != 36:
+            return _UNUSUAL, 0
+        ch_start, ch_stop = _bulk(buf, pos + 1, end)
+        if ch_stop < 0:
+            return _FAILURES[ch_stop], 0
+        pos = ch_stop + 2
+        if pos >= end:
+            return _INCOMPLETE, 0
+        if buf[pos] != 36:
+            return _UNUSUAL, 0
+        start, stop = _bulk(buf, pos + 1, end)
+        if stop < 0:
+            return _FAILURES[stop], 0
+        return (PMESSAGE, bytes(buf[pat_start:pat_stop]), bytes(buf[ch_start:ch_stop]),
+                self._payload(buf, start, stop)), stop + 2
+
+    def _payload(self, buf, start, stop):
+        return bytes(buf[start:stop])
+
+    def _parse(self, buf, pos, end):
+        nl = buf.find(b'\r\n', pos, end)
+        if nl < 0:
+            return _INCOMPLETE, pos
+        ctl = buf[pos]
+        if ctl == 36:  # $
+            size = self._int(buf, pos, nl)
+            if size < 0:
+                return None, nl + 2
+            start = nl + 2
+            if end < start + size + 2:
+                return _INCOMPLETE, pos
+            return bytes(buf[start:start + size]), start + size + 2
+        if ctl == 42:  # *
+            size = self._int(buf, pos, nl)
+            if size < 0:
+                return None, nl + 2
+            items = []
+            next_pos = nl + 2
+            for _ in range(size):
+                item, next_pos = self._parse(buf, next_pos, end)
+                if item is _INCOMPLETE:
+                    return _INCOMPLETE, pos
+                items.append(item)
+            return items, next_pos
+        if ctl == 43:  # +
+            return bytes(buf[pos + 1:nl]), nl + 2
+        if ctl == 45:  # -
+            return self.replyError(bytes(buf[pos + 1:nl]).decode('utf-8')), nl + 2
+        if ctl == 58:  # :
+            return self._int(buf, pos, nl), nl + 2
+        raise self.protocolError(f"Invalid first byte: {bytes([ctl])!r}")
+
+    def _int(self, buf, pos, nl):
+        try:
+            return int(buf[pos + 1:nl])
+        except ValueError as e:
+            raise self.protocolError(e)
+
+    def setmaxbuf(self, size):
+        pass
+
+    def getmaxbuf(self):
+        return 0
+
+
+def detach(payload):
+    """
+    Returns a copy of `payload` that outlives its dispatch, when it is
+    a view handed out by ViewPubSubParser. Anything that keeps a payload
+    past the callback it was given to must detach it first.
+    """
+    if type(payload) is memoryview:
+        return payload.tobytes()
+    return payload
+
+
+def detach_all(payloads):
+    """Like `detach`, for the payloads of a group sharing one parser."""
+    if type(payloads[0]) is memoryview:
+        return [payload.tobytes() for payload in payloads]
+    return payloads
+
+
+class ViewPubSubParser(PyPubSubParser):
+    """
+    Like PyPubSubParser, but message payloads are memoryviews over the 
+    received data instead of copies. 
+
+    The data fed to the parser is never appended to a growing buffer: 
+    payloads are sliced straight out of the chunks read from the socket, 
+    only a frame split between two reads gets copied into a bridge 
+    buffer taken from a small pool. Views must be given back through 
+    `release` once dispatched, which lets bridge buffers be reused.
+    """
+
+    def __init__(self, protocolError=ProtocolError, replyError=ReplyError, encoding=None):
+        super().__init__(protocolError, replyError, encoding)
+        self._buf = b''
+        self._view = memoryview(self._buf)
+        self._end = 0
+        self._segments = deque()
+        self._pool = []
+        self._retired = []
+
+    def feed(self, data, o=0, l=-1):
+        if l == -1:
+            l = len(data) - o
+        if type(data) is not bytes:
+            # We keep referencing the data, so it must not change.
+            data = bytes(data[o:o + l])
+            o = 0
+        self._segments.append((data, o, o + l))
+
+    def gets(self):
+        while True:
+            pos = self._pos
+            end = self._end
+            if pos < end:
+                frame, next_pos = self._frame(self._buf, pos, end)
+                if frame is not _INCOMPLETE:
+                    self._pos = next_pos
+                    return frame
+                if not self._segments:
+                    return False
+                self._bridge()
+            else:
+                if not self._segments:
+                    return False
+                self._retire()
+                data, start, stop = self._segments.popleft()
+                self._buf = data
+                self._view = memoryview(data)
+                self._pos = start
+                self._end = stop
+
+    def release(self, frames):
+        """Releases the payload views of the given frames."""
+        for frame in frames:
+            if frame[0] <= PMESSAGE:
+                payload = frame[-1]
+                if type(payload) is memoryview:
+                    payload.release()
+
+        retired = self._retired
+        self._retired = []
+        for buf in retired:
+            if len(self._pool) < _POOL_SIZE and not _exported(buf):
+                self._pool.append(buf)
+
+    def _payload(self, buf, start, stop):
+        return self._view[start:stop]
+
+    def _bridge(self):
+        # Copies the incomplete frame at the end of the current chunk, 
+        # followed by as much of the next chunk as the frame needs, 
+        # into a buffer of its own.
+        pos = self._pos
+        tail = self._end - pos
+        size = _frame_size(self._buf, pos, self._end)
+        data, start, stop = self._segments[0]
+        available = stop - start
+        needed = available if size is None else min(size - tail, available)
+
+        bridge = self._take(tail + needed)
+        bridge[:tail] = self._view[pos:self._end]
+        with memoryview(data) as view:
+            bridge[tail:tail + needed] = view[start:start + needed]
+        if needed == available:
+            self._segments.popleft()
+        else:
+            self._segments[0] = (data, start + needed, stop)
+
+        self._retire()
+        self._buf = bridge
+        self._view = memoryview(bridge)
+        self._pos = 0
+        self._end = tail + needed
+
+    def _take(self, size):
+        pool = self._pool
+        for i, buf in enumerate(pool):
+            if len(buf) >= size:
+                return pool.pop(i)
+        return bytearray(max(size, _BRIDGE_SIZE))
+
+    def _retire(self):
+        if type(self._buf) is bytearray:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+            self._retired.append(self._buf)
+
+
+def _bulk(buf, pos, end):
+    """
+    Reads a bulk string whose length starts at `pos`. Returns where the
+    string starts and stops, or a negative stop when the data is 
+    incomplete (-1) or the bulk string is unusual (-2).
+    """
+    nl = buf.find(b'\r\n', pos, min(pos + 21, end))
+    if nl < 0:
+        return 0, -1 if end - pos < 21 else -2
+    try:
+        size = int(buf[pos:nl])
+    except ValueError:
+        return 0, -2
+    if size < 0:
+        return 0, -2
+    start = nl + 2
+    stop = start + size
+    if end < stop + 2:
+        return 0, -1
+    return start, stop
+
+
+def _frame_size(buf, pos, end):
+    """
+    Returns the size of the array of bulk strings and integers at `pos`,
+    or None if it can't be known from the data before `end`.
+    """
+    try:
+        if buf[pos] != 42:
+            return None
+        nl = buf.find(b'\r\n', pos, end)
+        if nl < 0:
+            return None
+        items = int(buf[pos + 1:nl])
+        next_pos = nl + 2
+        for _ in range(items):
+            if next_pos >= end:
+                return None
+            nl = buf.find(b'\r\n', next_pos, end)
+            if nl < 0:
+                return None
+            ctl = buf[next_pos]
+            if ctl == 36:
+                size = int(buf[next_pos + 1:nl])
+                next_pos = nl + 2 + (size + 2 if size >= 0 else 0)
+            elif ctl == 58:
+                next_pos = nl + 2
+            else:
+                return None
+        return next_pos - pos
+    except ValueError:
+        return None
+
+
+def _exported(buf):
+    # A bytearray can't be resized while someone holds a view on it.
+    try:
+        buf.append(0)
+    except BufferError:
+        return True
+    del buf[-1]
+    return False
+
+
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+
+class HiredisPubSubParser:
+    """
+    A parser backed by hiredis. Replies are parsed in C and then
+    turned into tagged tuples. Data is queued and handed to hiredis
+    in slices of at most _HIREDIS_FEED_SIZE bytes when it runs out of
+    replies.
+    """
+
+    def __init__(self, protocolError=ProtocolError, replyError=ReplyError, encoding=None):
+        self.replyError = replyError
+        self._reader = hiredis.Reader(protocolError=protocolError, replyError=replyError)
+        self._pending = deque()
+
+    def feed(self, data, o=0, l=-1):
+        if l == -1:
+            l = len(data) - o
+        if type(data) is not bytes:
+            # We keep referencing the data, so it must not change.
+            data = bytes(data[o:o + l])
+            o = 0
+        if l > 0:
+            self._pending.append((data, o, o + l))
+
+    def gets(self):
+        reply = self._reader.gets()
+        while reply is False:
+            if not self._pending:
+                return False
+            data, start, stop = self._pending[0]
+            if stop - start > _HIREDIS_FEED_SIZE:
+                self._reader.feed(data, start, _HIREDIS_FEED_SIZE)
+                self._pending[0] = (data, start + _HIREDIS_FEED_SIZE, stop)
+            else:
+                self._reader.feed(data, start, stop - start)
+                self._pending.popleft()
+            reply = self._reader.gets()
+        if type(reply) is list:
+            kind = _KINDS.get(reply[0])
+            if kind is MESSAGE:
+                return (MESSAGE, reply[1], reply[2])
+            if kind is PMESSAGE:
+                return (PMESSAGE, reply[1], reply[2], reply[3])
+        return tag_reply(reply, self.replyError)
+
+    def setmaxbuf(self, size):
+        self._reader.setmaxbuf(size)
+
+    def getmaxbuf(self):
+        return self._reader.getmaxbuf()
+
+
+PubSubParser = PyPubSubParser if hiredis is None else HiredisPubSubParser
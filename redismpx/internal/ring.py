@@ -0,0 +1,26 @@
+import bisect
+import zlib
+
+
+class HashRing:
+    """
+    A consistent hash ring that maps keys to one of the given nodes,
+    using `replicas` virtual points per node to even out the load.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        if not nodes:
+            raise ValueError("a HashRing needs at least one node")
+        points = []
+        for i, node in enumerate(nodes):
+            for r in range(replicas):
+                points.append((zlib.crc32(b'%d-%d' % (i, r)), i))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._owners = [nodes[i] for _, i in points]
+
+    def get(self, key: bytes):
+        i = bisect.bisect(self._hashes, zlib.crc32(key))
+        if i == len(self._hashes):
+            i = 0
+        return self._owners[i]
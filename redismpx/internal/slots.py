@@ -0,0 +1,37 @@
+SLOT_COUNT = 16384
+
+
+def _make_crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+_CRC16_TABLE = _make_crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    """CRC16-XMODEM, the checksum Redis Cluster uses for key hashing."""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABLE[((crc >> 8) ^ byte) & 0xFF]
+    return crc
+
+
+def key_slot(key: bytes) -> int:
+    """
+    Returns the Redis Cluster hash slot of a key (or sharded channel),
+    honoring `{hash tags}` like Redis does.
+    """
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end != -1 and end != start + 1:
+            key = key[start + 1:end]
+    return crc16(key) % SLOT_COUNT
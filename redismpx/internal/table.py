@@ -0,0 +1,58 @@
+from typing import Optional
+
+class ChannelTable:
+    """
+    Maps the channels of a Multiplexer to small integer ids and to one
+    canonical bytes object, so that subscriptions and the Multiplexer's
+    own sets all share the same key instead of holding equal copies.
+    Ids of dropped channels get reused.
+    """
+    __slots__ = ("ids", "names", "free", "canonicals")
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.free = []
+        # name -> interned name, so that `canonical` needs a single lookup.
+        self.canonicals = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, name: bytes) -> int:
+        """Returns the id of `name`, adding it if needed."""
+        channel_id = self.ids.get(name)
+        if channel_id is None:
+            if self.free:
+                channel_id = self.free.pop()
+                self.names[channel_id] = name
+            else:
+                channel_id = len(self.names)
+                self.names.append(name)
+            self.ids[name] = channel_id
+            self.canonicals[name] = name
+        return channel_id
+
+    def release(self, name: bytes) -> None:
+        channel_id = self.ids.pop(name, None)
+        if channel_id is not None:
+            del self.canonicals[name]
+            self.names[channel_id] = None
+            self.free.append(channel_id)
+
+    def lookup(self, name: bytes) -> Optional[int]:
+        return self.ids.get(name)
+
+    def name(self, channel_id: int) -> bytes:
+        name = self.names[channel_id]
+        if name is None:
+            raise KeyError(channel_id)
+        return name
+
+    def canonical(self, name: bytes) -> bytes:
+        """
+        Returns the interned object equal to `name`, or `name` itself.
+        It is a single dict lookup, so it is safe to call from other
+        threads while the table changes.
+        """
+        return self.canonicals.get(name, name)
@@ -0,0 +1,69 @@
+import asyncio
+import math
+
+
+class TimingWheel:
+    """
+    A hashed timing wheel. Items scheduled with `schedule` get passed
+    in batches to `on_expire` once their delay has passed, at most one
+    tick late. A single loop timer drives the whole wheel, and it
+    only runs while the wheel holds at least one item.
+    """
+
+    def __init__(self, on_expire, tick=0.01, size=1024):
+        self.on_expire = on_expire
+        self.tick = tick
+        self.size = size
+        self.slots = [[] for _ in range(size)]
+        self.cursor = 0
+        self.count = 0
+        self._handle = None
+        self._next_time = None
+
+    def schedule(self, delay, item):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        if self._handle is None:
+            self._next_time = now + self.tick
+            self._handle = loop.call_at(self._next_time, self._advance)
+        # The slot after the cursor expires at `_next_time`, which can be
+        # anywhere within the next tick: count from there, so that items
+        # never expire before their delay.
+        ticks = max(1, math.ceil((now + delay - self._next_time) / self.tick) + 1)
+        slot = (self.cursor + ticks) % self.size
+        self.slots[slot].append(((ticks - 1) // self.size, item))
+        self.count += 1
+
+    def clear(self):
+        self.slots = [[] for _ in range(self.size)]
+        self.count = 0
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _advance(self):
+        self._handle = None
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        # Catch up with any tick we missed because the loop was busy.
+        while self._next_time <= now and self.count > 0:
+            self._next_time += self.tick
+            self.cursor = (self.cursor + 1) % self.size
+            bucket = self.slots[self.cursor]
+            if not bucket:
+                continue
+
+            expired = []
+            pending = []
+            for rounds, item in bucket:
+                if rounds == 0:
+                    expired.append(item)
+                else:
+                    pending.append((rounds - 1, item))
+            self.slots[self.cursor] = pending
+            if expired:
+                self.count -= len(expired)
+                self.on_expire(expired)
+
+        if self.count > 0 and self._handle is None:
+            self._handle = loop.call_at(self._next_time, self._advance)
@@ -0,0 +1,257 @@
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Optional, Sequence, Union
+
+# Latency buckets, in seconds, from 10µs to 10s.
+LATENCY_BUCKETS = (
+	0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+	0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+	0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+FANOUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000)
+
+class Histogram:
+	"""
+	A fixed-bucket histogram. `counts[i]` holds the observations that
+	are lower than or equal to `buckets[i]` (and greater than the
+	previous bucket), the last slot holds the ones above every bucket.
+	"""
+
+	def __init__(self, buckets: Sequence[float]):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.sum = 0
+		self.count = 0
+
+	def observe(self, value: float) -> None:
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def snapshot(self) -> dict:
+		cumulative = []
+		total = 0
+		for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+			total += count
+			cumulative.append((bound, total))
+		return {"buckets": cumulative, "sum": self.sum, "count": self.count}
+
+class Metrics:
+	"""
+	Counters and histograms describing what a Multiplexer is doing.
+
+	Everything gets updated from the event loop thread, so no locking is
+	needed. Counters are always updated, while dispatch latency and
+	fan-out are measured on one dispatch out of `sample_every` (per
+	channel or pattern group of messages), which keeps the overhead low
+	enough to leave metrics on in production.
+
+	Per-channel and per-pattern counters are dropped when the Multiplexer
+	unsubscribes from the channel or pattern. Set `per_channel=False` to
+	only keep the totals, e.g. when there are too many channels for
+	per-channel series to make sense.
+
+	A single Metrics instance can be shared by several Multiplexers,
+	which is what :class:`~redismpx.ShardedMultiplexer` does.
+
+	Use :func:`~redismpx.Metrics.snapshot` to read the metrics or
+	:func:`~redismpx.Metrics.prometheus` to export them in the Prometheus
+	text format.
+	"""
+
+	def __init__(self, sample_every: int = 64, per_channel: bool = True):
+		if sample_every < 1:
+			raise ValueError("sample_every must be at least 1")
+		self.sample_every = sample_every
+		self.per_channel = per_channel
+		# Decremented by the Multiplexer at each dispatch, which gets 
+		# timed when it reaches zero.
+		self.countdown = sample_every
+		# Map each channel (or pattern) to a [messages, bytes, deliveries]
+		# list that the Multiplexer updates directly.
+		self.channels = {}
+		self.patterns = {}
+		# Totals of forgotten channels and patterns, and of all of them
+		# when not counting per channel.
+		self.other = [0, 0, 0]
+		self.reconnects = 0
+		self.promises_fulfilled = 0
+		self.promises_timed_out = 0
+		self.promises_cancelled = 0
+		self.dispatch_seconds = Histogram(LATENCY_BUCKETS)
+		self.fanout = Histogram(FANOUT_BUCKETS)
+		self.reconnect_seconds = Histogram(LATENCY_BUCKETS)
+		self.activation_seconds = Histogram(LATENCY_BUCKETS)
+		self.gauges = {}
+
+	def add_gauge(self, name: str, fn: Callable[[], float]) -> None:
+		"""
+		Registers a function that gets called when taking a snapshot.
+		Values of gauges registered more than once under the same name
+		get summed.
+		"""
+		self.gauges.setdefault(name, []).append(fn)
+
+	def remove_gauge(self, name: str, fn: Callable[[], float]) -> None:
+		fns = self.gauges.get(name)
+		if fns is not None and fn in fns:
+			fns.remove(fn)
+			if not fns:
+				del self.gauges[name]
+
+	def new_stats(self, registry: dict, name: bytes) -> list:
+		"""Returns the stats list where messages for `name` should be counted."""
+		if not self.per_channel:
+			return self.other
+		stats = registry[name] = [0, 0, 0]
+		return stats
+
+	def forget(self, registry: dict, name: bytes) -> None:
+		stats = registry.pop(name, None)
+		if stats is not None:
+			for i, value in enumerate(stats):
+				self.other[i] += value
+
+	@property
+	def messages(self) -> int:
+		return self._total(0)
+
+	@property
+	def bytes(self) -> int:
+		return self._total(1)
+
+	@property
+	def deliveries(self) -> int:
+		return self._total(2)
+
+	def _total(self, i):
+		total = self.other[i]
+		for stats in self.channels.values():
+			total += stats[i]
+		for stats in self.patterns.values():
+			total += stats[i]
+		return total
+
+	def snapshot(self) -> dict:
+		"""Returns all the metrics as a dictionary of plain values."""
+		return {
+			"messages": self.messages,
+			"bytes": self.bytes,
+			"deliveries": self.deliveries,
+			"channels": {ch: {"messages": m, "bytes": b, "deliveries": d}
+				for ch, (m, b, d) in self.channels.items()},
+			"patterns": {p: {"messages": m, "bytes": b, "deliveries": d}
+				for p, (m, b, d) in self.patterns.items()},
+			"reconnects": self.reconnects,
+			"promises": {
+				"fulfilled": self.promises_fulfilled,
+				"timed_out": self.promises_timed_out,
+				"cancelled": self.promises_cancelled,
+			},
+			"histograms": {
+				"dispatch_seconds": self.dispatch_seconds.snapshot(),
+				"fanout": self.fanout.snapshot(),
+				"reconnect_seconds": self.reconnect_seconds.snapshot(),
+				"activation_seconds": self.activation_seconds.snapshot(),
+			},
+			"gauges": {name: sum(fn() for fn in fns) for name, fns in self.gauges.items()},
+		}
+
+	def prometheus(self, namespace: str = "redismpx") -> str:
+		"""Returns the metrics in the Prometheus text exposition format."""
+		snap = self.snapshot()
+		lines = []
+
+		def metric(name, kind, help_text, samples):
+			full_name = f"{namespace}_{name}"
+			lines.append(f"# HELP {full_name} {help_text}")
+			lines.append(f"# TYPE {full_name} {kind}")
+			for suffix, labels, value in samples:
+				lines.append(f"{full_name}{suffix}{_labels(labels)} {_number(value)}")
+
+		metric("messages_total", "counter", "Messages received.",
+			[("", {}, snap["messages"])])
+		metric("bytes_total", "counter", "Payload bytes received.",
+			[("", {}, snap["bytes"])])
+		metric("deliveries_total", "counter", "Messages delivered to callbacks.",
+			[("", {}, snap["deliveries"])])
+		if self.per_channel:
+			metric("channel_messages_total", "counter", "Messages received per channel.",
+				[("", {"channel": ch}, s["messages"]) for ch, s in snap["channels"].items()])
+			metric("channel_bytes_total", "counter", "Payload bytes received per channel.",
+				[("", {"channel": ch}, s["bytes"]) for ch, s in snap["channels"].items()])
+			metric("pattern_messages_total", "counter", "Messages received per pattern.",
+				[("", {"pattern": p}, s["messages"]) for p, s in snap["patterns"].items()])
+			metric("pattern_bytes_total", "counter", "Payload bytes received per pattern.",
+				[("", {"pattern": p}, s["bytes"]) for p, s in snap["patterns"].items()])
+		metric("reconnects_total", "counter", "Reconnections to Redis.",
+			[("", {}, snap["reconnects"])])
+		metric("promises_total", "counter", "Promises by outcome.",
+			[("", {"outcome": k}, v) for k, v in snap["promises"].items()])
+
+		for name, help_text in (
+			("dispatch_seconds", "Time spent delivering a message to its callbacks (sampled)."),
+			("fanout", "Callbacks per delivered message (sampled)."),
+			("reconnect_seconds", "Time spent reconnecting to Redis."),
+			("activation_seconds", "Time between a subscribe request and its confirmation.")):
+			hist = snap["histograms"][name]
+			samples = [("_bucket", {"le": bound}, count) for bound, count in hist["buckets"]]
+			samples.append(("_sum", {}, hist["sum"]))
+			samples.append(("_count", {}, hist["count"]))
+			metric(name, "histogram", help_text, samples)
+
+		for name, value in snap["gauges"].items():
+			metric(name, "gauge", name.replace("_", " ").capitalize() + ".", [("", {}, value)])
+
+		return "\n".join(lines) + "\n"
+
+	async def serve(self, host: str = "127.0.0.1", port: int = 9100,
+		namespace: str = "redismpx") -> asyncio.AbstractServer:
+		"""
+		Starts a minimal HTTP server that answers every request with
+		:func:`~redismpx.Metrics.prometheus`, for Prometheus to scrape.
+		It only listens on localhost unless given another `host`, e.g.
+		`"0.0.0.0"` to be reachable from other machines.
+		"""
+		async def handle(reader, writer):
+			try:
+				# Skip the request, we serve the same page for any path.
+				while (await reader.readline()).strip():
+					pass
+				body = self.prometheus(namespace).encode()
+				writer.write(
+					b"HTTP/1.1 200 OK\r\n"
+					b"Content-Type: text/plain; version=0.0.4\r\n"
+					b"Content-Length: %d\r\n"
+					b"Connection: close\r\n\r\n" % len(body) + body)
+				await writer.drain()
+			finally:
+				writer.close()
+
+		return await asyncio.start_server(handle, host, port)
+
+def resolve_metrics(option: Union[bool, Metrics, None]) -> Optional[Metrics]:
+	"""Turns the value of a `metrics` option into a Metrics instance or None."""
+	if option is True:
+		return Metrics()
+	if option is False or option is None:
+		return None
+	return option
+
+def _labels(labels):
+	if not labels:
+		return ""
+	parts = []
+	for key, value in labels.items():
+		if isinstance(value, bytes):
+			value = value.decode("utf-8", "backslashreplace")
+		elif isinstance(value, float):
+			value = _number(value)
+		value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+		parts.append(f'{key}="{value}"')
+	return "{" + ",".join(parts) + "}"
+
+def _number(value):
+	if value == float("inf"):
+		return "+Inf"
+	return repr(value) if isinstance(value, float) else str(value)
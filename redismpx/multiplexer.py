@@ -1,16 +1,102 @@
 import asyncio
 import logging
+import os
+import time
 import aioredis
-from typing import Union, Awaitable, Callable, Optional
-from .internal import Conn, List
-from .utils import as_bytes, jitter_exp_backoff
+from typing import Union, Awaitable, Callable, Optional, Sequence, Iterable
+from .internal import Conn, List, WriteStalled, ChannelTable, key_slot
+from .internal.parser import MESSAGE, PMESSAGE, SUBSCRIBE, PSUBSCRIBE, SUNSUBSCRIBE, ERROR, ViewPubSubParser
+from .internal.glob import PatternTrie, compile_glob
+from .utils import as_bytes, Backoff
 from .channel import ChannelSubscription
 from .pattern import PatternSubscription
 from .promise import PromiseSubscription
+from .delivery import Overflow, LoopOutbox
+from .metrics import Metrics, resolve_metrics
+from .profiler import CallbackProfiler
+from .publisher import Publisher
+from .decoding import Decoder, PayloadCache
 
 OnMessage = Callable[[bytes, bytes], Optional[Awaitable[None]]]
 OnDisconnect = Callable[[Exception], Optional[Awaitable[None]]]
 OnActivation = Callable[[bytes], Optional[Awaitable[None]]]
+OnMessages = Callable[[bytes, Sequence[bytes]], Optional[Awaitable[None]]]
+OnActivations = Callable[[Sequence[bytes]], Optional[Awaitable[None]]]
+
+# A dispatch plan is a tuple of four tuples holding the sync and async 
+# on_message functions, followed by the sync and async on_messages 
+# (batch) functions subscribed to a given channel or pattern.
+# Plans are never mutated, _add_* and _remove_* replace them, so
+# the reader can iterate over them without any introspection.
+_EMPTY_PLAN = ((), (), (), ())
+
+def _plan_slot(fn_box):
+	matcher = getattr(fn_box, "matcher", None)
+	if fn_box.on_messages is not None:
+		fn = fn_box.on_messages
+		slot = 3 if asyncio.iscoroutinefunction(fn) else 2
+	else:
+		fn = fn_box.on_message
+		slot = 1 if asyncio.iscoroutinefunction(fn) else 0
+	if matcher is not None:
+		fn = _filtered(fn, matcher, getattr(fn_box, "decode", None), fn_box.pattern, slot >= 2)
+	return fn, slot
+
+def _filtered(fn, matcher, decode=None, pattern=None, batch=False):
+	# Wraps the callbacks of patterns served by a broader 
+	# server-side pattern, see Multiplexer._add_pattern. Messages
+	# arrive decoded for the broader pattern, `decode` redoes it
+	# for the covered one.
+	if decode is None:
+		redecode = lambda channel, message: message
+	elif batch:
+		redecode = lambda channel, messages: decode(pattern, channel, messages)
+	else:
+		redecode = lambda channel, message: decode(pattern, channel, (message,))[0]
+	if asyncio.iscoroutinefunction(fn):
+		async def filtered(channel, message):
+			if matcher(channel):
+				await fn(channel, redecode(channel, message))
+	else:
+		def filtered(channel, message):
+			if matcher(channel):
+				fn(channel, redecode(channel, message))
+	return filtered
+
+def _extend_plan(plan, fn_box):
+	fn, slot = _plan_slot(fn_box)
+	plan = list(plan)
+	plan[slot] = plan[slot] + (fn,)
+	return tuple(plan)
+
+def _build_plan(fn_boxes):
+	plan = ([], [], [], [])
+	for fn_box in fn_boxes:
+		fn, slot = _plan_slot(fn_box)
+		plan[slot].append(fn)
+	return tuple(tuple(fns) for fns in plan)
+
+# Messages published with loopback enabled get wrapped in an envelope
+# made of this marker followed by the 8 bytes that identify the
+# Multiplexer that published them.
+_ENVELOPE_MARKER = b"\x00mpx"
+_ENVELOPE_SIZE = len(_ENVELOPE_MARKER) + 8
+
+def _queue_depth(subscriptions):
+	depth = 0
+	for node in subscriptions:
+		queue = getattr(getattr(node, "sub", None), "queue", None)
+		if queue is not None:
+			depth += len(queue.items)
+	return depth
+
+def _check_on_message(on_message, on_messages, queue_size, conflate):
+	if on_message is None and on_messages is None:
+		raise Exception("on_message cannot be None")
+	if on_messages is not None and queue_size is not None:
+		raise Exception("on_messages cannot be used together with queue_size")
+	if conflate is not None and (on_messages is not None or queue_size is not None):
+		raise Exception("conflate cannot be used together with on_messages or queue_size")
 
 class Multiplexer:
 	"""
@@ -30,7 +116,101 @@ class Multiplexer:
 	any exception will be logged as a warning and then discarded.
 
 	If you are making use of Python's type hints, you can import
-	`OnMessage`, `OnDisconnect`, and `OnActivation` from this package.
+	`OnMessage`, `OnMessages`, `OnDisconnect`, `OnActivation` and 
+	`OnActivations` from this package.
+
+	By default the Multiplexer dispatches one frame at a time. Passing
+	`read_batch=N` makes it parse up to N frames already buffered
+	from the socket in one go, grouping the messages of each channel,
+	before yielding back to the event loop. Subscriptions that provide an 
+	`on_messages` callback receive each group with a single call. Groups
+	span everything between two other kinds of frames (like subscription
+	confirmations), so messages keep their order within a channel (or 
+	pattern), but a subscriber of several channels can receive messages
+	of different channels in another order than Redis sent them. Channel
+	groups are dispatched before pattern ones.
+
+	Metrics about messages, dispatch latency, reconnections, 
+	subscriptions and promises are collected in `metrics`, see 
+	:class:`~redismpx.Metrics`. Pass `metrics=False` to disable them,
+	or a Metrics instance to configure them or share them between 
+	several Multiplexers.
+
+	Passing a :class:`~redismpx.CallbackProfiler` as `profiler` times
+	every callback of the subscriptions created from this Multiplexer 
+	and reports the ones that block the event loop for too long.
+
+	:func:`~redismpx.Multiplexer.publish` sends messages through a 
+	:class:`~redismpx.Publisher`, the one passed as `publisher` or one
+	created on first use with the same connection options. Passing 
+	`loopback=True` makes it deliver messages to the subscribers of this
+	Multiplexer right away, without waiting for Redis to send them back.
+	To recognize those messages when they come back, they are sent to 
+	Redis wrapped in a small envelope, which Multiplexers with `loopback`
+	enabled remove before delivery. All the Multiplexers subscribed to 
+	channels that receive such messages must have `loopback` enabled.
+
+	Subscriptions can be owned by other event loops, each running in
+	its own thread, by passing their `loop` when creating them. Their
+	callbacks then run on that loop: the messages of each read batch 
+	are handed over with a single `call_soon_threadsafe` per loop, and 
+	the subscriptions can be changed (e.g. with 
+	:func:`~redismpx.ChannelSubscription.add`) from the loop that owns 
+	them. Everything else must be done from the Multiplexer's loop.
+
+	Messages can be decoded once for all their subscribers by passing a
+	`decoder`, or with :func:`~redismpx.Multiplexer.set_decoder` for 
+	single channels and patterns. Callbacks then receive a 
+	:class:`~redismpx.Payload` in place of bytes. The last 
+	`decode_cache` Payloads are reused when the same message arrives
+	again, like when it matches both a channel and a pattern.
+
+	Passing `zero_copy=True` makes callbacks receive each payload as a 
+	`memoryview` over the data read from the socket instead of a copy
+	in a new `bytes` object. A view is only valid until the callback 
+	returns (for async callbacks, until they complete): subscribers 
+	that need to keep the payload must copy it, e.g. with `bytes(view)`.
+	Delivery queues and promises copy payloads automatically.
+
+	Channel names are interned: the Multiplexer and its subscriptions 
+	share one bytes object per channel, and each channel gets a small 
+	integer id, see :func:`~redismpx.Multiplexer.channel_id`.
+
+	Subscribe and unsubscribe requests are sent once per event loop
+	iteration, merged into as few commands as possible. Passing 
+	`linger=seconds` keeps channels that lose their last subscriber 
+	subscribed for that long, so that adding them back is free.
+
+	After a reconnection, channels and patterns are resubscribed in 
+	chunks of at most `resubscribe_chunk` names (and roughly 
+	`resubscribe_bytes` bytes), sending each chunk once Redis has
+	confirmed the previous one (or `resubscribe_timeout` seconds have 
+	passed). `resubscription` holds a (done, total) progress tuple and 
+	`resubscribed_event` gets set once all chunks have been sent.
+	Reconnection attempts are paced by the object returned by `backoff`,
+	see :class:`~redismpx.Backoff`.
+
+	Writes respect the transport's high and low water marks, which can
+	be set with `write_high_water` and `write_low_water`. When 
+	`write_stall_timeout` is set, a write buffer that doesn't drain 
+	below the low water mark within that many seconds is treated as a
+	dead connection and triggers a reconnection. When `write_buffer_limit`
+	is set, adding channels or patterns while more than that many bytes 
+	are waiting to be written fails immediately with 
+	:class:`~redismpx.WriteStalled`.
+
+	A new pattern covered by a broader `prefix*` pattern that is already 
+	subscribed, like `news.sports.*` when `news.*` is present, doesn't 
+	cost another PSUBSCRIBE: its messages get filtered locally from the 
+	broader pattern's ones. Patterns listed in `umbrella_patterns` 
+	(which must also have the `prefix*` form) act as such a broader 
+	pattern even before anyone subscribes to them, so that all the 
+	patterns they cover are matched locally under a single PSUBSCRIBE.
+
+	Passing `ssubscribe=True` makes the Multiplexer subscribe to channels
+	using Redis 7 sharded Pub/Sub (SSUBSCRIBE). All channels must then
+	belong to slots served by the node it's connected to, see 
+	:class:`~redismpx.ClusterMultiplexer` for automatic routing.
 
 	Usage example:
 
@@ -73,10 +253,95 @@ class Multiplexer:
 
 	"""
 
-	def __init__(self, *args, **kwargs):
+	def __init__(self, *args, read_batch: int = 1, ssubscribe: bool = False,
+		linger: float = 0, resubscribe_chunk: int = 1000, 
+		resubscribe_bytes: int = 64 * 1024, resubscribe_timeout: float = 5,
+		backoff: Callable[[], Backoff] = Backoff, 
+		write_high_water: Optional[int] = None, write_low_water: Optional[int] = None,
+		write_stall_timeout: Optional[float] = None, write_buffer_limit: Optional[int] = None,
+		umbrella_patterns: Iterable[Union[str, bytes]] = (), zero_copy: bool = False,
+		metrics: Union[bool, Metrics] = True, profiler: Optional[CallbackProfiler] = None, 
+		loopback: bool = False, publisher: Optional[Publisher] = None,
+		decoder: Optional[Decoder] = None, decode_cache: int = 64, **kwargs):
+		if read_batch < 1:
+			raise ValueError("read_batch must be at least 1")
 		kwargs["connection_cls"] = Conn
+		if zero_copy:
+			if "parser" in kwargs:
+				raise ValueError("zero_copy cannot be used together with a custom parser")
+			kwargs["parser"] = ViewPubSubParser
+		self.zero_copy = zero_copy
+		self.decoder = decoder
+		self.channel_decoders = {}
+		self.pattern_decoders = {}
+		self.decoding = decoder is not None
+		self.payload_cache = PayloadCache(decode_cache)
+		self.loopback = loopback
+		self.origin = os.urandom(8)
+		self.envelope = _ENVELOPE_MARKER + self.origin
+		self.publisher = publisher
+		self.owns_publisher = publisher is None
+		self.profiler = profiler
+		if profiler is not None:
+			profiler.attach()
+		self.metrics = resolve_metrics(metrics)
+		self.disconnected_at = None
+		self.activation_started = {}
+		self.gauges = ()
+		if self.metrics is not None:
+			self.gauges = (
+				("subscribed_channels", lambda: len(self.channels)),
+				("subscribed_patterns", lambda: len(self.patterns)),
+				("write_buffer_bytes", lambda: self.write_buffer_size),
+				("delivery_queue_depth", lambda: _queue_depth(self.subscriptions)),
+			)
+			for name, fn in self.gauges:
+				self.metrics.add_gauge(name, fn)
+		self.read_batch = read_batch
+		self.resubscribe_chunk = resubscribe_chunk
+		self.resubscribe_bytes = resubscribe_bytes
+		self.resubscribe_timeout = resubscribe_timeout
+		self.resubscriber = None
+		self.resubscription = (0, 0)
+		self.resubscribed_event = asyncio.Event()
+		self.confirmations = 0
+		self.confirm_target = None
+		self.confirmed_event = asyncio.Event()
+		self.backoff = backoff()
+		self.write_limits = (write_high_water, write_low_water)
+		self.write_stall_timeout = write_stall_timeout
+		self.write_buffer_limit = write_buffer_limit
+		self.write_watcher = None
+		self.pattern_trie = PatternTrie()
+		self.umbrella_patterns = set()
+		for pattern in umbrella_patterns:
+			pattern = as_bytes(pattern)
+			if not self.pattern_trie.add(pattern):
+				raise ValueError(f"umbrella patterns must have the form `prefix*`, got {pattern}")
+			self.umbrella_patterns.add(pattern)
+		self.ssubscribe = ssubscribe
+		self.linger = linger
+		self.lingering = {}
+		self.pending_channels = {}
+		self.pending_patterns = {}
+		self.flush_handle = None
+		if ssubscribe:
+			self.subscribe_cmd = b"SSUBSCRIBE"
+			self.unsubscribe_cmd = b"SUNSUBSCRIBE"
+		else:
+			self.subscribe_cmd = b"SUBSCRIBE"
+			self.unsubscribe_cmd = b"UNSUBSCRIBE"
+		# Called with (multiplexer, channel) when Redis Cluster moves one
+		# of our sharded channels away, or with (multiplexer, None) when
+		# Redis replies with a MOVED error.
+		self.on_slot_migration = None
+		# Every channel and pattern maps to the Callbacks subscribed to
+		# it, held in a dict used as an ordered set.
+		self.channel_table = ChannelTable()
 		self.channels = {}
 		self.patterns = {}
+		self.channel_plans = {}
+		self.pattern_plans = {}
 		self.active_channels = set()
 		self.active_patterns = set()
 		self.subscriptions = List(None)
@@ -85,13 +350,24 @@ class Multiplexer:
 		self.must_exit = False
 		self.reconnecting = True
 		self.connected_event = asyncio.Event()
+		self.loop = asyncio.get_event_loop()
+		self.outboxes = {}
+		self.handoffs = []
+		self.handoff_handle = None
 		self.conn_reader = asyncio.create_task(self._read_messages())
 
 	
 	def new_channel_subscription(self, 
 		on_message: OnMessage, 
 		on_disconnect: Optional[OnDisconnect], 
-		on_activation: Optional[OnActivation]) -> ChannelSubscription:
+		on_activation: Optional[OnActivation],
+		*,
+		on_messages: Optional[OnMessages] = None,
+		queue_size: Optional[int] = None,
+		overflow: Overflow = Overflow.BLOCK,
+		loop: Optional[asyncio.AbstractEventLoop] = None,
+		conflate: Optional[float] = None,
+		on_activations: Optional[OnActivations] = None) -> ChannelSubscription:
 		"""
 		Creates a new ChannelSubscription tied to the Multiplexer. 
 
@@ -104,18 +380,32 @@ class Multiplexer:
 		:param on_message: a (async or non) function that gets called for every message recevied.
 		:param on_disconnect: a (async or non) function that gets called when the connection is lost.
 		:param on_activation: a (async or non) function that gets called when a subscription goes into effect.
+		:param on_messages: a (async or non) function that gets called with a channel and a list of messages, used in place of `on_message` when set.
+		:param queue_size: when set, messages get delivered through a bounded queue of this size drained by a dedicated task, so that a slow `on_message` doesn't stall the other subscriptions.
+		:param overflow: what to do when the delivery queue is full, see :class:`~redismpx.Overflow`.
+		:param loop: the event loop that owns the subscription and runs its callbacks, defaults to the Multiplexer's one.
+		:param conflate: when set, only the latest message of each channel gets delivered, at most once every `conflate` seconds and only once `on_message` is done with the previous ones.
+		:param on_activations: a (async or non) function that gets called with a list of channels that went into effect, used in place of `on_activation` when set. :func:`~redismpx.ChannelSubscription.add_many` calls it once with all the channels that were already active.
 		
 		"""
-		if on_message is None:
-			raise Exception("on_message cannot be None")
-		sub = ChannelSubscription(self, on_message, on_disconnect, on_activation)
+		_check_on_message(on_message, on_messages, queue_size, conflate)
+		if on_activation is not None and on_activations is not None:
+			raise Exception("on_activation cannot be used together with on_activations")
+		sub = ChannelSubscription(self, on_message, on_disconnect, on_activation,
+			on_messages, queue_size, overflow, loop, conflate, on_activations)
 		return sub
 
 	def new_pattern_subscription(self, 
 		pattern: Union[str, bytes], 
 		on_message: OnMessage, 
 		on_disconnect: Optional[OnDisconnect], 
-		on_activation: Optional[OnActivation]) -> PatternSubscription:
+		on_activation: Optional[OnActivation],
+		*,
+		on_messages: Optional[OnMessages] = None,
+		queue_size: Optional[int] = None,
+		overflow: Overflow = Overflow.BLOCK,
+		loop: Optional[asyncio.AbstractEventLoop] = None,
+		conflate: Optional[float] = None) -> PatternSubscription:
 		"""
 		Creates a new PatternSubscription tied to the Multiplexer. 
 
@@ -129,14 +419,19 @@ class Multiplexer:
 		:param on_message: a (async or non) function that gets called for every message recevied.
 		:param on_disconnect: a (async or non) function that gets called when the connection is lost.
 		:param on_activation: a (async or non) function that gets called when a subscription goes into effect.
+		:param on_messages: a (async or non) function that gets called with a channel and a list of messages, used in place of `on_message` when set.
+		:param queue_size: when set, messages get delivered through a bounded queue of this size drained by a dedicated task, so that a slow `on_message` doesn't stall the other subscriptions.
+		:param overflow: what to do when the delivery queue is full, see :class:`~redismpx.Overflow`.
+		:param loop: the event loop that owns the subscription and runs its callbacks, defaults to the Multiplexer's one.
+		:param conflate: when set, only the latest message of each channel gets delivered, at most once every `conflate` seconds and only once `on_message` is done with the previous ones.
 		
 		"""
-		if on_message is None:
-			raise Exception("on_message cannot be None")
-		sub = PatternSubscription(self, pattern, on_message, on_disconnect, on_activation)
+		_check_on_message(on_message, on_messages, queue_size, conflate)
+		sub = PatternSubscription(self, pattern, on_message, on_disconnect, on_activation,
+			on_messages, queue_size, overflow, loop, conflate)
 		return sub
 
-	def new_promise_subscription(self, prefix: Union[str, bytes]) -> PromiseSubscription:
+	def new_promise_subscription(self, prefix: Union[str, bytes], *, timer_tick: float = 0.01) -> PromiseSubscription:
 		""" 
 		Creates a new PromiseSubscription tied to the Multiplexer. 
 
@@ -153,17 +448,130 @@ class Multiplexer:
 		Use NewPromise from PromiseSubscription to create a new Promise. 
 
 		:param prefix: the prefix under which all Promises will be created under.
+		:param timer_tick: the resolution, in seconds, of the timer that expires promises.
+		"""
+		return PromiseSubscription(self, prefix, timer_tick)
+
+	async def publish(self, channel: Union[str, bytes], message: Union[str, bytes], *, 
+		ack: bool = False) -> Optional[int]:
+		"""
+		Publishes a message to a Redis Pub/Sub channel. With `loopback` 
+		enabled, the message is first delivered to the matching 
+		subscriptions of this Multiplexer, and it won't be delivered
+		to them again when Redis sends it back.
+
+		:param channel: a Redis Pub/Sub channel
+		:param message: the message, `str` gets encoded as UTF-8
+		:param ack: whether to wait for Redis' reply
+		:return: the number of clients that received the message from Redis, when `ack` is set
+		"""
+		if self.must_exit:
+			raise Exception("tried to use a closed multiplexer")
+		channel = as_bytes(channel)
+		if isinstance(message, str):
+			message = message.encode()
+		if self.publisher is None:
+			args, kwargs = self.connection_options
+			self.publisher = Publisher(*args, sharded=self.ssubscribe, **kwargs)
+		if self.loopback:
+			await self._deliver_locally(channel, message)
+			message = self.envelope + message
+		return await self.publisher.publish(channel, message, ack=ack)
+
+	def set_decoder(self, decoder: Optional[Decoder], *, channel: Union[str, bytes, None] = None,
+		pattern: Union[str, bytes, None] = None) -> None:
+		"""
+		Sets the decoder for the messages of a channel or of a pattern,
+		or the default one when neither is given. For messages received
+		through a pattern, the pattern's decoder comes first, then the 
+		channel's one and then the default one.
+
+		:param decoder: a function that decodes a message, e.g. :func:`~redismpx.json_decoder`, None removes it
+		:param channel: a Redis Pub/Sub channel
+		:param pattern: a Redis Pub/Sub pattern
+		"""
+		if channel is not None and pattern is not None:
+			raise ValueError("set either channel or pattern, not both")
+		if channel is not None:
+			registry, name = self.channel_decoders, as_bytes(channel)
+		elif pattern is not None:
+			registry, name = self.pattern_decoders, as_bytes(pattern)
+		else:
+			self.decoder = decoder
+			registry, name = None, None
+		if registry is not None:
+			if decoder is None:
+				registry.pop(name, None)
+			else:
+				registry[name] = decoder
+		self.decoding = (self.decoder is not None or bool(self.channel_decoders) 
+			or bool(self.pattern_decoders))
+		self.payload_cache.clear()
+
+	def _decode_covered(self, pattern, channel, payloads):
+		# Decoders are looked up by the pattern Redis matched, which is
+		# the cover for patterns served under one, see _filtered.
+		if not self.decoding:
+			return payloads
+		decoder = self.pattern_decoders.get(pattern)
+		if decoder is None:
+			decoder = self.channel_decoders.get(channel, self.decoder)
+		raws = [getattr(payload, "raw", payload) for payload in payloads]
+		if decoder is None:
+			return raws
+		return self.payload_cache.wrap(decoder, raws)
+
+	def channel_id(self, channel: Union[str, bytes]) -> Optional[int]:
 		"""
-		return PromiseSubscription(self, prefix)
+		Returns the id of a channel that has subscribers, or None. Ids 
+		are small integers, unique among the channels of this 
+		Multiplexer, and get reused once a channel has no subscribers.
+
+		:param channel: a Redis Pub/Sub channel
+		"""
+		return self.channel_table.lookup(as_bytes(channel))
+
+	def channel_name(self, channel_id: int) -> bytes:
+		"""
+		Returns the channel with the given id, see :func:`~redismpx.Multiplexer.channel_id`.
+
+		:param channel_id: the id of a channel
+		"""
+		return self.channel_table.name(channel_id)
+
+	@property
+	def write_buffer_size(self) -> int:
+		"""How many bytes are waiting to be written to Redis."""
+		if self.connection is None:
+			return 0
+		return self.connection.buffered_bytes
 
 	def close(self):
 		self.must_exit = True
+		for linger_handle in self.lingering.values():
+			linger_handle.cancel()
+		self.lingering = {}
+		if self.flush_handle is not None:
+			self.flush_handle.cancel()
+		if self.handoff_handle is not None:
+			self.handoff_handle.cancel()
+		for outbox in self.outboxes.values():
+			outbox.close()
+		if self.resubscriber is not None:
+			self.resubscriber.cancel()
+		if self.write_watcher is not None:
+			self.write_watcher.cancel()
 		self.conn_reader.cancel()
 		if self.connection:
 			self.connection.close()
+		for name, fn in self.gauges:
+			self.metrics.remove_gauge(name, fn)
+		self.gauges = ()
+		if self.publisher is not None and self.owns_publisher:
+			self.publisher.close()
 
 	async def _reconnect(self, cause):
-		if self.reconnecting:
+		if self.reconnecting or self.must_exit:
 			return
 		for s in self.subscriptions:
 			if s.on_disconnect is not None:
@@ -177,9 +585,20 @@ class Multiplexer:
 		
 		logging.info(f"redismpx id({id(self)}): reconnecting because of error: {cause}")
 		self.reconnecting = True
+		self.disconnected_at = time.perf_counter()
+		if self.metrics is not None:
+			self.metrics.reconnects += 1
 		self.connected_event.clear()
+		self.resubscribed_event.clear()
 		self.active_channels = set()
 		self.active_patterns = set()
+		self.activation_started = {}
+		if self.resubscriber is not None:
+			self.resubscriber.cancel()
+		if self.write_watcher is not None:
+			# It watches the connection we are about to drop.
+			self.write_watcher.cancel()
+			self.write_watcher = None
 		self.conn_reader.cancel()
 		try:
 			await self.conn_reader
@@ -193,97 +612,318 @@ class Multiplexer:
 		logging.debug("redismpx started _read_messages")
 		args, kwargs = self.connection_options
 		# Keep trying to connect
-		tries = 1
 		while not self.must_exit:
 			try:	
 				self.connection = await aioredis.create_connection(*args, **kwargs)
 				break # DO NOT DELETE THIS LINE LMAO
 			except Exception as e:
-				# Exp backoff + jitter
-				sleep_ms = jitter_exp_backoff(8, 512, tries)
-				await asyncio.sleep(sleep_ms/1000)
-				if tries < 20:
-					tries += 1
+				logging.debug(f"redismpx id({id(self)}): connection attempt failed: {e}")
+				await self.backoff.wait()
 
 		logging.debug("redismpx connected")
+		if self.write_limits != (None, None):
+			self.connection.set_write_limits(*self.write_limits)
+		self.backoff.success()
 		self.reconnecting = False
+		if self.disconnected_at is not None and self.metrics is not None:
+			self.metrics.reconnect_seconds.observe(time.perf_counter() - self.disconnected_at)
+		self.disconnected_at = None
 		self.connected_event.set()
 
-		# Resubscribe to all channels, if any is present.
-		if len(self.channels) > 0:
-			logging.debug("redismpx resubscribing %s", self.channels.keys())
-			self.connection.write_command(b"SUBSCRIBE", *self.channels.keys())
-
-		# Resubscribe to all patterns, if any is present.
-		if len(self.patterns) > 0:
-			logging.debug("redismpx resubscribing %s", self.patterns.keys())
-			self.connection.write_command(b"PSUBSCRIBE", *self.patterns.keys())
+		# Whatever was waiting to be sent is covered by resubscribing.
+		self.pending_channels = {}
+		self.pending_patterns = {}
+		self.resubscriber = asyncio.create_task(
+			self._resubscribe(list(self.channels), list(self.patterns)))
 
 		try:
-			async for msg in self.connection.read_message():
-				if msg[0] == b"message":
-					ch_name = msg[1]
-					if ch_name in self.channels:
-						for fn_box in self.channels[ch_name]:
-							try:
-								if asyncio.iscoroutinefunction(fn_box.on_message):
-									await fn_box.on_message(ch_name, msg[2])
-								else:
-									fn_box.on_message(ch_name, msg[2])
-							except Exception as e:
-								logging.warning(f"redismpx id({id(self)}): on_message function threw exception: {e}")
-					continue
+			async for batch in self.connection.read_batches(self.read_batch):
+				await self._process_batch(batch)
+		except Exception as e:
+			if not self.must_exit:
+				asyncio.create_task(self._reconnect(e))
 
-				if msg[0] == b"pmessage":
-					pat_name = msg[1]
-					if pat_name in self.patterns:
-						for fn_box in self.patterns[pat_name]:
-							try:
-								if asyncio.iscoroutinefunction(fn_box.on_message):
-									await fn_box.on_message(msg[2], msg[3])
-								else:
-									fn_box.on_message(msg[2], msg[3])
-							except Exception as e:
-								logging.warning(f"redismpx id({id(self)}): on_message function threw exception: {e}")
-					continue
+	async def _resubscribe(self, channels, patterns):
+		# Resubscribing in bounded chunks, each one waiting for the 
+		# previous to be confirmed, avoids sending Redis one huge command
+		# and then getting back a burst of replies for all our channels.
+		total = len(channels) + len(patterns)
+		done = 0
+		self.resubscription = (done, total)
+		if total > 0:
+			logging.debug(f"redismpx id({id(self)}): resubscribing to {total} channels and patterns")
+
+		for command, registry, names in (
+			(self.subscribe_cmd, self.channels, channels), 
+			(b"PSUBSCRIBE", self.patterns, patterns)):
+			for chunk in self._chunks(names):
+				# Skip what got removed in the meantime.
+				chunk = [name for name in chunk if name in registry]
+				if chunk:
+					self.confirm_target = self.confirmations + len(chunk)
+					self.confirmed_event.clear()
+					self._start_activation(chunk)
+					if registry is self.patterns:
+						self.connection.write_command(command, *chunk)
+					else:
+						self._write_channels_command(command, chunk)
+					try:
+						await self.connection.drain(self.write_stall_timeout)
+					except asyncio.CancelledError:
+						raise
+					except Exception as e:
+						logging.warning(f"redismpx id({id(self)}): resubscription failed: {e}")
+						asyncio.create_task(self._reconnect(e))
+						return
+					try:
+						await asyncio.wait_for(self.confirmed_event.wait(), self.resubscribe_timeout)
+					except asyncio.TimeoutError:
+						logging.warning(f"redismpx id({id(self)}): resubscription chunk not confirmed in time")
+					self.confirm_target = None
+				done += len(chunk)
+				self.resubscription = (done, total)
+
+		self.resubscribed_event.set()
+
+	def _chunks(self, names):
+		chunk = []
+		size = 0
+		for name in names:
+			chunk.append(name)
+			size += len(name)
+			if len(chunk) >= self.resubscribe_chunk or size >= self.resubscribe_bytes:
+				yield chunk
+				chunk = []
+				size = 0
+		if chunk:
+			yield chunk
+
+	async def _process_batch(self, batch):
+		if self.loopback:
+			batch = self._open_envelopes(batch)
+		# Messages get grouped by channel (and by pattern for pmessages)
+		# so that on_messages callbacks see them all at once, which only
+		# preserves their order within each channel. Groups are flushed
+		# before any other kind of frame to preserve the order of 
+		# activation events.
+		channel_groups = {}
+		pattern_groups = {}
+		for msg in batch:
+			kind = msg[0]
+			if kind == MESSAGE:
+				payloads = channel_groups.get(msg[1])
+				if payloads is None:
+					channel_groups[msg[1]] = [msg[2]]
+				else:
+					payloads.append(msg[2])
+				continue
 
-				# SUBSCRIPTIONS 
-				if msg[0] == b'subscribe':
-					ch_name = msg[1]
-					self.active_channels.add(ch_name)
-					if ch_name in self.channels:
-						for fn_box in self.channels[ch_name]:
-							if fn_box.on_activation is None:
-								continue
-							try:
-								if asyncio.iscoroutinefunction(fn_box.on_activation):
-									await fn_box.on_activation(ch_name)
-								else:
-									fn_box.on_activation(ch_name)
-							except Exception as e:
-								logging.warning(f"redismpx id({id(self)}): on_activation function threw exception: {e}")
+			if kind == PMESSAGE:
+				key = (msg[1], msg[2])
+				payloads = pattern_groups.get(key)
+				if payloads is None:
+					pattern_groups[key] = [msg[3]]
+				else:
+					payloads.append(msg[3])
+				continue
+
+			if channel_groups or pattern_groups:
+				await self._dispatch_groups(channel_groups, pattern_groups)
+				channel_groups = {}
+				pattern_groups = {}
+			await self._process_control(msg)
+
+		if channel_groups or pattern_groups:
+			await self._dispatch_groups(channel_groups, pattern_groups)
+		if self.handoffs:
+			self._flush_handoffs()
+
+	def _open_envelopes(self, batch):
+		# Drops our own messages, which were delivered when published,
+		# and unwraps the ones published by other Multiplexers.
+		frames = []
+		for msg in batch:
+			kind = msg[0]
+			if kind == MESSAGE or kind == PMESSAGE:
+				payload = msg[-1]
+				if payload is not None and payload[:len(_ENVELOPE_MARKER)] == _ENVELOPE_MARKER:
+					if payload[len(_ENVELOPE_MARKER):_ENVELOPE_SIZE] == self.origin:
+						continue
+					msg = msg[:-1] + (payload[_ENVELOPE_SIZE:],)
+			frames.append(msg)
+		return frames
+
+	async def _deliver_locally(self, channel, message):
+		channel_groups = {}
+		if channel in self.channel_plans:
+			channel_groups[channel] = [message]
+		pattern_groups = {}
+		for pattern in self.pattern_plans:
+			if compile_glob(pattern)(channel):
+				pattern_groups[(pattern, channel)] = [message]
+		if channel_groups or pattern_groups:
+			await self._dispatch_groups(channel_groups, pattern_groups)
+		if self.handoffs:
+			self._flush_handoffs()
+
+	async def _dispatch_groups(self, channel_groups, pattern_groups):
+		metrics = self.metrics
+		for ch_name, payloads in channel_groups.items():
+			plan = self.channel_plans.get(ch_name)
+			if plan is None:
+				continue
+			if self.decoding:
+				decoder = self.channel_decoders.get(ch_name, self.decoder)
+				if decoder is not None:
+					payloads = self.payload_cache.wrap(decoder, payloads)
+			if metrics is not None:
+				stats = metrics.channels.get(ch_name)
+				if stats is None:
+					stats = metrics.new_stats(metrics.channels, self.channel_table.canonical(ch_name))
+				count = len(payloads)
+				stats[0] += count
+				stats[1] += len(payloads[0]) if count == 1 else sum(map(len, payloads))
+				stats[2] += count * (len(plan[0]) + len(plan[1])) + len(plan[2]) + len(plan[3])
+				metrics.countdown -= 1
+				if metrics.countdown <= 0:
+					await self._timed_dispatch(metrics, plan, ch_name, payloads)
 					continue
+			await self._dispatch(plan, ch_name, payloads)
 
-				if msg[0] == b'psubscribe':
-					pat_name = msg[1]
-					self.active_channels.add(pat_name)
-
-					if pat_name in self.patterns:
-						for fn_box in self.patterns[pat_name]:
-							if fn_box.on_activation is None:
-								continue
-
-							try:
-								if asyncio.iscoroutinefunction(fn_box.on_activation):
-									await fn_box.on_activation(pat_name)
-								else:
-									fn_box.on_activation(pat_name)
-							except Exception as e:
-								logging.warning(f"redismpx id({id(self)}): on_activation function threw exception: {e}")
+		for (pat_name, ch_name), payloads in pattern_groups.items():
+			plan = self.pattern_plans.get(pat_name)
+			if plan is None:
+				continue
+			if self.decoding:
+				decoder = self.pattern_decoders.get(pat_name)
+				if decoder is None:
+					decoder = self.channel_decoders.get(ch_name, self.decoder)
+				if decoder is not None:
+					payloads = self.payload_cache.wrap(decoder, payloads)
+			if metrics is not None:
+				stats = metrics.patterns.get(pat_name)
+				if stats is None:
+					stats = metrics.new_stats(metrics.patterns, pat_name)
+				count = len(payloads)
+				stats[0] += count
+				stats[1] += len(payloads[0]) if count == 1 else sum(map(len, payloads))
+				stats[2] += count * (len(plan[0]) + len(plan[1])) + len(plan[2]) + len(plan[3])
+				metrics.countdown -= 1
+				if metrics.countdown <= 0:
+					await self._timed_dispatch(metrics, plan, ch_name, payloads)
 					continue
-		except Exception as e:
-			if not self.must_exit:
-				asyncio.create_task(self._reconnect(e))
+			await self._dispatch(plan, ch_name, payloads)
+
+	async def _timed_dispatch(self, metrics, plan, ch_name, payloads):
+		metrics.countdown = metrics.sample_every
+		start = time.perf_counter()
+		await self._dispatch(plan, ch_name, payloads)
+		metrics.dispatch_seconds.observe((time.perf_counter() - start) / len(payloads))
+		metrics.fanout.observe(len(plan[0]) + len(plan[1]) + len(plan[2]) + len(plan[3]))
+
+	async def _dispatch(self, plan, ch_name, payloads):
+		sync_fns, async_fns, sync_batch_fns, async_batch_fns = plan
+		for payload in payloads:
+			for fn in sync_fns:
+				try:
+					fn(ch_name, payload)
+				except Exception as e:
+					logging.warning(f"redismpx id({id(self)}): on_message function threw exception: {e}")
+			for fn in async_fns:
+				try:
+					await fn(ch_name, payload)
+				except Exception as e:
+					logging.warning(f"redismpx id({id(self)}): on_message function threw exception: {e}")
+
+		for fn in sync_batch_fns:
+			try:
+				fn(ch_name, payloads)
+			except Exception as e:
+				logging.warning(f"redismpx id({id(self)}): on_messages function threw exception: {e}")
+		for fn in async_batch_fns:
+			try:
+				await fn(ch_name, payloads)
+			except Exception as e:
+				logging.warning(f"redismpx id({id(self)}): on_messages function threw exception: {e}")
+
+	async def _process_control(self, msg):
+		kind = msg[0]
+		if kind == SUBSCRIBE:
+			self._confirm()
+			ch_name = self.channel_table.canonical(msg[1])
+			self._end_activation(ch_name)
+			self.active_channels.add(ch_name)
+			if ch_name in self.channels:
+				for fn_box in self.channels[ch_name]:
+					if fn_box.on_activation is None:
+						continue
+					try:
+						if asyncio.iscoroutinefunction(fn_box.on_activation):
+							await fn_box.on_activation(ch_name)
+						else:
+							fn_box.on_activation(ch_name)
+					except Exception as e:
+						logging.warning(f"redismpx id({id(self)}): on_activation function threw exception: {e}")
+			return
+
+		if kind == PSUBSCRIBE:
+			self._confirm()
+			pat_name = msg[1]
+			self._end_activation(pat_name)
+			self.active_patterns.add(pat_name)
+
+			if pat_name in self.patterns:
+				for fn_box in self.patterns[pat_name]:
+					if fn_box.on_activation is None:
+						continue
+
+					try:
+						if asyncio.iscoroutinefunction(fn_box.on_activation):
+							await fn_box.on_activation(fn_box.pattern)
+						else:
+							fn_box.on_activation(fn_box.pattern)
+					except Exception as e:
+						logging.warning(f"redismpx id({id(self)}): on_activation function threw exception: {e}")
+			return
+
+		if kind == SUNSUBSCRIBE:
+			# If we still want the channel, Redis Cluster is telling us
+			# that its slot got migrated to another node.
+			ch_name = msg[1]
+			if ch_name in self.channels:
+				self.active_channels.discard(ch_name)
+				if self.on_slot_migration is not None:
+					self.on_slot_migration(self, ch_name)
+			return
+
+		if kind == ERROR:
+			# One error answers a whole command, so a resubscription
+			# chunk that fails won't get confirmed name by name.
+			if self.confirm_target is not None:
+				self.confirmed_event.set()
+			error = msg[1]
+			if str(error).startswith("MOVED") and self.on_slot_migration is not None:
+				self.on_slot_migration(self, None)
+			else:
+				logging.warning(f"redismpx id({id(self)}): Redis replied with an error: {error}")
+			return
+
+	def _start_activation(self, names):
+		if self.metrics is None:
+			return
+		now = time.perf_counter()
+		for name in names:
+			self.activation_started[name] = now
+
+	def _end_activation(self, name):
+		started = self.activation_started.pop(name, None)
+		if started is not None:
+			self.metrics.activation_seconds.observe(time.perf_counter() - started)
+
+	def _confirm(self):
+		self.confirmations += 1
+		if self.confirm_target is not None and self.confirmations >= self.confirm_target:
+			self.confirmed_event.set()
 
 	async def _log_exeptions(self, callback, *args, **kwargs):
 		try:
@@ -294,71 +934,294 @@ class Multiplexer:
 		except Exception as e:
 			logging.warning(f"redismpx id({id(self)}): on_disconnect function threw exception: {e}")
 
-	def _add_channel(self, channel, fn_box):
+	def _outbox(self, loop):
+		if loop is None or loop is self.loop:
+			return None
+		outbox = self.outboxes.get(loop)
+		if outbox is None:
+			# Might run in the thread of `loop`, setdefault keeps it atomic.
+			outbox = self.outboxes.setdefault(loop, LoopOutbox(self, loop))
+		return outbox
+
+	def _schedule_handoff(self, outbox):
+		if outbox in self.handoffs:
+			return
+		self.handoffs.append(outbox)
+		if self.handoff_handle is None:
+			self.handoff_handle = self.loop.call_soon(self._flush_handoffs)
+
+	def _flush_handoffs(self):
+		if self.handoff_handle is not None:
+			self.handoff_handle.cancel()
+			self.handoff_handle = None
+		handoffs, self.handoffs = self.handoffs, []
+		for outbox in handoffs:
+			outbox.flush()
+
+	def _call(self, fn, *args):
+		# Subscriptions owned by other loops change the Multiplexer 
+		# from their own thread, so the change has to be moved to ours.
+		try:
+			in_loop = asyncio.get_running_loop() is self.loop
+		except RuntimeError:
+			in_loop = False
+		if in_loop:
+			fn(*args)
+		else:
+			self.loop.call_soon_threadsafe(self._call_logged, fn, *args)
+
+	def _call_logged(self, fn, *args):
+		try:
+			fn(*args)
+		except Exception as e:
+			logging.warning(f"redismpx id({id(self)}): subscription change failed: {e}")
+
+	def _canonical_channel(self, channel):
+		# Lets subscriptions share the Multiplexer's copy of the name.
+		# Subscriptions call it from their own thread, which is fine as
+		# long as ChannelTable.canonical stays a single dict lookup.
+		return self.channel_table.canonical(channel)
+
+	def _add_channels(self, channels, fn_box):
+		# Fail before changing anything, so that the subscription's
+		# channels stay in sync with ours.
+		self._check_write_limits(channels)
+		# Channels that are already active get reported all at once.
+		active = []
+		for channel in channels:
+			self._add_channel(channel, fn_box, active)
+		if not active:
+			return
+		if fn_box.on_activations is not None:
+			asyncio.create_task(self._log_exeptions(fn_box.on_activations, active))
+		elif fn_box.on_activation is not None:
+			for channel in active:
+				asyncio.create_task(self._log_exeptions(fn_box.on_activation, channel))
+
+	def _remove_channels(self, channels, fn_box):
+		for channel in channels:
+			self._remove_channel(channel, fn_box)
+
+	def _replace_channels(self, removed, added, fn_box):
+		self._check_write_limits(added)
+		self._remove_channels(removed, fn_box)
+		self._add_channels(added, fn_box)
+
+	def _add_channel(self, channel, fn_box, active=None):
 		if self.must_exit:
 			raise Exception("tried to use a closed multiplexer")
+		self._check_write_limit()
 
 		# Are we already subscribed inside the multiplexer?
 		if channel not in self.channels:
-			try:
-				if self.connection is not None:
-					self.connection.write_command(b"SUBSCRIBE", channel)
-			except Exception as e:
-				asyncio.create_task(self._reconnect(e))
-			self.channels[channel] = List(fn_box)
+			self.channel_table.intern(channel)
+			self.channels[channel] = {fn_box: None}
+			self.channel_plans[channel] = _extend_plan(_EMPTY_PLAN, fn_box)
+			if not self._queue_change(self.pending_channels, channel, True):
+				# We cancelled an UNSUBSCRIBE that never left, so the
+				# subscription might still be active.
+				if channel in self.active_channels:
+					self._report_active(channel, fn_box, active)
 		else:
+			linger_handle = self.lingering.pop(channel, None)
+			if linger_handle is not None:
+				linger_handle.cancel()
+
 			# We are already subscribed, check if the sub is active
 			# if so, we immediately trigger on_activation
 			if channel in self.active_channels:
-				if fn_box.on_activation is not None:
-					asyncio.create_task(self._log_exeptions(fn_box.on_activation, channel))
-			self.channels[channel].prepend(fn_box)
+				self._report_active(channel, fn_box, active)
+			self.channels[channel][fn_box] = None
+			self.channel_plans[channel] = _extend_plan(self.channel_plans[channel], fn_box)
+
+	def _report_active(self, channel, fn_box, active):
+		if active is not None:
+			active.append(channel)
+		elif fn_box.on_activation is not None:
+			asyncio.create_task(self._log_exeptions(fn_box.on_activation, channel))
 
 	def _remove_channel(self, channel, fn_box):
 		if self.must_exit:
 			raise Exception("tried to use a closed multiplexer")
 
-		fn_box_list = fn_box.remove_from_list()
-		if fn_box_list.is_empty():
-			del self.channels[channel]
-			self.active_channels.remove(channel)
-			try:
-				if self.connection is not None:
-					self.connection.write_command(b"UNSUBSCRIBE", channel)
-			except Exception as e:
-				asyncio.create_task(self._reconnect(e))
+		fn_boxes = self.channels[channel]
+		del fn_boxes[fn_box]
+		if not fn_boxes:
+			if self.linger > 0:
+				# Keep the channel subscribed for a while in case
+				# somebody else wants it back soon.
+				self.channel_plans[channel] = _EMPTY_PLAN
+				self.lingering[channel] = asyncio.get_event_loop().call_later(
+					self.linger, self._expire_channel, channel)
+			else:
+				self._drop_channel(channel)
+		else:
+			self.channel_plans[channel] = _build_plan(fn_boxes)
+
+	def _expire_channel(self, channel):
+		del self.lingering[channel]
+		if not self.must_exit:
+			self._drop_channel(channel)
 
+	def _drop_channel(self, channel):
+		self.channel_table.release(channel)
+		del self.channels[channel]
+		del self.channel_plans[channel]
+		if self.metrics is not None:
+			self.metrics.forget(self.metrics.channels, channel)
+		self._queue_change(self.pending_channels, channel, False)
 
 	def _add_pattern(self, pattern, fn_box):
 		if self.must_exit:
 			raise Exception("tried to use a closed multiplexer")
+		self._check_write_limit()
+		self._attach_pattern(pattern, fn_box)
 
-		# Are we already subscribed inside the multiplexer?
+	def _attach_pattern(self, pattern, fn_box):
+		# Patterns covered by a broader one that we are (or must be, in 
+		# the case of umbrella patterns) subscribed to get served by 
+		# filtering the broader pattern's messages locally.
+		fn_box.pattern = pattern
+		fn_box.matcher = None
+		fn_box.decode = None
+		server_pattern = pattern
 		if pattern not in self.patterns:
-			try:
-				if self.connection is not None:
-					self.connection.write_command(b"PSUBSCRIBE", pattern)
-			except Exception as e:
-				asyncio.create_task(self._reconnect(e))
-			self.patterns[pattern] = List(fn_box)
+			cover = self.pattern_trie.find_cover(pattern)
+			if cover is not None:
+				server_pattern = cover
+				fn_box.matcher = compile_glob(pattern)
+				fn_box.decode = self._decode_covered
+		fn_box.server_pattern = server_pattern
+
+		# Are we already subscribed inside the multiplexer?
+		if server_pattern not in self.patterns:
+			self.patterns[server_pattern] = {fn_box: None}
+			self.pattern_plans[server_pattern] = _extend_plan(_EMPTY_PLAN, fn_box)
+			self.pattern_trie.add(server_pattern)
+			if not self._queue_change(self.pending_patterns, server_pattern, True):
+				if server_pattern in self.active_patterns and fn_box.on_activation is not None:
+					asyncio.create_task(self._log_exeptions(fn_box.on_activation, pattern))
 		else:
 			# We are already subscribed, check if the sub is active
 			# if so, we immediately trigger on_activation
-			if pattern in self.active_patterns:
+			if server_pattern in self.active_patterns:
 				if fn_box.on_activation is not None:
 					asyncio.create_task(self._log_exeptions(fn_box.on_activation, pattern))
-			self.patterns[pattern].prepend(fn_box)
+			self.patterns[server_pattern][fn_box] = None
+			self.pattern_plans[server_pattern] = _extend_plan(self.pattern_plans[server_pattern], fn_box)
 
 	def _remove_pattern(self, pattern, fn_box):
 		if self.must_exit:
 			raise Exception("tried to use a closed multiplexer")
 
-		fn_box_list = fn_box.remove_from_list()
-		if fn_box_list.is_empty():
-			del self.patterns[pattern]
-			self.active_patterns.remove(pattern)
-			try:
-				if self.connection is not None:
-					self.connection.write_command(b"PUNSUBSCRIBE", pattern)
-			except Exception as e:
-				asyncio.create_task(self._reconnect(e))
+		server_pattern = fn_box.server_pattern
+		fn_boxes = self.patterns[server_pattern]
+		del fn_boxes[fn_box]
+		uncovered = ()
+		if fn_box.matcher is None and server_pattern not in self.umbrella_patterns and \
+				all(box.matcher is not None for box in fn_boxes):
+			# Nobody subscribes to the cover itself anymore, the patterns
+			# it served get their own PSUBSCRIBE (or a narrower cover).
+			uncovered = list(fn_boxes)
+			fn_boxes.clear()
+		if not fn_boxes:
+			del self.patterns[server_pattern]
+			del self.pattern_plans[server_pattern]
+			if server_pattern not in self.umbrella_patterns:
+				self.pattern_trie.remove(server_pattern)
+			if self.metrics is not None:
+				self.metrics.forget(self.metrics.patterns, server_pattern)
+			self._queue_change(self.pending_patterns, server_pattern, False)
+		else:
+			self.pattern_plans[server_pattern] = _build_plan(fn_boxes)
+		# Broader patterns go first so that they can cover the others.
+		for box in sorted(uncovered, key=lambda box: len(box.pattern)):
+			self._attach_pattern(box.pattern, box)
+
+	def _queue_change(self, pending, name, subscribe):
+		# Changes are sent once per loop tick. A change that reverts
+		# one still waiting to be sent just cancels it.
+		if pending.get(name, subscribe) != subscribe:
+			del pending[name]
+			return False
+		pending[name] = subscribe
+		if self.flush_handle is None:
+			self.flush_handle = asyncio.get_event_loop().call_soon(self._flush_changes)
+		return True
+
+	def _flush_changes(self):
+		self.flush_handle = None
+		if self.connection is None:
+			# Resubscribing after connecting will take care of it.
+			return
+
+		subscribe = [ch for ch, sub in self.pending_channels.items() if sub]
+		unsubscribe = [ch for ch, sub in self.pending_channels.items() if not sub]
+		psubscribe = [p for p, sub in self.pending_patterns.items() if sub]
+		punsubscribe = [p for p, sub in self.pending_patterns.items() if not sub]
+		self.pending_channels = {}
+		self.pending_patterns = {}
+
+		self.active_channels.difference_update(unsubscribe)
+		self.active_patterns.difference_update(punsubscribe)
+		if self.activation_started:
+			for name in unsubscribe + punsubscribe:
+				self.activation_started.pop(name, None)
+		self._start_activation(subscribe)
+		self._start_activation(psubscribe)
+		try:
+			if subscribe:
+				self._write_channels_command(self.subscribe_cmd, subscribe)
+			if unsubscribe:
+				self._write_channels_command(self.unsubscribe_cmd, unsubscribe)
+			if psubscribe:
+				self.connection.write_command(b"PSUBSCRIBE", *psubscribe)
+			if punsubscribe:
+				self.connection.write_command(b"PUNSUBSCRIBE", *punsubscribe)
+		except Exception as e:
+			asyncio.create_task(self._reconnect(e))
+			return
+		self._check_write_buffer()
+
+	def _check_write_buffer(self):
+		if self.write_stall_timeout is None or self.write_watcher is not None:
+			return
+		low, high = self.connection.write_limits
+		if self.connection.buffered_bytes > high:
+			self.write_watcher = asyncio.create_task(self._watch_writes())
+
+	async def _watch_writes(self):
+		try:
+			await self.connection.drain(self.write_stall_timeout)
+		except asyncio.CancelledError:
+			raise
+		except WriteStalled as e:
+			logging.warning(f"redismpx id({id(self)}): write buffer stalled: {e}")
+			asyncio.create_task(self._reconnect(e))
+		except Exception as e:
+			logging.warning(f"redismpx id({id(self)}): waiting for the write buffer failed: {e}")
+			asyncio.create_task(self._reconnect(e))
+		finally:
+			if self.write_watcher is asyncio.current_task():
+				self.write_watcher = None
+
+	def _check_write_limits(self, channels):
+		self._check_write_limit()
+
+	def _check_write_limit(self):
+		if self.write_buffer_limit is None or self.connection is None:
+			return
+		if self.connection.buffered_bytes > self.write_buffer_limit:
+			raise WriteStalled(
+				f"{self.connection.buffered_bytes} bytes waiting to be written to Redis")
+
+	def _write_channels_command(self, command, channels):
+		if self.ssubscribe:
+			# Sharded Pub/Sub commands can't mix channels from different slots.
+			by_slot = {}
+			for ch in channels:
+				by_slot.setdefault(key_slot(ch), []).append(ch)
+			for group in by_slot.values():
+				self.connection.write_command(command, *group)
+		else:
+			self.connection.write_command(command, *channels)
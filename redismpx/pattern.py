@@ -1,6 +1,8 @@
+import asyncio
 from typing import Union
 from .utils import as_bytes, SubscriptionIsClosed
-from .internal import ListNode
+from .internal import ListNode, Callbacks
+from .delivery import DeliveryQueue, ConflatingQueue, Overflow
 
 class PatternSubscription:
 	"""
@@ -22,27 +24,75 @@ class PatternSubscription:
 		# Once created, a PatternSubscription can only be closed.
 		pattern_sub.close()
 
+	A PatternSubscription created with a `loop` must only be used from
+	that loop.
 	"""
-	def __init__(self, multiplexer, pattern, on_message, on_disconnect, on_activation):
+	def __init__(self, multiplexer, pattern, on_message, on_disconnect, on_activation,
+		on_messages=None, queue_size=None, overflow=Overflow.BLOCK, loop=None, conflate=None):
 		pattern = as_bytes(pattern)
+		profiler = getattr(multiplexer, "profiler", None)
+		if profiler is not None:
+			on_message = profiler.wrap(on_message, "on_message", self)
+			on_messages = profiler.wrap(on_messages, "on_messages", self)
+			on_disconnect = profiler.wrap(on_disconnect, "on_disconnect", self)
+			on_activation = profiler.wrap(on_activation, "on_activation", self)
 
 		self.channels = {}
 		self.mpx = multiplexer
 		self.pattern = pattern
-		self.fn_box =  ListNode(on_message=on_message, on_activation=on_activation)
+		self.queue = None
+		if queue_size is not None:
+			self.queue = DeliveryQueue(on_message, queue_size, overflow, self._on_overflow)
+			on_message = self.queue.put
+		elif conflate is not None:
+			self.queue = ConflatingQueue(on_message, conflate)
+			on_message = self.queue.put
 		self.on_disconnect = on_disconnect
 		self.on_activation = on_activation
+		self.loop = loop
+		outbox = self.mpx._outbox(loop)
+		if outbox is not None:
+			if on_messages is not None:
+				on_messages = outbox.wrap(on_messages, "on_messages")
+			else:
+				on_messages = outbox.wrap(on_message, "on_message")
+			on_message = None
+			on_activation = outbox.wrap(on_activation, "on_activation")
+			on_disconnect = outbox.wrap(on_disconnect, "on_disconnect")
+		self.fn_box = Callbacks(on_message, on_messages, on_activation)
 		self.closed = False
-		self.subNode = ListNode(on_disconnect=on_disconnect)
+		self.subNode = ListNode(on_disconnect=on_disconnect, sub=self)
+		try:
+			# Only raises when called from the Multiplexer's loop, 
+			# otherwise errors get logged.
+			self.mpx._call(self._subscribe)
+		except Exception:
+			if self.queue is not None:
+				self.queue.close()
+			raise
+
+	def _subscribe(self):
+		self.mpx._add_pattern(self.pattern, self.fn_box)
 		self.mpx.subscriptions.prepend(self.subNode)
-		self.mpx._add_pattern(pattern, self.fn_box)
 
 	def close(self) -> None:
 		"""Closes the subscription."""
 		if self.closed:
 			raise SubscriptionIsClosed("tried to use a closed PatternSubscription")
 			
+		self.mpx._call(self._unsubscribe)
+		self.closed = True
+		if self.queue is not None:
+			self.queue.close()
+
+	def _unsubscribe(self):
 		self.mpx._remove_pattern(self.pattern, self.fn_box)
 		self.subNode.remove_from_list()
-		self.closed = True
+
+	def _on_overflow(self, error):
+		if self.closed:
+			return
+		self.close()
+		if self.on_disconnect is not None:
+			asyncio.create_task(self.mpx._log_exeptions(self.on_disconnect, error))
 
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import sys
+import threading
+import traceback
+import types
+from collections import deque
+from time import perf_counter
+from typing import Callable, Optional
+
+class SlowCallback:
+	"""
+	Describes a callback invocation that took longer than the threshold
+	of a :class:`~redismpx.CallbackProfiler`.
+
+	`duration` is the wall time of the call, while `running` is the time
+	the callback actually spent running on the event loop, which for
+	async callbacks excludes the time spent awaiting. `stack` is the
+	formatted stack of the event loop thread, captured while the callback
+	was still running, or None if the call returned before the watchdog
+	thread could look at it.
+	"""
+
+	def __init__(self, kind, callback, subscription, channel, duration, running, stack):
+		self.kind = kind
+		self.callback = callback
+		self.subscription = subscription
+		self.channel = channel
+		self.duration = duration
+		self.running = running
+		self.stack = stack
+
+	def __repr__(self):
+		return (f"<SlowCallback {self.kind} {_name(self.callback)} channel={self.channel!r} "
+			f"duration={self.duration * 1000:.1f}ms running={self.running * 1000:.1f}ms>")
+
+class CallbackProfiler:
+	"""
+	Times the `on_message`, `on_messages`, `on_activation` and
+	`on_disconnect` callbacks of the subscriptions created by the
+	Multiplexers it's passed to, to find the ones that block the event loop.
+
+	Every call that takes `threshold` seconds or longer is reported to
+	`on_slow` (which by default logs a warning) together with its
+	subscription, its channel and the stack of the event loop thread.
+	The stack gets captured by a watchdog thread while the call is still
+	running, so it shows where the callback is stuck rather than where it
+	returned from. The last `keep` reports are also kept in `slow_calls`.
+
+	When `sample_interval` is set, the watchdog thread also looks at which
+	callback is running every `sample_interval` seconds and accumulates
+	the time spent in each one, see :func:`~redismpx.CallbackProfiler.breakdown`.
+
+	Profiling is off unless a profiler is passed to the Multiplexer, in
+	which case only the callbacks of subscriptions created from then on
+	get timed. A single CallbackProfiler can be shared by several
+	Multiplexers running on the same event loop thread.
+
+	Usage example:
+
+	.. highlight:: python
+
+    .. code-block:: python
+
+		profiler = CallbackProfiler(threshold=0.05, sample_interval=0.001)
+		mpx = Multiplexer('redis://localhost', profiler=profiler)
+
+		# Later on, find out where the event loop time goes.
+		for entry in profiler.breakdown()[:10]:
+			print(entry["kind"], entry["callback"], entry["share"])
+	"""
+
+	def __init__(self, threshold: Optional[float] = 0.1,
+		on_slow: Optional[Callable[[SlowCallback], None]] = None,
+		sample_interval: Optional[float] = None, stack_limit: int = 32, keep: int = 100):
+		if threshold is not None and threshold <= 0:
+			raise ValueError("threshold must be positive")
+		if sample_interval is not None and sample_interval <= 0:
+			raise ValueError("sample_interval must be positive")
+		self.threshold = threshold
+		self.on_slow = on_slow if on_slow is not None else _log_slow_callback
+		self.sample_interval = sample_interval
+		self.stack_limit = stack_limit
+		self.slow_calls = deque(maxlen=keep)
+		# The callback running right now, as a (step_started, call) tuple
+		# where `call` is the list built by wrap. Only the event loop
+		# thread sets it, the watchdog thread only reads it.
+		self.current = None
+		self.sampled_seconds = 0
+		self.samples = {}
+		self.lock = threading.Lock()
+		self.thread_id = None
+		self.watchdog = None
+		self.stopped = threading.Event()
+
+	def wrap(self, fn: Optional[Callable], kind: str, subscription) -> Optional[Callable]:
+		"""
+		Returns a function that calls `fn` and times it. Called by
+		subscriptions on their callbacks, `kind` is the name of the
+		callback (e.g. "on_message").
+		"""
+		if fn is None:
+			return None
+		key = (kind, _name(fn), _describe(subscription))
+		with_channel = kind != "on_disconnect"
+		profiler = self
+
+		if asyncio.iscoroutinefunction(fn):
+			async def profiled(*args):
+				call = [kind, fn, subscription, args[0] if with_channel else None, None, key]
+				started = perf_counter()
+				running = [0]
+				try:
+					return await _steps(profiler, fn(*args), call, running)
+				finally:
+					profiler._finish(call, perf_counter() - started, running[0])
+		else:
+			def profiled(*args):
+				call = [kind, fn, subscription, args[0] if with_channel else None, None, key]
+				previous = profiler.current
+				started = perf_counter()
+				profiler.current = (started, call)
+				try:
+					return fn(*args)
+				finally:
+					profiler.current = previous
+					duration = perf_counter() - started
+					profiler._finish(call, duration, duration)
+		return profiled
+
+	def attach(self) -> None:
+		"""
+		Called by the Multiplexers that use this profiler, from the
+		event loop thread, to start the watchdog thread.
+		"""
+		self.thread_id = threading.get_ident()
+		if self.watchdog is not None or (self.threshold is None and self.sample_interval is None):
+			return
+		self.stopped.clear()
+		self.watchdog = threading.Thread(target=self._watch, name="redismpx-profiler", daemon=True)
+		self.watchdog.start()
+
+	def stop(self) -> None:
+		"""Stops the watchdog thread. Calls keep getting timed."""
+		self.stopped.set()
+		if self.watchdog is not None:
+			self.watchdog.join()
+			self.watchdog = None
+
+	def breakdown(self) -> list:
+		"""
+		Returns the time spent in each callback while sampling, as a list
+		of dictionaries sorted from the most expensive callback. Each one
+		holds the callback `kind`, the `callback` and `subscription` names,
+		the `seconds` spent in it and the `share` of the sampled time.
+		"""
+		with self.lock:
+			samples = list(self.samples.items())
+			total = self.sampled_seconds
+		result = [{
+			"kind": kind,
+			"callback": callback,
+			"subscription": subscription,
+			"seconds": seconds,
+			"share": seconds / total if total else 0,
+		} for (kind, callback, subscription), seconds in samples]
+		result.sort(key=lambda entry: entry["seconds"], reverse=True)
+		return result
+
+	def reset(self) -> None:
+		"""Forgets the slow calls and samples collected so far."""
+		with self.lock:
+			self.samples = {}
+			self.sampled_seconds = 0
+		self.slow_calls.clear()
+
+	def _finish(self, call, duration, running):
+		if self.threshold is None or duration < self.threshold:
+			return
+		kind, fn, subscription, channel, stack, _ = call
+		report = SlowCallback(kind, fn, subscription, channel, duration, running, stack)
+		self.slow_calls.append(report)
+		try:
+			self.on_slow(report)
+		except Exception as e:
+			logging.warning(f"redismpx: on_slow function threw exception: {e}")
+
+	def _watch(self):
+		intervals = [self.sample_interval]
+		if self.threshold is not None:
+			intervals.append(self.threshold / 2)
+		interval = min(i for i in intervals if i is not None)
+		last = perf_counter()
+		while not self.stopped.wait(interval):
+			now = perf_counter()
+			current = self.current
+			if self.sample_interval is not None:
+				with self.lock:
+					self.sampled_seconds += now - last
+					if current is not None:
+						key = current[1][5]
+						self.samples[key] = self.samples.get(key, 0) + now - last
+			last = now
+			if current is None or self.threshold is None:
+				continue
+			step_started, call = current
+			if call[4] is None and now - step_started >= self.threshold:
+				frame = sys._current_frames().get(self.thread_id)
+				if frame is not None:
+					call[4] = traceback.format_stack(frame, self.stack_limit)
+
+@types.coroutine
+def _steps(profiler, coro, call, running):
+	# Drives `coro` one step at a time like a Task would, so that the
+	# watchdog thread only sees the callback while it's actually running.
+	value, error = None, None
+	while True:
+		previous = profiler.current
+		started = perf_counter()
+		profiler.current = (started, call)
+		try:
+			if error is None:
+				yielded = coro.send(value)
+			else:
+				yielded = coro.throw(error)
+		except StopIteration as e:
+			return e.value
+		finally:
+			profiler.current = previous
+			running[0] += perf_counter() - started
+		try:
+			value, error = (yield yielded), None
+		except GeneratorExit:
+			coro.close()
+			raise
+		except BaseException as e:
+			value, error = None, e
+
+def _name(fn):
+	return getattr(fn, "__qualname__", None) or repr(fn)
+
+def _describe(subscription):
+	if subscription is None:
+		return None
+	return f"{type(subscription).__name__}@{id(subscription):#x}"
+
+def _log_slow_callback(report):
+	stack = "".join(report.stack) if report.stack is not None else "  (not captured)\n"
+	logging.warning(f"redismpx: {report.kind} function {_name(report.callback)} of "
+		f"{_describe(report.subscription)} on {report.channel!r} took "
+		f"{report.duration * 1000:.1f}ms ({report.running * 1000:.1f}ms running), stack:\n{stack}")
@@ -1,7 +1,8 @@
 import asyncio
-from typing import Union, Awaitable
+from typing import Union, Awaitable, Iterable, List
 from .utils import as_bytes, SubscriptionIsClosed
-from .internal import List, ListNode
+from .internal import TimingWheel
+from .internal.parser import detach
 
 class InactiveSubscription(Exception):
 	pass
@@ -45,12 +46,16 @@ class PromiseSubscription:
 
 	"""
 
-	def __init__(self, multiplexer, prefix):
+	def __init__(self, multiplexer, prefix, timer_tick=0.01):
+		# Maps each channel to its promise's future, or to a list of 
+		# futures when more than one promise is waiting on it.
 		self.channels = {}
 		self.multiplexer = multiplexer
 		self.prefix = as_bytes(prefix)
 		self.active = asyncio.Event()
 		self.closed = False
+		self.wheel = TimingWheel(self._expire, timer_tick)
+		self.metrics = getattr(multiplexer, "metrics", None)
 		self.pat_sub = multiplexer.new_pattern_subscription(
 			self.prefix + b'*', self.on_message, self.on_disconnect, self.on_activation)
 
@@ -66,6 +71,10 @@ class PromiseSubscription:
 		:class:`~redismpx.InactiveSubscription`. 
 
 		A promise that expires will throw a `asyncio.TimeoutError`.
+		Timeouts are enforced by a timing wheel shared by all the 
+		promises of the subscription, which means that a promise can
+		expire up to `timer_tick` seconds (see 
+		:func:`~redismpx.Multiplexer.new_promise_subscription`) late.
 
 
 		:param suffix: the suffix that will be appended to the subscription's prefix
@@ -77,21 +86,112 @@ class PromiseSubscription:
 		if not self.active.is_set():
 			raise InactiveSubscription("the subscription is inactive")
 
-		suffix = as_bytes(suffix)
-		channel = self.prefix + suffix
+		channel = self.prefix + as_bytes(suffix)
+		fut = asyncio.get_running_loop().create_future()
 
-		if channel not in self.channels:
-			self.channels[channel] = List(None)
+		futures = self.channels.get(channel)
+		if futures is None:
+			self.channels[channel] = fut
+		elif type(futures) is list:
+			futures.append(fut)
+		else:
+			self.channels[channel] = [futures, fut]
 
-		loop = asyncio.get_running_loop()
-		fut = loop.create_future()
-		fut.channel = channel
-		node = ListNode(fut=fut)
-		fut.node = node
-		fut.add_done_callback(self._cleanup)
-		self.channels[channel].prepend(node)
+		if timeout is not None:
+			self.wheel.schedule(timeout, (channel, fut))
+		else:
+			# Without a deadline the wheel won't ever clean up after
+			# a cancelled promise, so we have to do it ourselves.
+			fut.add_done_callback(lambda fut: fut.cancelled() and self._on_cancel(channel, fut))
 
-		return asyncio.wait_for(fut, timeout)
+		return fut
+
+	def new_promises(self, suffixes: Iterable[Union[str, bytes]], timeout: Union[int, float, None]) -> List[Awaitable[bytes]]:
+		"""
+		Like :func:`~redismpx.PromiseSubscription.new_promise` but creates 
+		one promise for each suffix in a single pass. All the promises 
+		share the same deadline, which costs a single timer entry for 
+		the whole batch.
+
+		Use :func:`~redismpx.PromiseSubscription.wait_all`, 
+		:func:`~redismpx.PromiseSubscription.wait_any` or 
+		:func:`~redismpx.PromiseSubscription.wait_first_n` to wait on 
+		the returned promises.
+
+		:param suffixes: the suffixes that will be appended to the subscription's prefix
+		:param timeout: a timeout for all the promises expressed in seconds
+		:return: A list of promises, in the same order as `suffixes`.
+		"""
+		if self.closed:
+			raise Exception("tried to use a closed PromiseSubscription")
+		if not self.active.is_set():
+			raise InactiveSubscription("the subscription is inactive")
+
+		prefix = self.prefix
+		registry = self.channels
+		create_future = asyncio.get_running_loop().create_future
+		channels = []
+		promises = []
+		for suffix in suffixes:
+			channel = prefix + (suffix if type(suffix) is bytes else as_bytes(suffix))
+			fut = create_future()
+			futures = registry.get(channel)
+			if futures is None:
+				registry[channel] = fut
+			elif type(futures) is list:
+				futures.append(fut)
+			else:
+				registry[channel] = [futures, fut]
+			channels.append(channel)
+			promises.append(fut)
+
+		if not promises:
+			return promises
+
+		if timeout is not None:
+			self.wheel.schedule(timeout, (channels, promises))
+		else:
+			for channel, fut in zip(channels, promises):
+				fut.add_done_callback(lambda fut, channel=channel: fut.cancelled() and self._on_cancel(channel, fut))
+
+		return promises
+
+	async def wait_all(self, promises: List[Awaitable[bytes]], *, return_exceptions: bool = False) -> List[bytes]:
+		"""
+		Waits for all the given promises and returns their messages in 
+		the same order. Unlike `asyncio.gather`, it doesn't wrap each 
+		promise in a task: all the promises share one completion callback.
+
+		If a promise fails, the error is raised right away, unless 
+		`return_exceptions` is set, in which case errors are returned 
+		in place of the corresponding messages.
+		"""
+		if not promises:
+			return []
+		n = len(promises)
+		await _Waiter(promises, n, 0, settle=return_exceptions).done
+		if return_exceptions:
+			return [_outcome(fut) for fut in promises]
+		return [fut.result() for fut in promises]
+
+	async def wait_any(self, promises: List[Awaitable[bytes]]) -> bytes:
+		"""
+		Returns the message of the first promise to be fulfilled. 
+		Raises the error of the last failed promise if none succeeds.
+		The other promises are left untouched.
+		"""
+		return (await self.wait_first_n(promises, 1))[0]
+
+	async def wait_first_n(self, promises: List[Awaitable[bytes]], n: int) -> List[bytes]:
+		"""
+		Returns the messages of the first `n` promises to be fulfilled,
+		in the order they got fulfilled. Raises the error of the last 
+		failed promise as soon as fewer than `n` promises can succeed.
+		The other promises are left untouched.
+		"""
+		if n < 1 or n > len(promises):
+			raise ValueError(f"n must be between 1 and {len(promises)}")
+		return await _Waiter(promises, n, len(promises) - n).done
 
 	async def wait_for_activation(self) -> Awaitable[None]:
 		"""
@@ -104,7 +204,7 @@ class PromiseSubscription:
 		if self.closed:
 			raise SubscriptionIsClosed("tried to use a closed PromiseSubscription")
 
-	async def wait_for_new_promise(self, prefix: Union[str, bytes]) -> Awaitable[Awaitable[bytes]]:
+	async def wait_for_new_promise(self, suffix: Union[str, bytes], timeout: Union[int, float, None]) -> Awaitable[Awaitable[bytes]]:
 		"""
 		Like :func:`~redismpx.PromiseSubscription.new_promise` but waits for
 		the subscription to become active instead of throwing 
@@ -118,8 +218,8 @@ class PromiseSubscription:
 			if self.closed:
 				raise SubscriptionIsClosed("tried to use a closed PromiseSubscription")
 			try:
-				return self.new_promise(prefix)
-			except:
+				return self.new_promise(suffix, timeout)
+			except InactiveSubscription:
 				pass
 
 	def clear(self) -> None:
@@ -128,10 +228,7 @@ class PromiseSubscription:
 		if self.closed:
 			raise SubscriptionIsClosed("tried to use a closed PromiseSubscription")
 
-		for ch in self.channels:
-			for node in self.channels[ch]:
-				node.fut.cancel()
-			del self.channels[ch]
+		self._cancel_all()
 
 	def close(self) -> None:
 		"""Closes the subscription and cancels all outstanding promises."""
@@ -148,24 +245,118 @@ class PromiseSubscription:
 	def on_disconnect(self, error):
 		if not self.closed:
 			self.active.clear()
-			for ch in self.channels:
-				for node in self.channels[ch]:
-					node.fut.cancel()
-				del self.channels[ch]
+			self._cancel_all()
 
 	def on_activation(self, pattern):
 		self.active.set()
 
-	async def on_message(self, channel, message):
-		if channel in self.channels:
-			for node in self.channels[channel]:
-				node.fut.set_result(message)
+	def on_message(self, channel, message):
+		futures = self.channels.pop(channel, None)
+		if futures is None:
+			return
+		message = detach(message)
+		fulfilled = 0
+		if type(futures) is list:
+			for fut in futures:
+				if not fut.done():
+					fut.set_result(message)
+					fulfilled += 1
+		elif not futures.done():
+			futures.set_result(message)
+			fulfilled = 1
+		if self.metrics is not None:
+			self.metrics.promises_fulfilled += fulfilled
+
+	def _cancel_all(self):
+		channels = self.channels
+		self.channels = {}
+		self.wheel.clear()
+		cancelled = 0
+		for futures in channels.values():
+			if type(futures) is list:
+				for fut in futures:
+					cancelled += fut.cancel()
+			else:
+				cancelled += futures.cancel()
+		if self.metrics is not None:
+			self.metrics.promises_cancelled += cancelled
+
+	def _expire(self, expired):
+		timed_out = 0
+		cancelled = 0
+		for channel, fut in expired:
+			if type(channel) is list:
+				# A batch created by new_promises.
+				pairs = zip(channel, fut)
+			else:
+				pairs = ((channel, fut),)
+			for channel, fut in pairs:
+				if not fut.done():
+					fut.set_exception(asyncio.TimeoutError())
+					timed_out += 1
+				if self._forget(channel, fut) and fut.cancelled():
+					cancelled += 1
+		if self.metrics is not None:
+			self.metrics.promises_timed_out += timed_out
+			self.metrics.promises_cancelled += cancelled
+
+	def _on_cancel(self, channel, fut):
+		if self._forget(channel, fut) and self.metrics is not None:
+			self.metrics.promises_cancelled += 1
+
+	def _forget(self, channel, fut):
+		futures = self.channels.get(channel)
+		if futures is fut:
 			del self.channels[channel]
+			return True
+		if type(futures) is list and fut in futures:
+			futures.remove(fut)
+			if len(futures) == 1:
+				self.channels[channel] = futures[0]
+			return True
+		return False
+
+
+def _outcome(fut):
+	if fut.cancelled():
+		return asyncio.CancelledError()
+	return fut.exception() or fut.result()
+
+
+class _Waiter:
+	"""
+	Resolves `done` with the messages of the first `needed` promises to
+	be fulfilled (in completion order), sharing a single callback between
+	all the promises. More than `max_failures` failed promises resolve 
+	`done` with the last error instead. When `settle` is set, failed 
+	promises count towards `needed` too.
+	"""
 
-	def _cleanup(self, fut):
-		try:
-			fut.exception() 
-		except:
-			print(self.channels[fut.channel]._head is fut.node)
-			if fut.node.remove_from_list().is_empty():
-				del self.channels[fut.channel]
+	def __init__(self, promises, needed, max_failures, settle=False):
+		self.done = asyncio.get_running_loop().create_future()
+		self.needed = needed
+		self.max_failures = max_failures
+		self.settle = settle
+		self.failures = 0
+		self.results = []
+		for fut in promises:
+			fut.add_done_callback(self._on_done)
+
+	def _on_done(self, fut):
+		done = self.done
+		if done.done():
+			return
+		if fut.cancelled():
+			error = asyncio.CancelledError()
+		else:
+			error = fut.exception()
+
+		if error is None or self.settle:
+			self.results.append(error or fut.result())
+			if len(self.results) == self.needed:
+				done.set_result(self.results)
+			return
+
+		self.failures += 1
+		if self.failures > self.max_failures:
+			done.set_exception(error)
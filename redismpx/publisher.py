@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import aioredis
+from collections import deque
+from typing import Union, Callable, Optional
+from aioredis.errors import ConnectionClosedError
+from .internal import Conn
+from .internal.connection import encode_command
+from .internal.parser import ERROR
+from .utils import as_bytes, Backoff
+
+class Publisher:
+	"""
+	A Publisher sends PUBLISH commands to Redis over a small pool of
+	connections. All publishes issued during the same event loop
+	iteration are sent with a single pipelined write per connection,
+	and Redis' replies are matched to them in order.
+
+	By default :func:`~redismpx.Publisher.publish` waits for Redis to
+	reply and returns the number of clients that received the message.
+	With `ack=False` (passed to the constructor, or to a single call)
+	it returns as soon as the message is queued, and errors get logged.
+
+	Passing `sharded=True` makes it use SPUBLISH, for channels of 
+	Redis 7 sharded Pub/Sub.
+
+	Channels are assigned to connections by hash, so messages published
+	to the same channel are delivered in the order they were published.
+
+	When more than `max_pending` messages are waiting to be sent or
+	acknowledged, `publish` blocks until Redis catches up.
+
+	Each connection reconnects on its own, pacing its attempts with
+	the object returned by `backoff`. Messages published in the meantime
+	are sent once the connection is back, while the ones that were
+	already sent but not yet acknowledged fail with
+	:class:`aioredis.ConnectionClosedError`, as there is no way of
+	knowing whether Redis received them.
+
+	Publisher accepts the same connection options as
+	:class:`~redismpx.Multiplexer`.
+
+	Usage example:
+
+	.. highlight:: python
+
+    .. code-block:: python
+
+		publisher = Publisher('redis://localhost', pool_size=2)
+
+		# Waits for Redis to acknowledge the message.
+		receivers = await publisher.publish("hello-world", "hi!")
+
+		# Only waits when there are too many messages in flight.
+		await publisher.publish("metrics", payload, ack=False)
+
+		# Request/response on top of a PromiseSubscription.
+		reply = promise_sub.new_promise(request_id, 5)
+		await publisher.publish("requests", request)
+		response = await reply
+	"""
+
+	def __init__(self, *args, pool_size: int = 2, max_pending: int = 10_000,
+		ack: bool = True, sharded: bool = False, read_batch: int = 64,
+		backoff: Callable[[], Backoff] = Backoff, **kwargs):
+		if pool_size < 1:
+			raise ValueError("pool_size must be at least 1")
+		if max_pending < 1:
+			raise ValueError("max_pending must be at least 1")
+		kwargs["connection_cls"] = Conn
+		self.connection_options = (args, kwargs)
+		self.max_pending = max_pending
+		self.ack = ack
+		self.command = b"SPUBLISH" if sharded else b"PUBLISH"
+		self.read_batch = read_batch
+		self.pending = 0
+		self.capacity = asyncio.Event()
+		self.capacity.set()
+		self.flush_handle = None
+		self.must_exit = False
+		self.links = [_Link(backoff()) for _ in range(pool_size)]
+		for link in self.links:
+			link.reader = asyncio.create_task(self._run(link))
+
+	async def publish(self, channel: Union[str, bytes], message: Union[str, bytes], *,
+		ack: Optional[bool] = None) -> Optional[int]:
+		"""
+		Publishes a message to a Redis Pub/Sub channel.
+
+		:param channel: a Redis Pub/Sub channel
+		:param message: the message, `str` gets encoded as UTF-8
+		:param ack: whether to wait for Redis' reply, defaults to the Publisher's `ack`
+		:return: the number of clients that received the message, or None when not waiting for Redis
+		"""
+		if self.must_exit:
+			raise Exception("tried to use a closed publisher")
+		while self.pending >= self.max_pending:
+			self.capacity.clear()
+			await self.capacity.wait()
+			if self.must_exit:
+				raise Exception("tried to use a closed publisher")
+
+		channel = as_bytes(channel)
+		if isinstance(message, str):
+			message = message.encode()
+		link = self.links[hash(channel) % len(self.links)]
+		link.buffer += encode_command(self.command, channel, message)
+		reply = None
+		if ack or (ack is None and self.ack):
+			reply = asyncio.get_event_loop().create_future()
+		link.queued.append(reply)
+		self.pending += 1
+		if self.flush_handle is None:
+			self.flush_handle = asyncio.get_event_loop().call_soon(self._flush)
+
+		if reply is not None:
+			return await reply
+
+	@property
+	def connected(self) -> int:
+		"""How many connections of the pool are currently connected."""
+		return sum(1 for link in self.links if link.connection is not None)
+
+	def close(self):
+		self.must_exit = True
+		if self.flush_handle is not None:
+			self.flush_handle.cancel()
+			self.flush_handle = None
+		for link in self.links:
+			link.reader.cancel()
+			if link.connection is not None:
+				link.connection.close()
+				link.connection = None
+			for reply in list(link.replies) + link.queued:
+				if reply is not None:
+					reply.cancel()
+			link.replies.clear()
+			link.queued = []
+			link.buffer = bytearray()
+		self.pending = 0
+		# Wake up whoever is waiting for capacity, they will find us closed.
+		self.capacity.set()
+
+	def _flush(self):
+		self.flush_handle = None
+		for link in self.links:
+			self._flush_link(link)
+
+	def _flush_link(self, link):
+		if not link.buffer or link.connection is None:
+			return
+		try:
+			link.connection.write(link.buffer)
+		except Exception as e:
+			# The reader will notice that the connection is gone.
+			logging.debug(f"redismpx publisher id({id(self)}): write failed: {e}")
+			return
+		link.buffer = bytearray()
+		link.replies.extend(link.queued)
+		link.queued = []
+
+	async def _run(self, link):
+		args, kwargs = self.connection_options
+		while not self.must_exit:
+			try:
+				link.connection = await aioredis.create_connection(*args, **kwargs)
+			except Exception as e:
+				logging.debug(f"redismpx publisher id({id(self)}): connection attempt failed: {e}")
+				await link.backoff.wait()
+				continue
+
+			link.backoff.success()
+			# Send whatever got published while we were disconnected.
+			self._flush_link(link)
+			try:
+				async for batch in link.connection.read_batches(self.read_batch):
+					self._process_replies(link, batch)
+				cause = Exception("reached EOF")
+			except Exception as e:
+				cause = e
+			if self.must_exit:
+				return
+			logging.info(f"redismpx publisher id({id(self)}): reconnecting because of error: {cause}")
+			link.connection.close()
+			link.connection = None
+			self._fail_replies(link, cause)
+
+	def _process_replies(self, link, batch):
+		replies = link.replies
+		for frame in batch:
+			if not replies:
+				logging.warning(f"redismpx publisher id({id(self)}): unexpected reply from Redis: {frame}")
+				continue
+			reply = replies.popleft()
+			self.pending -= 1
+			if frame[0] == ERROR:
+				if reply is None:
+					logging.warning(f"redismpx publisher id({id(self)}): {self.command.decode()} failed: {frame[1]}")
+				elif not reply.done():
+					reply.set_exception(frame[1])
+			elif reply is not None and not reply.done():
+				reply.set_result(frame[1])
+		if self.pending < self.max_pending:
+			self.capacity.set()
+
+	def _fail_replies(self, link, cause):
+		for reply in link.replies:
+			if reply is not None and not reply.done():
+				reply.set_exception(ConnectionClosedError(f"connection lost before Redis replied: {cause}"))
+		self.pending -= len(link.replies)
+		link.replies.clear()
+		if self.pending < self.max_pending:
+			self.capacity.set()
+
+class _Link:
+	# One pooled connection, with the commands waiting to be written
+	# and, in order, the futures (None for fire-and-forget publishes)
+	# waiting for a reply.
+	def __init__(self, backoff):
+		self.backoff = backoff
+		self.connection = None
+		self.reader = None
+		self.buffer = bytearray()
+		self.queued = []
+		self.replies = deque()
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from .internal import List, ListNode, HashRing
+from .multiplexer import Multiplexer, _queue_depth
+from .metrics import resolve_metrics
+from .pattern import PatternSubscription
+
+class ShardedMultiplexer:
+	"""
+	A ShardedMultiplexer spreads channels over a pool of Redis Pub/Sub
+	connections, each one owned by an internal :class:`~redismpx.Multiplexer`.
+	Channels are assigned to shards by consistent hashing, while all
+	patterns (and so all PromiseSubscriptions) share one dedicated
+	connection that gets opened the first time it's needed.
+
+	Each shard reconnects independently, so a dropped connection only
+	interrupts the channels assigned to it. A subscription's `on_disconnect`
+	gets called only when a shard it depends on loses its connection.
+
+	ShardedMultiplexer accepts the same connection options as
+	:class:`~redismpx.Multiplexer`, plus the number of channel shards,
+	and offers the same methods to create new subscriptions.
+
+	Usage example:
+
+	.. highlight:: python
+
+    .. code-block:: python
+
+		mpx = ShardedMultiplexer('redis://localhost', shards=4)
+
+		channel_sub = mpx.new_channel_subscription(
+			my_on_message, my_on_disconnect, None)
+		channel_sub.add("hello-world")
+	"""
+
+	def __init__(self, *args, shards: int = 4, **kwargs):
+		if shards < 1:
+			raise ValueError("shards must be at least 1")
+		self.metrics = resolve_metrics(kwargs.get("metrics", True))
+		# All shards share our metrics.
+		kwargs["metrics"] = self.metrics or False
+		# Our subscriptions wrap their callbacks, our shards only need
+		# to start the profiler.
+		self.profiler = kwargs.get("profiler")
+		self.connection_options = (args, kwargs)
+		self.ssubscribe = kwargs.get("ssubscribe", False)
+		self.subscriptions = List(None)
+		self._watch_queues()
+		self._init_handoffs()
+		self.shards = [self._new_shard(*args, **kwargs) for _ in range(shards)]
+		self.pattern_shard = None
+		self.ring = HashRing(self.shards)
+
+	new_channel_subscription = Multiplexer.new_channel_subscription
+	new_pattern_subscription = Multiplexer.new_pattern_subscription
+	new_promise_subscription = Multiplexer.new_promise_subscription
+	_log_exeptions = Multiplexer._log_exeptions
+	_outbox = Multiplexer._outbox
+	_schedule_handoff = Multiplexer._schedule_handoff
+	_flush_handoffs = Multiplexer._flush_handoffs
+	_call = Multiplexer._call
+	_call_logged = Multiplexer._call_logged
+	_add_channels = Multiplexer._add_channels
+	_remove_channels = Multiplexer._remove_channels
+	_replace_channels = Multiplexer._replace_channels
+
+	def shard_for(self, channel: bytes) -> Multiplexer:
+		"""Returns the Multiplexer that owns the given channel."""
+		return self.ring.get(channel)
+
+	def close(self):
+		for shard in self.shards:
+			shard.close()
+		if self.pattern_shard is not None:
+			self.pattern_shard.close()
+		if self.metrics is not None:
+			self.metrics.remove_gauge("delivery_queue_depth", self._queue_depth)
+		if self.handoff_handle is not None:
+			self.handoff_handle.cancel()
+		for outbox in self.outboxes.values():
+			outbox.close()
+
+	def _watch_queues(self):
+		# Our shards only see the subscriptions that we own.
+		if self.metrics is not None:
+			self.metrics.add_gauge("delivery_queue_depth", self._queue_depth)
+
+	def _init_handoffs(self):
+		# Subscriptions owned by other loops are handed their callbacks
+		# by us, see Multiplexer._outbox.
+		self.loop = asyncio.get_event_loop()
+		self.outboxes = {}
+		self.handoffs = []
+		self.handoff_handle = None
+
+	def _queue_depth(self):
+		return _queue_depth(self.subscriptions)
+
+	def _new_shard(self, *args, **kwargs):
+		shard = Multiplexer(*args, **kwargs)
+
+		async def on_disconnect(cause):
+			await self._on_shard_disconnect(shard, cause)
+
+		shard.subscriptions.prepend(ListNode(on_disconnect=on_disconnect))
+		return shard
+
+	async def _on_shard_disconnect(self, shard, cause):
+		for node in self.subscriptions:
+			if node.on_disconnect is None:
+				continue
+			if isinstance(node.sub, PatternSubscription):
+				if shard is not self.pattern_shard:
+					continue
+			elif not any(self.shard_for(ch) is shard for ch in node.sub.channels):
+				continue
+			try:
+				if asyncio.iscoroutinefunction(node.on_disconnect):
+					await node.on_disconnect(cause)
+				else:
+					node.on_disconnect(cause)
+			except Exception as e:
+				logging.warning(f"redismpx id({id(self)}): on_disconnect function threw exception: {e}")
+
+	def _canonical_channel(self, channel):
+		return self.shard_for(channel)._canonical_channel(channel)
+
+	def _check_write_limits(self, channels):
+		for shard in {self.shard_for(channel) for channel in channels}:
+			shard._check_write_limit()
+
+	def _add_channel(self, channel, fn_box, active=None):
+		self.shard_for(channel)._add_channel(channel, fn_box, active)
+
+	def _remove_channel(self, channel, fn_box):
+		self.shard_for(channel)._remove_channel(channel, fn_box)
+
+	def _add_pattern(self, pattern, fn_box):
+		if self.pattern_shard is None:
+			args, kwargs = self.connection_options
+			self.pattern_shard = self._new_shard(*args, **kwargs)
+		self.pattern_shard._add_pattern(pattern, fn_box)
+
+	def _remove_pattern(self, pattern, fn_box):
+		self.pattern_shard._remove_pattern(pattern, fn_box)
@@ -1,4 +1,6 @@
+import asyncio
 import random
+from typing import Optional
 
 class SubscriptionIsClosed(Exception):
 	pass
@@ -8,5 +10,47 @@ def as_bytes(string):
 		return string
 	return string.encode()
 
-def jitter_exp_backoff(base, maxValue, attempts):
-	return random.randint(0, min(maxValue, base * 2 ** attempts))
\ No newline at end of file
+class Backoff:
+	"""
+	Reconnection backoff using decorrelated jitter, capped at `cap` seconds.
+
+	When `breaker_threshold` is set, that many consecutive failures open 
+	the circuit breaker: the next attempt only happens after 
+	`breaker_cooldown` seconds (half-open state) and, if it fails too,
+	the breaker opens again. A success closes it and resets the delay.
+	"""
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half-open"
+
+	def __init__(self, base: float = 0.008, cap: float = 10,
+		breaker_threshold: Optional[int] = None, breaker_cooldown: float = 30):
+		self.base = base
+		self.cap = cap
+		self.breaker_threshold = breaker_threshold
+		self.breaker_cooldown = breaker_cooldown
+		self.failures = 0
+		self.delay = base
+		self.state = Backoff.CLOSED
+
+	def failure(self) -> float:
+		"""Records a failed attempt and returns how many seconds to wait."""
+		self.failures += 1
+		if self.breaker_threshold is not None and self.failures >= self.breaker_threshold:
+			self.state = Backoff.OPEN
+			self.delay = self.base
+			return self.breaker_cooldown
+
+		self.delay = min(self.cap, random.uniform(self.base, self.delay * 3))
+		return self.delay
+
+	def success(self) -> None:
+		self.failures = 0
+		self.delay = self.base
+		self.state = Backoff.CLOSED
+
+	async def wait(self) -> None:
+		"""Records a failed attempt and sleeps for the appropriate time."""
+		await asyncio.sleep(self.failure())
+		if self.state == Backoff.OPEN:
+			self.state = Backoff.HALF_OPEN
@@ -21,5 +21,6 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     install_requires=['aioredis'],
+    extras_require={'msgpack': ['msgpack']},
     python_requires='>=3.7',
 )
\ No newline at end of file
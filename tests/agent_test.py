@@ -0,0 +1,82 @@
+import pytest
+import asyncio
+from aioredis.parser import PyReader
+from redismpx import Agent
+from redismpx.internal.parser import MESSAGE, PMESSAGE, SUBSCRIBE, PSUBSCRIBE
+
+class Worker:
+    """A raw connection to the Agent, to look at what it sends."""
+
+    async def connect(self, path):
+        self.reader, self.writer = await asyncio.open_unix_connection(path)
+        self.parser = PyReader()
+
+    def send(self, *args):
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.writer.write(b"".join(out))
+
+    async def receive(self):
+        while True:
+            reply = self.parser.gets()
+            if reply is not False:
+                return reply
+            data = await asyncio.wait_for(self.reader.read(65536), 1)
+            assert data, "the agent closed the connection"
+            self.parser.feed(data)
+
+@pytest.mark.asyncio
+async def test_agent(tmp_path, make_multiplexer, recording_publisher):
+    path = str(tmp_path / "mpx.sock")
+    upstream = make_multiplexer(publisher=recording_publisher)
+    agent = Agent(path, multiplexer=upstream)
+    await agent.start()
+
+    first, second = Worker(), Worker()
+    await first.connect(path)
+    await second.connect(path)
+    first.send(b"SUBSCRIBE", b"news", b"sports")
+    second.send(b"SUBSCRIBE", b"news")
+    second.send(b"PSUBSCRIBE", b"spo*")
+    await asyncio.sleep(0.05)
+
+    # The upstream Multiplexer doesn't use sharded Pub/Sub.
+    second.send(b"SSUBSCRIBE", b"shard")
+    reply = await second.receive()
+    assert isinstance(reply, Exception) and "sharded" in str(reply)
+
+    # Both workers share the upstream subscriptions.
+    assert set(upstream.channels) == {b"news", b"sports"}
+    assert set(upstream.patterns) == {b"spo*"}
+
+    await upstream._process_batch([(SUBSCRIBE, b"news"), (SUBSCRIBE, b"sports"), (PSUBSCRIBE, b"spo*")])
+    assert sorted([await first.receive(), await first.receive()]) == [
+        [b"subscribe", b"news", 1], [b"subscribe", b"sports", 2]]
+    assert await second.receive() == [b"subscribe", b"news", 1]
+    assert await second.receive() == [b"psubscribe", b"spo*", 2]
+
+    await upstream._process_batch([
+        (MESSAGE, b"news", b"a"),
+        (MESSAGE, b"news", b"b"),
+        (MESSAGE, b"sports", b"c"),
+        (PMESSAGE, b"spo*", b"sports", b"c"),
+    ])
+    assert [await first.receive() for _ in range(3)] == [
+        [b"message", b"news", b"a"], [b"message", b"news", b"b"], [b"message", b"sports", b"c"]]
+    assert [await second.receive() for _ in range(3)] == [
+        [b"message", b"news", b"a"], [b"message", b"news", b"b"], [b"pmessage", b"spo*", b"sports", b"c"]]
+
+    # Publishing goes through the upstream Multiplexer.
+    first.send(b"PUBLISH", b"news", b"hi")
+    assert await first.receive() == 1
+    assert upstream.publisher.published == [(b"news", b"hi")]
+
+    # A worker that goes away releases its subscriptions.
+    first.send(b"UNSUBSCRIBE", b"news")
+    assert await first.receive() == [b"unsubscribe", b"news", 1]
+    first.writer.close()
+    await asyncio.sleep(0.05)
+    assert set(upstream.channels) == {b"news"}
+
+    agent.close()
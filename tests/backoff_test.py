@@ -0,0 +1,17 @@
+from redismpx import Backoff
+
+def test_backoff():
+    b = Backoff(base=0.01, cap=1)
+    delays = [b.failure() for _ in range(50)]
+    assert all(0.01 <= d <= 1 for d in delays)
+    assert b.state == Backoff.CLOSED
+
+    b = Backoff(base=0.01, cap=1, breaker_threshold=3, breaker_cooldown=60)
+    b.failure()
+    b.failure()
+    assert b.failure() == 60
+    assert b.state == Backoff.OPEN
+
+    b.success()
+    assert b.state == Backoff.CLOSED
+    assert b.failure() <= 0.03
@@ -0,0 +1,71 @@
+import pytest
+import asyncio
+from redismpx.internal.parser import SUBSCRIBE
+
+@pytest.mark.asyncio
+async def test_changes_merge(make_multiplexer, recording_connection):
+    mpx = make_multiplexer()
+    connection = mpx.connection = recording_connection
+    subs = [mpx.new_channel_subscription(lambda ch, msg: None, None, None) for _ in range(3)]
+    for sub in subs:
+        sub.add("a")
+        sub.add("b")
+    mpx.new_pattern_subscription("p*", lambda ch, msg: None, None, None)
+    assert connection.commands == []
+
+    # Everything changed during a tick goes out as one command per kind.
+    await asyncio.sleep(0)
+    assert connection.commands == [(b"SUBSCRIBE", b"a", b"b"), (b"PSUBSCRIBE", b"p*")]
+
+    connection.commands.clear()
+    for sub in subs:
+        sub.remove("a")
+        sub.add("c")
+    await asyncio.sleep(0)
+    assert connection.commands == [(b"SUBSCRIBE", b"c"), (b"UNSUBSCRIBE", b"a")]
+
+@pytest.mark.asyncio
+async def test_revert_cancels_change(make_multiplexer, recording_connection):
+    mpx = make_multiplexer()
+    connection = mpx.connection = recording_connection
+    activations = []
+    sub = mpx.new_channel_subscription(lambda ch, msg: None, None, activations.append)
+    sub.add("a")
+    await asyncio.sleep(0)
+    await mpx._process_batch([(SUBSCRIBE, b"a")])
+    assert activations == [b"a"]
+
+    connection.commands.clear()
+    sub.add("b")
+    sub.remove("b")
+    sub.remove("a")
+    sub.add("a")
+    await asyncio.sleep(0)
+    assert connection.commands == []
+    assert mpx.pending_channels == {}
+    # The UNSUBSCRIBE never left, so the channel is still active.
+    assert activations == [b"a", b"a"]
+
+@pytest.mark.asyncio
+async def test_linger(make_multiplexer, recording_connection):
+    mpx = make_multiplexer(linger=0.05)
+    connection = mpx.connection = recording_connection
+    sub = mpx.new_channel_subscription(lambda ch, msg: None, None, None)
+    sub.add("a")
+    await asyncio.sleep(0)
+    connection.commands.clear()
+
+    # A channel that loses its last subscriber stays subscribed for a
+    # while, and coming back in the meantime costs nothing.
+    sub.remove("a")
+    await asyncio.sleep(0.03)
+    assert b"a" in mpx.channels
+    sub.add("a")
+    await asyncio.sleep(0.03)
+    assert connection.commands == []
+    assert not mpx.lingering
+
+    sub.remove("a")
+    await asyncio.sleep(0.1)
+    assert connection.commands == [(b"UNSUBSCRIBE", b"a")]
+    assert b"a" not in mpx.channels and not mpx.lingering
@@ -0,0 +1,99 @@
+import pytest
+import asyncio
+from aioredis.errors import ReplyError
+from benchmarks.fake_redis import FakeRedis, SlotMap
+from redismpx import ClusterMultiplexer
+from redismpx.internal import key_slot
+from redismpx.internal.parser import ERROR
+from redismpx.internal.slots import crc16, SLOT_COUNT
+
+def test_key_slot():
+    assert crc16(b"123456789") == 0x31C3
+    assert key_slot(b"foo") == 12182
+    assert key_slot(b"{user1000}.following") == key_slot(b"{user1000}.followers")
+    # empty hash tags are ignored
+    assert key_slot(b"foo{}{bar}") != key_slot(b"bar")
+    assert key_slot(b"foo{{bar}}") == key_slot(b"{bar")
+
+async def wait_until(condition, timeout=2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert condition()
+
+@pytest.mark.asyncio
+async def test_slot_migration():
+    slot_map = SlotMap()
+    first, second = FakeRedis(slot_map), FakeRedis(slot_map)
+    first_address = await first.start()
+    second_address = await second.start()
+    slot_map.assign(0, SLOT_COUNT - 1, first_address)
+
+    mpx = ClusterMultiplexer([first_address])
+    received = []
+    sub = mpx.new_channel_subscription(lambda ch, msg: received.append((ch, msg)), None, None)
+    # Subscriptions made before the slot map arrives wait for it.
+    sub.add("x")
+    await wait_until(lambda: first.subscribers(b"x") == 1)
+    assert mpx.shard_for(b"x") is mpx.nodes[first_address]
+    first.publish(b"x", b"1", sharded=True)
+    await wait_until(lambda: received == [(b"x", b"1")])
+
+    # The node force-unsubscribes the channels of a slot that moves away.
+    first.move_slot(key_slot(b"x"), second_address)
+    await wait_until(lambda: second.subscribers(b"x") == 1)
+    assert first.subscribers(b"x") == 0
+    assert mpx.shard_for(b"x") is mpx.nodes[second_address]
+    # Nodes left without channels get dropped.
+    assert first_address not in mpx.nodes
+    second.publish(b"x", b"2", sharded=True)
+    await wait_until(lambda: received[-1] == (b"x", b"2"))
+
+    # Subscribing with a stale slot map gets a MOVED reply.
+    slot_map.owners[key_slot(b"y")] = second_address
+    sub.add("y")
+    await wait_until(lambda: second.subscribers(b"y") == 1)
+    await wait_until(lambda: mpx.shard_for(b"y") is mpx.nodes[second_address])
+    assert first.subscribers(b"y") == 0
+
+    sub.close()
+    mpx.close()
+    first.close()
+    second.close()
+
+@pytest.mark.asyncio
+async def test_error_confirms_resubscription(make_multiplexer):
+    mpx = make_multiplexer()
+    mpx.confirm_target = mpx.confirmations + 3
+    mpx.confirmed_event.clear()
+    await mpx._process_batch([(ERROR, ReplyError("MOVED 12182 127.0.0.1:7001"))])
+    # The chunk waiting for confirmations doesn't wait for the timeout.
+    assert mpx.confirmed_event.is_set()
+
+@pytest.mark.asyncio
+async def test_lingering_channel_migration():
+    slot_map = SlotMap()
+    first, second = FakeRedis(slot_map), FakeRedis(slot_map)
+    first_address = await first.start()
+    second_address = await second.start()
+    slot_map.assign(0, SLOT_COUNT - 1, first_address)
+
+    mpx = ClusterMultiplexer([first_address], linger=10)
+    sub = mpx.new_channel_subscription(lambda ch, msg: None, None, None)
+    sub.add("x")
+    await wait_until(lambda: first.subscribers(b"x") == 1)
+    sub.remove("x")
+    await asyncio.sleep(0.05)
+    assert first.subscribers(b"x") == 1
+
+    # Nobody wants the channel anymore, so it doesn't follow its slot.
+    first.move_slot(key_slot(b"x"), second_address)
+    await wait_until(lambda: first_address not in mpx.nodes)
+    assert second.subscribers(b"x") == 0
+    assert mpx.shard_for(b"x") is None
+
+    sub.close()
+    mpx.close()
+    first.close()
+    second.close()
@@ -0,0 +1,71 @@
+import pytest
+from redismpx import Multiplexer
+
+class RecordingPublisher:
+    """Stands in for a Publisher, keeping what gets published."""
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, channel, message, ack=False):
+        self.published.append((channel, message))
+        return len(self.published)
+
+class RecordingConnection:
+    """Stands in for a Multiplexer's connection, keeping the commands sent."""
+
+    def __init__(self):
+        self.commands = []
+
+    def write_command(self, *args):
+        self.commands.append(args)
+
+    async def drain(self, stall_timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+class PatternOnlyMultiplexer:
+    """Activates pattern subscriptions right away, without a connection."""
+
+    def __init__(self):
+        self.metrics = None
+
+    def new_pattern_subscription(self, pattern, on_message, on_disconnect, on_activation):
+        on_activation(pattern)
+        return self
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def make_multiplexer():
+    """
+    Returns a function that creates Multiplexers nobody listens to:
+    tests feed frames to their dispatcher directly. They get closed
+    at the end of the test.
+    """
+    created = []
+
+    def make(cls=Multiplexer, **kwargs):
+        # Nothing listens on this port.
+        mpx = cls(("127.0.0.1", 1), **kwargs)
+        created.append(mpx)
+        return mpx
+
+    yield make
+    for mpx in created:
+        mpx.close()
+
+@pytest.fixture
+def recording_publisher():
+    return RecordingPublisher()
+
+@pytest.fixture
+def recording_connection():
+    return RecordingConnection()
+
+@pytest.fixture
+def pattern_only_multiplexer():
+    return PatternOnlyMultiplexer()
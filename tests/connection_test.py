@@ -0,0 +1,122 @@
+import pytest
+import asyncio
+import socket
+import aioredis
+from redismpx import Multiplexer, WriteStalled
+from redismpx.internal import Conn
+
+class StalledServer:
+    """Accepts connections but only reads from them once `reading` is set."""
+
+    def __init__(self):
+        self.reading = asyncio.Event()
+        self.connections = 0
+
+    async def start(self):
+        # A small receive buffer makes the client's writes back up quickly.
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.bind(("127.0.0.1", 0))
+        server = await asyncio.start_server(self.handle, sock=sock)
+        return server, sock.getsockname()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await self.reading.wait()
+        while await reader.read(65536):
+            pass
+        writer.close()
+
+def fill(conn):
+    conn.set_write_limits(high=1024)
+    conn.write(b"x" * (16 << 20))
+    assert conn.buffered_bytes > 1024
+
+@pytest.mark.asyncio
+async def test_shared_drain():
+    fake = StalledServer()
+    server, address = await fake.start()
+    conn = await aioredis.create_connection(address, connection_cls=Conn)
+    fill(conn)
+
+    # Concurrent waits share the writer's drain, and each one gives up
+    # on its own.
+    results = await asyncio.gather(conn.drain(0.05), conn.drain(0.1), return_exceptions=True)
+    assert [type(r) for r in results] == [WriteStalled, WriteStalled]
+
+    waiting = asyncio.ensure_future(conn.drain())
+    fake.reading.set()
+    await asyncio.wait_for(asyncio.gather(waiting, conn.drain(1)), 5)
+    assert conn.buffered_bytes <= conn.write_limits[0]
+    conn.close()
+    server.close()
+
+@pytest.mark.asyncio
+async def test_write_limits():
+    fake = StalledServer()
+    server, address = await fake.start()
+    mpx = Multiplexer(address, write_stall_timeout=0.05, write_buffer_limit=1024)
+    await asyncio.wait_for(mpx.connected_event.wait(), 1)
+    sub = mpx.new_channel_subscription(lambda ch, msg: None, None, None)
+    fill(mpx.connection)
+    assert mpx.write_buffer_size > 1024
+
+    # Past the limit, new subscriptions fail right away.
+    with pytest.raises(WriteStalled):
+        sub.add("a")
+
+    # A buffer that doesn't drain in time means the connection is dead.
+    mpx.write_buffer_limit = None
+    sub.add("b")
+    await asyncio.sleep(0)
+    assert mpx.write_watcher is not None
+    await asyncio.sleep(0.1)
+    assert mpx.reconnecting or fake.connections == 2
+    fake.reading.set()
+    await asyncio.wait_for(mpx.connected_event.wait(), 1)
+    assert fake.connections == 2
+    assert mpx.write_watcher is None
+    mpx.close()
+    server.close()
+
+def message_frame(channel, payload):
+    return b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n" % (
+        len(channel), channel, len(payload), payload)
+
+@pytest.mark.asyncio
+async def test_read_batches():
+    from redismpx.internal.parser import MESSAGE
+
+    async def handle(reader, writer):
+        # Everything arrives with a single read.
+        writer.write(b"".join(message_frame(b"ch", b"%d" % i) for i in range(5)))
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    conn = await aioredis.create_connection(server.sockets[0].getsockname()[:2], connection_cls=Conn)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0)
+
+    ticking = asyncio.ensure_future(ticker())
+    batches = []
+    seen = []
+    async for batch in conn.read_batches(2):
+        batches.append([bytes(frame[2]) for frame in batch])
+        seen.append(ticks)
+        assert all(frame[0] == MESSAGE for frame in batch)
+        if sum(map(len, batches)) == 5:
+            break
+
+    # Batches hold at most `budget` frames, and a full one gives the
+    # other tasks a turn before the next.
+    assert batches == [[b"0", b"1"], [b"2", b"3"], [b"4"]]
+    assert seen[0] < seen[1] < seen[2]
+    ticking.cancel()
+    conn.close()
+    server.close()
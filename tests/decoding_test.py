@@ -0,0 +1,103 @@
+import pytest
+import json
+import zlib
+from redismpx import Payload, json_decoder
+from redismpx.decoding import PayloadCache
+from redismpx.internal.parser import MESSAGE, PMESSAGE
+
+def test_payload_cache():
+    calls = []
+
+    def decoder(raw):
+        calls.append(raw)
+        return json.loads(raw)
+
+    cache = PayloadCache(2)
+    first = cache.wrap(decoder, [b'{"a": 1}', b'[2]'])
+    assert first[0].value == {"a": 1}
+    assert first[0].value is first[0].value
+    assert calls == [b'{"a": 1}']
+
+    # A repeated message gets the same Payload, decoded once.
+    again = cache.wrap(decoder, [memoryview(b'{"a": 1}')])
+    assert again[0] is first[0]
+    assert bytes(again[0]) == b'{"a": 1}' and len(again[0]) == 8
+    assert calls == [b'{"a": 1}']
+
+    cache.wrap(decoder, [b'3'])
+    assert len(cache.entries) == 2
+    assert cache.wrap(decoder, [b'[2]'])[0] is not first[1]
+
+    assert PayloadCache(0).wrap(decoder, [b"1"])[0].value == 1
+
+def test_json_decoder():
+    decode = json_decoder(decompress=zlib.decompress)
+    assert decode(zlib.compress(b'{"x": [1, 2]}')) == {"x": [1, 2]}
+
+@pytest.mark.asyncio
+async def test_decode_once(make_multiplexer):
+    mpx = make_multiplexer()
+    calls = []
+
+    def decoder(raw):
+        calls.append(raw)
+        return json.loads(raw)
+
+    received = []
+    for _ in range(3):
+        sub = mpx.new_channel_subscription(lambda ch, msg: received.append(msg), None, None)
+        sub.add("news")
+        sub.add("raw")
+    mpx.new_pattern_subscription("ne*", lambda ch, msg: received.append(msg), None, None)
+    mpx.set_decoder(decoder, channel="news")
+
+    await mpx._process_batch([
+        (MESSAGE, b"news", b'{"n": 1}'),
+        (PMESSAGE, b"ne*", b"news", b'{"n": 1}'),
+    ])
+    assert len(received) == 4
+    assert all(msg is received[0] for msg in received)
+    assert isinstance(received[0], Payload) and received[0].value == {"n": 1}
+    assert calls == [b'{"n": 1}']
+
+    # Channels without a decoder still get bytes.
+    received.clear()
+    await mpx._process_batch([(MESSAGE, b"raw", b"x")])
+    assert received == [b"x", b"x", b"x"]
+
+    # The pattern's decoder comes before the channel's one.
+    received.clear()
+    mpx.set_decoder(lambda raw: "pattern", pattern="ne*")
+    await mpx._process_batch([(PMESSAGE, b"ne*", b"news", b"{}")])
+    assert received[0].value == "pattern"
+
+    mpx.set_decoder(None, channel="news")
+    mpx.set_decoder(None, pattern="ne*")
+    assert not mpx.decoding
+
+@pytest.mark.asyncio
+async def test_covered_pattern_decoder(make_multiplexer):
+    mpx = make_multiplexer()
+    received = []
+    mpx.new_pattern_subscription("news.*", lambda ch, msg: received.append(("news.*", msg)), None, None)
+    mpx.new_pattern_subscription("news.sports.*", lambda ch, msg: received.append(("news.sports.*", msg)), None, None)
+    mpx.new_pattern_subscription("news.sports.*", None, None, None,
+        on_messages=lambda ch, msgs: received.append(("batch", list(msgs))))
+    assert set(mpx.patterns) == {b"news.*"}
+
+    # The covered pattern's decoder applies, even though Redis only
+    # matched the broader pattern.
+    mpx.set_decoder(json.loads, pattern="news.sports.*")
+    await mpx._process_batch([(PMESSAGE, b"news.*", b"news.sports.x", b'{"a": 1}')])
+    assert received[0] == ("news.*", b'{"a": 1}')
+    assert received[1][0] == "news.sports.*" and received[1][1].value == {"a": 1}
+    assert received[2][0] == "batch" and received[2][1] == [received[1][1]]
+
+    # And the broader pattern's decoder doesn't.
+    received.clear()
+    mpx.set_decoder(None, pattern="news.sports.*")
+    mpx.set_decoder(lambda raw: "cover", pattern="news.*")
+    await mpx._process_batch([(PMESSAGE, b"news.*", b"news.sports.x", b"raw")])
+    assert received[0][1].value == "cover"
+    assert received[1] == ("news.sports.*", b"raw")
+    assert received[2] == ("batch", [b"raw"])
@@ -0,0 +1,98 @@
+import pytest
+import asyncio
+from redismpx import Overflow, SubscriberOverflow
+from redismpx.delivery import DeliveryQueue, ConflatingQueue
+
+@pytest.mark.asyncio
+async def test_delivery_queue_overflow():
+    received = []
+    errors = []
+
+    q = DeliveryQueue(lambda c, m: received.append(m), 2, Overflow.DROP_OLDEST, errors.append)
+    for i in range(5):
+        q.put(b"ch", i)
+    await asyncio.sleep(0)
+    assert received == [3, 4]
+    assert q.dropped == 3
+    q.close()
+
+    received.clear()
+    q = DeliveryQueue(lambda c, m: received.append(m), 2, Overflow.DROP_NEWEST, errors.append)
+    for i in range(5):
+        q.put(b"ch", i)
+    await asyncio.sleep(0)
+    assert received == [0, 1]
+    q.close()
+
+    received.clear()
+    q = DeliveryQueue(lambda c, m: received.append(m), 2, Overflow.DISCONNECT, errors.append)
+    for i in range(5):
+        q.put(b"ch", i)
+    await asyncio.sleep(0)
+    assert received == []
+    assert len(errors) == 1 and isinstance(errors[0], SubscriberOverflow)
+    assert q.closed
+
+@pytest.mark.asyncio
+async def test_delivery_queue_block():
+    release = asyncio.Event()
+    received = []
+
+    async def slow(channel, message):
+        await release.wait()
+        received.append(message)
+
+    q = DeliveryQueue(slow, 1, Overflow.BLOCK, None)
+    await q.put(b"ch", 1)
+    await asyncio.sleep(0)
+    # the consumer holds message 1, the queue holds message 2
+    await q.put(b"ch", 2)
+    blocked = asyncio.create_task(q.put(b"ch", 3))
+    await asyncio.sleep(0)
+    assert not blocked.done()
+
+    release.set()
+    await asyncio.wait_for(blocked, 1)
+    await asyncio.sleep(0)
+    assert received[:2] == [1, 2]
+    q.close()
+
+@pytest.mark.asyncio
+async def test_conflating_queue():
+    release = asyncio.Event()
+    received = []
+
+    async def slow(channel, message):
+        received.append((channel, message))
+        await release.wait()
+
+    q = ConflatingQueue(slow, 0)
+    q.put(b"a", 1)
+    await asyncio.sleep(0)
+    assert received == [(b"a", 1)]
+
+    # While the subscriber is busy, only the latest message per channel is kept.
+    for i in range(2, 10):
+        q.put(b"a", i)
+        q.put(b"b", -i)
+    assert q.items == {b"a": 9, b"b": -9}
+    assert q.dropped == 14
+
+    release.set()
+    await asyncio.sleep(0.01)
+    assert received == [(b"a", 1), (b"a", 9), (b"b", -9)]
+    q.close()
+
+@pytest.mark.asyncio
+async def test_conflating_queue_interval():
+    received = []
+    q = ConflatingQueue(lambda c, m: received.append(m), 0.05)
+    q.put(b"a", 1)
+    await asyncio.sleep(0.01)
+    q.put(b"a", 2)
+    q.put(b"a", 3)
+    await asyncio.sleep(0.01)
+    assert received == [1]
+    await asyncio.sleep(0.06)
+    assert received == [1, 3]
+    q.close()
@@ -0,0 +1,51 @@
+import pytest
+from redismpx.internal.parser import MESSAGE, PMESSAGE, SUBSCRIBE
+
+@pytest.mark.asyncio
+async def test_batch_grouping(make_multiplexer):
+    mpx = make_multiplexer()
+    events = []
+    sub = mpx.new_channel_subscription(None, None, lambda ch: events.append(("active", ch)),
+        on_messages=lambda ch, msgs: events.append((ch, list(msgs))))
+    sub.add("a")
+    sub.add("b")
+    sub.add("c")
+    mpx.new_pattern_subscription("a*", None, None, None,
+        on_messages=lambda ch, msgs: events.append(("a*", ch, list(msgs))))
+
+    # Messages get grouped by channel within the batch.
+    await mpx._process_batch([
+        (MESSAGE, b"a", b"1"),
+        (MESSAGE, b"b", b"2"),
+        (PMESSAGE, b"a*", b"a", b"1"),
+        (MESSAGE, b"a", b"3"),
+        (PMESSAGE, b"a*", b"a", b"3"),
+    ])
+    assert events == [(b"a", [b"1", b"3"]), (b"b", [b"2"]), ("a*", b"a", [b"1", b"3"])]
+
+    # Groups pending before a control frame get dispatched first.
+    events.clear()
+    await mpx._process_batch([
+        (MESSAGE, b"a", b"4"),
+        (SUBSCRIBE, b"c"),
+        (MESSAGE, b"a", b"5"),
+        (MESSAGE, b"c", b"6"),
+    ])
+    assert events == [(b"a", [b"4"]), ("active", b"c"), (b"a", [b"5"]), (b"c", [b"6"])]
+
+@pytest.mark.asyncio
+async def test_batch_order(make_multiplexer):
+    mpx = make_multiplexer(read_batch=16)
+    received = []
+    sub = mpx.new_channel_subscription(lambda ch, msg: received.append((ch, msg)), None, None)
+    sub.add("a")
+    sub.add("b")
+
+    await mpx._process_batch([
+        (MESSAGE, b"a", b"1"),
+        (MESSAGE, b"b", b"2"),
+        (MESSAGE, b"a", b"3"),
+        (MESSAGE, b"b", b"4"),
+    ])
+    # Order is only kept within each channel.
+    assert received == [(b"a", b"1"), (b"a", b"3"), (b"b", b"2"), (b"b", b"4")]
@@ -0,0 +1,81 @@
+import pytest
+import asyncio
+from redismpx.internal.glob import compile_glob, subsumes, PatternTrie
+
+def test_glob_matching():
+    cases = [
+        (b"h?llo", b"hello", True),
+        (b"h*llo", b"heeeeello", True),
+        (b"h[ae]llo", b"hallo", True),
+        (b"h[ae]llo", b"hillo", False),
+        (b"h[^e]llo", b"hallo", True),
+        (b"h[^e]llo", b"hello", False),
+        (b"h[a-b]llo", b"hbllo", True),
+        (b"h[b-a]llo", b"hallo", True),
+        (b"a\\*b", b"a*b", True),
+        (b"a\\*b", b"axb", False),
+        (b"a.b", b"axb", False),
+        (b"*", b"", True),
+    ]
+    for pattern, channel, expected in cases:
+        assert bool(compile_glob(pattern)(channel)) == expected, (pattern, channel)
+
+def test_pattern_subsumption():
+    assert subsumes(b"news.*", b"news.sports.*")
+    assert subsumes(b"news.*", b"news.[ab]")
+    assert subsumes(b"*", b"anything?")
+    assert not subsumes(b"news.*", b"new*")
+    assert not subsumes(b"news.?", b"news.a")
+
+    trie = PatternTrie()
+    trie.add(b"news.*")
+    trie.add(b"news.sports.*")
+    assert trie.find_cover(b"news.sports.football.*") == b"news.*"
+    assert trie.find_cover(b"news.*") is None
+    trie.remove(b"news.*")
+    assert trie.find_cover(b"news.sports.football.*") == b"news.sports.*"
+
+@pytest.mark.asyncio
+async def test_covered_patterns(make_multiplexer, recording_connection):
+    from redismpx.internal.parser import PMESSAGE
+
+    mpx = make_multiplexer()
+    connection = mpx.connection = recording_connection
+    received = []
+
+    def subscribe(pattern):
+        return mpx.new_pattern_subscription(pattern,
+            lambda ch, msg: received.append((pattern, ch)), None, None)
+
+    news = subscribe("news.*")
+    sports = subscribe("news.sports.*")
+    football = subscribe("news.sports.football.*")
+    await asyncio.sleep(0)
+    # The narrower patterns are served by the broader one.
+    assert connection.commands == [(b"PSUBSCRIBE", b"news.*")]
+    await mpx._process_batch([(PMESSAGE, b"news.*", b"news.sports.football.x", b"m")])
+    assert sorted(received) == [
+        ("news.*", b"news.sports.football.x"),
+        ("news.sports.*", b"news.sports.football.x"),
+        ("news.sports.football.*", b"news.sports.football.x"),
+    ]
+
+    # Once nobody subscribes to the cover itself, the broadest of the
+    # patterns it served takes over.
+    connection.commands.clear()
+    news.close()
+    await asyncio.sleep(0)
+    assert connection.commands == [(b"PSUBSCRIBE", b"news.sports.*"), (b"PUNSUBSCRIBE", b"news.*")]
+    assert set(mpx.patterns) == {b"news.sports.*"}
+
+    received.clear()
+    await mpx._process_batch([(PMESSAGE, b"news.sports.*", b"news.sports.football.x", b"m")])
+    assert sorted(received) == [
+        ("news.sports.*", b"news.sports.football.x"),
+        ("news.sports.football.*", b"news.sports.football.x"),
+    ]
+
+    sports.close()
+    football.close()
+    await asyncio.sleep(0)
+    assert not mpx.patterns
@@ -0,0 +1,101 @@
+import pytest
+import asyncio
+import threading
+from redismpx.internal.parser import MESSAGE, PMESSAGE, SUBSCRIBE, PSUBSCRIBE
+
+class LoopThread:
+    """An event loop running in its own thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.handoffs = 0
+        call_soon_threadsafe = self.loop.call_soon_threadsafe
+
+        def counting(*args):
+            self.handoffs += 1
+            return call_soon_threadsafe(*args)
+
+        self.loop.call_soon_threadsafe = counting
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def run(self, fn):
+        async def call():
+            return fn()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call(), self.loop))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+@pytest.mark.asyncio
+async def test_foreign_loop_subscriptions(make_multiplexer):
+    mpx = make_multiplexer()
+    other = LoopThread()
+    received = []
+    threads = set()
+
+    def on_message(channel, message):
+        threads.add(threading.get_ident())
+        received.append((channel, message))
+
+    async def on_messages(channel, messages):
+        threads.add(threading.get_ident())
+        received.append((channel, list(messages)))
+
+    def on_activation(name):
+        received.append(("active", name))
+
+    sub = await other.run(lambda: mpx.new_channel_subscription(
+        on_message, None, on_activation, loop=other.loop))
+    await other.run(lambda: sub.add("news"))
+    psub = await other.run(lambda: mpx.new_pattern_subscription("spo*", None, None, None,
+        on_messages=on_messages, loop=other.loop))
+    await asyncio.sleep(0.01)
+    assert set(mpx.channels) == {b"news"} and set(mpx.patterns) == {b"spo*"}
+
+    await mpx._process_batch([(SUBSCRIBE, b"news"), (PSUBSCRIBE, b"spo*")])
+    other.handoffs = 0
+    await mpx._process_batch([
+        (MESSAGE, b"news", b"a"),
+        (MESSAGE, b"news", b"b"),
+        (PMESSAGE, b"spo*", b"sports", b"c"),
+        (PMESSAGE, b"spo*", b"sports", b"d"),
+    ])
+    await asyncio.sleep(0.05)
+    # One hand-off for the whole batch.
+    assert other.handoffs == 1
+    assert received == [("active", b"news"), (b"news", b"a"), (b"news", b"b"), (b"sports", [b"c", b"d"])]
+    assert threads == {other.thread.ident}
+
+    await other.run(lambda: sub.remove("news"))
+    await other.run(psub.close)
+    await asyncio.sleep(0.01)
+    assert not mpx.channels and not mpx.patterns
+
+    await other.run(sub.close)
+    mpx.close()
+    await asyncio.sleep(0.01)
+    other.stop()
+
+@pytest.mark.asyncio
+async def test_sharded_foreign_loop(make_multiplexer):
+    from redismpx import ShardedMultiplexer
+    mpx = make_multiplexer(ShardedMultiplexer, shards=2)
+    other = LoopThread()
+    received = []
+
+    sub = await other.run(lambda: mpx.new_channel_subscription(
+        lambda ch, msg: received.append((threading.get_ident(), msg)), None, None, loop=other.loop))
+    await other.run(lambda: sub.add("news"))
+    await asyncio.sleep(0.01)
+
+    await mpx.shard_for(b"news")._process_batch([(MESSAGE, b"news", b"a")])
+    await asyncio.sleep(0.05)
+    assert received == [(other.thread.ident, b"a")]
+
+    await other.run(sub.close)
+    mpx.close()
+    await asyncio.sleep(0.01)
+    other.stop()
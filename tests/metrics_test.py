@@ -0,0 +1,56 @@
+import pytest
+import asyncio
+from redismpx import Metrics, Histogram, PromiseSubscription
+
+def test_histogram():
+    h = Histogram((1, 10))
+    for value in (0.5, 1, 5, 50):
+        h.observe(value)
+    assert h.snapshot() == {
+        "buckets": [(1, 2), (10, 3), (float("inf"), 4)],
+        "sum": 56.5,
+        "count": 4,
+    }
+
+def test_metrics():
+    m = Metrics()
+    m.new_stats(m.channels, b"ch")[:] = [2, 5, 6]
+    m.new_stats(m.patterns, b"p*")[:] = [1, 1, 1]
+    m.add_gauge("depth", lambda: 2)
+    m.add_gauge("depth", lambda: 3)
+
+    snap = m.snapshot()
+    assert snap["messages"] == 3
+    assert snap["bytes"] == 6
+    assert snap["deliveries"] == 7
+    assert snap["channels"] == {b"ch": {"messages": 2, "bytes": 5, "deliveries": 6}}
+    assert snap["gauges"] == {"depth": 5}
+
+    text = m.prometheus()
+    assert 'redismpx_channel_messages_total{channel="ch"} 2' in text
+    assert 'redismpx_dispatch_seconds_bucket{le="+Inf"} 0' in text
+    assert "redismpx_depth 5" in text
+
+    # Totals survive forgetting a channel.
+    m.forget(m.channels, b"ch")
+    assert m.snapshot()["channels"] == {}
+    assert m.messages == 3
+
+    m = Metrics(per_channel=False)
+    assert m.new_stats(m.channels, b"ch") is m.new_stats(m.patterns, b"p*")
+    assert m.channels == {}
+
+@pytest.mark.asyncio
+async def test_promise_outcomes(pattern_only_multiplexer):
+    m = pattern_only_multiplexer.metrics = Metrics()
+    sub = PromiseSubscription(pattern_only_multiplexer, "p-")
+    fulfilled = sub.new_promise("a", 1)
+    timed_out = sub.new_promise("b", 0.01)
+    cancelled = sub.new_promise("c", None)
+    sub.on_message(b"p-a", b"ok")
+    cancelled.cancel()
+    await asyncio.sleep(0.05)
+    sub.new_promise("d", None)
+    sub.close()
+    assert m.snapshot()["promises"] == {"fulfilled": 1, "timed_out": 1, "cancelled": 2}
+    assert timed_out.exception() is not None
@@ -0,0 +1,102 @@
+import pytest
+from aioredis.errors import ReplyError
+from redismpx.internal.parser import (
+    PyPubSubParser, ViewPubSubParser, HiredisPubSubParser, hiredis,
+    MESSAGE, PMESSAGE, SUBSCRIBE, PSUBSCRIBE, SUNSUBSCRIBE, ERROR, OTHER)
+
+STREAM = (
+    b"*3\r\n$9\r\nsubscribe\r\n$2\r\nch\r\n:1\r\n"
+    b"*3\r\n$10\r\npsubscribe\r\n$2\r\np*\r\n:2\r\n"
+    b"*3\r\n$7\r\nmessage\r\n$2\r\nch\r\n$5\r\nhe\r\nl\r\n"
+    b"*4\r\n$8\r\npmessage\r\n$2\r\np*\r\n$2\r\npx\r\n$0\r\n\r\n"
+    b"*3\r\n$8\r\nsmessage\r\n$2\r\nch\r\n$1\r\n!\r\n"
+    b"*3\r\n$7\r\nmessage\r\n$2\r\nch\r\n$-1\r\n"
+    b"*3\r\n$12\r\nsunsubscribe\r\n$2\r\nch\r\n:0\r\n"
+    b"-MOVED 1 127.0.0.1:7000\r\n"
+    b"+PONG\r\n"
+)
+
+def parse(parser_cls, chunk_size):
+    parser = parser_cls()
+    frames = []
+    for i in range(0, len(STREAM), chunk_size):
+        parser.feed(STREAM[i:i + chunk_size])
+        batch = []
+        while True:
+            frame = parser.gets()
+            if frame is False:
+                break
+            batch.append(frame)
+        frames.extend(tuple(bytes(x) if type(x) is memoryview else x for x in f) for f in batch)
+        if hasattr(parser, "release"):
+            parser.release(batch)
+    return frames
+
+parsers = [PyPubSubParser, ViewPubSubParser]
+if hiredis is not None:
+    parsers.append(HiredisPubSubParser)
+
+@pytest.mark.parametrize("parser_cls", parsers)
+@pytest.mark.parametrize("chunk_size", [1, 7, len(STREAM)])
+def test_parser(parser_cls, chunk_size):
+    frames = parse(parser_cls, chunk_size)
+    assert frames[:7] == [
+        (SUBSCRIBE, b"ch"),
+        (PSUBSCRIBE, b"p*"),
+        (MESSAGE, b"ch", b"he\r\nl"),
+        (PMESSAGE, b"p*", b"px", b""),
+        (MESSAGE, b"ch", b"!"),
+        (MESSAGE, b"ch", None),
+        (SUNSUBSCRIBE, b"ch"),
+    ]
+    assert frames[7][0] == ERROR and isinstance(frames[7][1], ReplyError)
+    assert str(frames[7][1]).startswith("MOVED")
+    assert frames[8] == (OTHER, b"PONG")
+    assert len(frames) == 9
+
+def test_view_parser_reuses_bridges():
+    parser = ViewPubSubParser()
+    frame = b"*3\r\n$7\r\nmessage\r\n$2\r\nch\r\n$100\r\n" + b"x" * 100 + b"\r\n"
+
+    def read(*chunks):
+        for chunk in chunks:
+            parser.feed(chunk)
+        msg = parser.gets()
+        assert type(msg[2]) is memoryview and msg[2] == b"x" * 100
+        return msg
+
+    # A frame split in two needs a bridge buffer, which goes back 
+    # to the pool once released and replaced by the next chunk.
+    msg = read(frame[:50], frame[50:])
+    parser.release([msg])
+    with pytest.raises(ValueError):
+        msg[2].tobytes()
+    parser.release([read(frame)])
+    assert len(parser._pool) == 1
+
+    # A view kept by the subscriber keeps its bridge out of the pool.
+    msg = read(frame[:50], frame[50:])
+    assert parser._pool == []
+    kept = msg[2][:10]
+    parser.release([msg])
+    parser.release([read(frame)])
+    assert parser._pool == []
+    assert kept == b"x" * 10
+
+@pytest.mark.parametrize("parser_cls", parsers)
+def test_parser_large_backlog(parser_cls):
+    # A backlog much larger than any internal buffer, fed as a bytearray
+    # that gets cleared right away like aioredis does.
+    payloads = [b"%d" % i * 300 for i in range(2000)]
+    data = bytearray(b"".join(b"*3\r\n$7\r\nmessage\r\n$2\r\nch\r\n$%d\r\n%s\r\n" % (len(p), p)
+        for p in payloads))
+    parser = parser_cls()
+    parser.feed(data)
+    del data[:]
+    received = []
+    while True:
+        frame = parser.gets()
+        if frame is False:
+            break
+        received.append(bytes(frame[2]))
+    assert received == payloads
@@ -0,0 +1,62 @@
+import pytest
+from redismpx.internal import List, ListNode
+from redismpx.internal.parser import MESSAGE
+
+def test_list_prepend():
+    l = List(None)
+    nodes = [ListNode(sub=i) for i in range(3)]
+    for node in nodes:
+        l.prepend(node)
+    assert [node.sub for node in l] == [2, 1, 0]
+
+    nodes[1].remove_from_list()
+    assert [node.sub for node in l] == [2, 0]
+    nodes[2].remove_from_list()
+    assert [node.sub for node in l] == [0]
+    nodes[0].remove_from_list()
+    assert l.is_empty()
+
+@pytest.mark.asyncio
+async def test_dispatch_plans(make_multiplexer):
+    mpx = make_multiplexer()
+    received = []
+
+    def on_message(ch, msg):
+        received.append("sync")
+
+    async def on_message_async(ch, msg):
+        received.append("async")
+
+    def on_messages(ch, msgs):
+        received.append("batch")
+
+    async def on_messages_async(ch, msgs):
+        received.append("async batch")
+
+    first = mpx.new_channel_subscription(on_message, None, None)
+    second = mpx.new_channel_subscription(on_message_async, None, None)
+    third = mpx.new_channel_subscription(None, None, None, on_messages=on_messages)
+    fourth = mpx.new_channel_subscription(None, None, None, on_messages=on_messages_async)
+    extra = mpx.new_channel_subscription(on_message, None, None)
+
+    expected = ((), (), (), ())
+    for sub, slot, fn in [
+            (first, 0, on_message), (second, 1, on_message_async),
+            (third, 2, on_messages), (fourth, 3, on_messages_async),
+            (extra, 0, on_message)]:
+        sub.add("a")
+        expected = tuple(fns + (fn,) if i == slot else fns for i, fns in enumerate(expected))
+        assert mpx.channel_plans[b"a"] == expected
+
+    await mpx._process_batch([(MESSAGE, b"a", b"x")])
+    assert sorted(received) == ["async", "async batch", "batch", "sync", "sync"]
+
+    first.remove("a")
+    assert mpx.channel_plans[b"a"] == ((on_message,), (on_message_async,), (on_messages,), (on_messages_async,))
+    second.remove("a")
+    fourth.remove("a")
+    assert mpx.channel_plans[b"a"] == ((on_message,), (), (on_messages,), ())
+
+    received.clear()
+    await mpx._process_batch([(MESSAGE, b"a", b"x")])
+    assert sorted(received) == ["batch", "sync"]
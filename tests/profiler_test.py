@@ -0,0 +1,55 @@
+import pytest
+import asyncio
+import time
+from redismpx import CallbackProfiler
+
+def blocking_on_message(channel, message):
+    time.sleep(0.05)
+
+async def blocking_async_on_message(channel, message):
+    await asyncio.sleep(0.01)
+    time.sleep(0.05)
+
+@pytest.mark.asyncio
+async def test_slow_callbacks():
+    reports = []
+    profiler = CallbackProfiler(threshold=0.02, on_slow=reports.append)
+    profiler.attach()
+    sub = object()
+
+    fast = profiler.wrap(lambda channel, message: None, "on_message", sub)
+    fast(b"ch", b"msg")
+    assert reports == []
+
+    profiler.wrap(blocking_on_message, "on_message", sub)(b"ch", b"msg")
+    on_message = profiler.wrap(blocking_async_on_message, "on_message", sub)
+    assert asyncio.iscoroutinefunction(on_message)
+    await on_message(b"other", b"msg")
+    profiler.stop()
+
+    assert [r.channel for r in reports] == [b"ch", b"other"]
+    assert all(r.subscription is sub for r in reports)
+    # The watchdog caught both callbacks while they were blocked.
+    assert "blocking_on_message" in "".join(reports[0].stack)
+    assert "blocking_async_on_message" in "".join(reports[1].stack)
+    # The async one spent part of its time awaiting.
+    assert reports[1].running < reports[1].duration
+    assert list(profiler.slow_calls) == reports
+
+@pytest.mark.asyncio
+async def test_breakdown():
+    profiler = CallbackProfiler(threshold=None, sample_interval=0.001)
+    profiler.attach()
+    heavy = profiler.wrap(blocking_on_message, "on_message", None)
+    light = profiler.wrap(lambda channel: time.sleep(0.005), "on_activation", None)
+    heavy(b"ch", b"msg")
+    light(b"ch")
+    profiler.stop()
+
+    breakdown = profiler.breakdown()
+    assert [entry["kind"] for entry in breakdown] == ["on_message", "on_activation"]
+    assert breakdown[0]["callback"] == "blocking_on_message"
+    assert breakdown[0]["share"] > breakdown[1]["share"] > 0
+
+    profiler.reset()
+    assert profiler.breakdown() == []
@@ -0,0 +1,32 @@
+import pytest
+import asyncio
+from redismpx import PromiseSubscription
+
+@pytest.mark.asyncio
+async def test_bulk_promises(pattern_only_multiplexer):
+    sub = PromiseSubscription(pattern_only_multiplexer, "p-")
+    promises = sub.new_promises(["a", "b", "c"], 0.05)
+    assert len(sub.wheel.slots[(sub.wheel.cursor + 5) % sub.wheel.size]) == 1
+
+    loop = asyncio.get_running_loop()
+    loop.call_soon(sub.on_message, b"p-b", b"2")
+    loop.call_soon(sub.on_message, b"p-a", b"1")
+    assert await sub.wait_first_n(promises, 2) == [b"2", b"1"]
+
+    with pytest.raises(asyncio.TimeoutError):
+        await sub.wait_all(promises)
+    assert await sub.wait_all(promises, return_exceptions=True) == \
+        [b"1", b"2", promises[2].exception()]
+    assert sub.channels == {}
+
+    promises = sub.new_promises([b"x", b"x"], None)
+    sub.on_message(b"p-x", b"ok")
+    assert await sub.wait_any(promises) == b"ok"
+    assert await sub.wait_all(promises) == [b"ok", b"ok"]
+
+    promises = sub.new_promises(["y", "z"], 0.02)
+    sub.on_message(b"p-z", b"late")
+    assert await sub.wait_any(promises) == b"late"
+    with pytest.raises(ValueError):
+        await sub.wait_first_n(promises, 3)
+    sub.close()
@@ -0,0 +1,123 @@
+import pytest
+import asyncio
+from aioredis.parser import PyReader
+from aioredis.errors import ConnectionClosedError
+from redismpx import Publisher
+
+class PublishServer:
+    """Answers PUBLISH with the number of the command, when `replying` is set."""
+
+    def __init__(self):
+        self.received = []
+        self.reads = 0
+        self.replying = asyncio.Event()
+        self.replying.set()
+        self.writers = []
+
+    async def start(self):
+        server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return server, server.sockets[0].getsockname()[:2]
+
+    async def handle(self, reader, writer):
+        self.writers.append(writer)
+        parser = PyReader()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            self.reads += 1
+            parser.feed(data)
+            while True:
+                command = parser.gets()
+                if command is False:
+                    break
+                await self.replying.wait()
+                self.received.append((command[1], command[2]))
+                writer.write(b":%d\r\n" % len(self.received))
+        writer.close()
+
+@pytest.mark.asyncio
+async def test_publisher_pipelines():
+    fake = PublishServer()
+    server, address = await fake.start()
+    publisher = Publisher(address, pool_size=1)
+
+    results = await asyncio.gather(*(publisher.publish("ch", b"%d" % i) for i in range(100)))
+    assert results == list(range(1, 101))
+    assert fake.received == [(b"ch", b"%d" % i) for i in range(100)]
+    # All publishes went out with a single write.
+    assert fake.reads == 1
+
+    assert await publisher.publish("ch", "last", ack=False) is None
+    publisher.close()
+    server.close()
+
+@pytest.mark.asyncio
+async def test_publisher_backpressure():
+    fake = PublishServer()
+    server, address = await fake.start()
+    publisher = Publisher(address, pool_size=1, max_pending=10, ack=False)
+    fake.replying.clear()
+
+    for i in range(10):
+        await publisher.publish("ch", b"%d" % i)
+    blocked = asyncio.ensure_future(publisher.publish("ch", b"10"))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+    assert publisher.pending == 10
+
+    fake.replying.set()
+    await asyncio.wait_for(blocked, 1)
+    publisher.close()
+    server.close()
+
+@pytest.mark.asyncio
+async def test_publisher_reconnects():
+    fake = PublishServer()
+    server, address = await fake.start()
+    publisher = Publisher(address, pool_size=1)
+    assert await publisher.publish("ch", b"a") == 1
+
+    fake.replying.clear()
+    unacknowledged = asyncio.ensure_future(publisher.publish("ch", b"b"))
+    await asyncio.sleep(0.05)
+    fake.writers[-1].close()
+    with pytest.raises(ConnectionClosedError):
+        await unacknowledged
+
+    fake.replying.set()
+    assert await asyncio.wait_for(publisher.publish("ch", b"c"), 1) > 1
+    publisher.close()
+    server.close()
+
+@pytest.mark.asyncio
+async def test_loopback(make_multiplexer, recording_publisher):
+    from redismpx.internal.parser import MESSAGE, PMESSAGE
+
+    publisher = recording_publisher
+    mpx = make_multiplexer(loopback=True, publisher=publisher)
+    other = make_multiplexer(loopback=True)
+    received = []
+    sub = mpx.new_channel_subscription(lambda ch, msg: received.append((ch, msg)), None, None)
+    sub.add("news")
+    mpx.new_pattern_subscription("ne*", lambda ch, msg: received.append((b"ne*", msg)), None, None)
+    mpx.new_pattern_subscription("sports*", lambda ch, msg: received.append((b"sports*", msg)), None, None)
+
+    await mpx.publish("news", "hello")
+    assert received == [(b"news", b"hello"), (b"ne*", b"hello")]
+    channel, wrapped = publisher.published[0]
+    assert channel == b"news" and wrapped != b"hello"
+
+    # Our own message coming back from Redis is dropped, while messages
+    # published by other Multiplexers get unwrapped.
+    received.clear()
+    foreign = other.envelope + b"hi"
+    await mpx._process_batch([
+        (MESSAGE, b"news", wrapped),
+        (PMESSAGE, b"ne*", b"news", wrapped),
+        (MESSAGE, b"news", foreign),
+        (PMESSAGE, b"ne*", b"news", foreign),
+        (MESSAGE, b"news", b"plain"),
+    ])
+    # Within a batch, channel groups are dispatched before pattern ones.
+    assert received == [(b"news", b"hi"), (b"news", b"plain"), (b"ne*", b"hi")]
@@ -0,0 +1,110 @@
+import pytest
+from redismpx.internal import Callbacks
+from redismpx.internal.parser import MESSAGE
+
+@pytest.mark.asyncio
+async def test_registry(make_multiplexer):
+    mpx = make_multiplexer()
+    received = []
+    subs = []
+    for i in range(3):
+        sub = mpx.new_channel_subscription(lambda ch, msg, i=i: received.append((i, ch)), None, None)
+        sub.add("a")
+        sub.add("b")
+        subs.append(sub)
+
+    # One Callbacks per subscription, shared by all its channels.
+    assert list(mpx.channels[b"a"]) == list(mpx.channels[b"b"]) == [sub.fn_box for sub in subs]
+    assert isinstance(subs[0].fn_box, Callbacks)
+    assert not hasattr(subs[0].fn_box, "__dict__")
+
+    subs[1].remove("a")
+    subs[1].remove("a")
+    assert list(mpx.channels[b"a"]) == [subs[0].fn_box, subs[2].fn_box]
+    assert list(subs[1].channels) == [b"b"]
+
+    await mpx._process_batch([(MESSAGE, b"a", b"x"), (MESSAGE, b"b", b"y")])
+    assert sorted(received) == [(0, b"a"), (0, b"b"), (1, b"b"), (2, b"a"), (2, b"b")]
+
+    for sub in subs:
+        sub.close()
+    assert not mpx.channels
+
+@pytest.mark.asyncio
+async def test_bulk_channels(make_multiplexer, recording_connection):
+    import asyncio
+    from redismpx.internal.parser import SUBSCRIBE
+
+    mpx = make_multiplexer()
+    connection = mpx.connection = recording_connection
+    first = mpx.new_channel_subscription(lambda ch, msg: None, None, None)
+    first.add_many(["a", "b", b"c", "a"])
+    assert list(first.channels) == [b"a", b"b", b"c"]
+    await asyncio.sleep(0)
+    assert connection.commands == [(b"SUBSCRIBE", b"a", b"b", b"c")]
+    await mpx._process_batch([(SUBSCRIBE, b"a"), (SUBSCRIBE, b"b"), (SUBSCRIBE, b"c")])
+
+    activations = []
+    second = mpx.new_channel_subscription(lambda ch, msg: None, None, None,
+        on_activations=activations.append)
+    second.add_many(["a", "b", "d"])
+    await asyncio.sleep(0)
+    # Already active channels are reported with a single call.
+    assert activations == [[b"a", b"b"]]
+    await mpx._process_batch([(SUBSCRIBE, b"d")])
+    assert activations == [[b"a", b"b"], [b"d"]]
+
+    connection.commands.clear()
+    calls = []
+    call = mpx._call
+    mpx._call = lambda fn, *args: calls.append(fn) or call(fn, *args)
+    first.set_channels(["c", "e", "f"])
+    assert list(first.channels) == [b"c", b"e", b"f"]
+    # The whole change is handed to the Multiplexer at once.
+    assert calls == [mpx._replace_channels]
+    await asyncio.sleep(0)
+    assert connection.commands == [(b"SUBSCRIBE", b"e", b"f")]
+
+    connection.commands.clear()
+    first.remove_many(["e", "f", "x"])
+    second.remove_many(["a", "b", "d"])
+    assert list(second.channels) == []
+    await asyncio.sleep(0)
+    assert connection.commands == [(b"UNSUBSCRIBE", b"e", b"f", b"a", b"b", b"d")]
+
+    first.close()
+    second.close()
+
+@pytest.mark.asyncio
+async def test_channel_interning(make_multiplexer):
+    from redismpx.internal.parser import SUBSCRIBE
+
+    mpx = make_multiplexer()
+    subs = [mpx.new_channel_subscription(lambda ch, msg: None, None, None) for _ in range(3)]
+    for sub in subs:
+        sub.add("news")
+        sub.add_many(["sports"])
+
+    # All subscriptions share the Multiplexer's copy of the name.
+    news = next(iter(mpx.channels))
+    assert all(next(iter(sub.channels)) is news for sub in subs)
+    await mpx._process_batch([(SUBSCRIBE, b"news")])
+    assert next(iter(mpx.active_channels)) is news
+
+    news_id = mpx.channel_id("news")
+    assert mpx.channel_name(news_id) is news
+    assert mpx.channel_id("sports") != news_id
+    assert mpx.channel_id("weather") is None
+
+    # Ids of dropped channels get reused.
+    for sub in subs:
+        sub.remove("news")
+    assert mpx.channel_id("news") is None
+    assert mpx._canonical_channel(b"news") == b"news"
+    with pytest.raises(KeyError):
+        mpx.channel_name(news_id)
+    subs[0].add("weather")
+    assert mpx.channel_id("weather") == news_id
+
+    for sub in subs:
+        sub.close()
@@ -0,0 +1,53 @@
+import pytest
+import asyncio
+from redismpx.internal.parser import SUBSCRIBE, PSUBSCRIBE
+
+async def settle():
+    # Lets the resubscriber notice confirmations, through wait_for.
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+@pytest.mark.asyncio
+async def test_chunks(make_multiplexer):
+    mpx = make_multiplexer(resubscribe_chunk=3, resubscribe_bytes=4)
+    assert list(mpx._chunks([b"a", b"b", b"c", b"d"])) == [[b"a", b"b", b"c"], [b"d"]]
+    assert list(mpx._chunks([b"aa", b"bb", b"c"])) == [[b"aa", b"bb"], [b"c"]]
+    assert list(mpx._chunks([])) == []
+
+@pytest.mark.asyncio
+async def test_resubscribe(make_multiplexer, recording_connection):
+    mpx = make_multiplexer(resubscribe_chunk=2, resubscribe_timeout=0.05)
+    sub = mpx.new_channel_subscription(lambda ch, msg: None, None, None)
+    sub.add_many(["a", "b", "c"])
+    mpx.new_pattern_subscription("p*", lambda ch, msg: None, None, None)
+    patterns = mpx.new_pattern_subscription("q*", lambda ch, msg: None, None, None)
+    await settle()
+
+    connection = mpx.connection = recording_connection
+    resubscriber = asyncio.ensure_future(mpx._resubscribe(list(mpx.channels), list(mpx.patterns)))
+    await settle()
+    assert connection.commands == [(b"SUBSCRIBE", b"a", b"b")]
+    assert mpx.resubscription == (0, 5)
+
+    # The next chunk waits for the whole previous one to be confirmed.
+    await mpx._process_batch([(SUBSCRIBE, b"a")])
+    await settle()
+    assert len(connection.commands) == 1
+    await mpx._process_batch([(SUBSCRIBE, b"b")])
+    await settle()
+    assert connection.commands[1:] == [(b"SUBSCRIBE", b"c")]
+    assert mpx.resubscription == (2, 5)
+
+    # Without confirmations, it moves on after resubscribe_timeout, and
+    # skips what got removed in the meantime.
+    patterns.close()
+    await asyncio.sleep(0.1)
+    assert (b"PSUBSCRIBE", b"p*") in connection.commands
+    assert (b"PSUBSCRIBE", b"p*", b"q*") not in connection.commands
+    assert mpx.resubscription == (3, 5)
+    assert not mpx.resubscribed_event.is_set()
+
+    await mpx._process_batch([(PSUBSCRIBE, b"p*")])
+    await asyncio.wait_for(resubscriber, 1)
+    assert mpx.resubscribed_event.is_set()
+    assert mpx.resubscription == (4, 5)
@@ -0,0 +1,16 @@
+from redismpx.internal import HashRing
+
+def test_hash_ring():
+    ring = HashRing(["a", "b", "c"])
+    keys = [b"channel-%d" % i for i in range(3000)]
+    owners = [ring.get(k) for k in keys]
+
+    # every node gets a fair share of the keys
+    for node in ("a", "b", "c"):
+        assert owners.count(node) > 600
+
+    # removing a node only moves the keys it owned
+    smaller = HashRing(["a", "b"])
+    for key, owner in zip(keys, owners):
+        if owner != "c":
+            assert smaller.get(key) == owner
@@ -0,0 +1,106 @@
+import pytest
+import asyncio
+from benchmarks.fake_redis import FakeRedis
+from redismpx import ShardedMultiplexer
+
+async def wait_until(condition, timeout=2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert condition()
+
+@pytest.mark.asyncio
+async def test_shard_disconnect():
+    fake = FakeRedis()
+    address = await fake.start()
+    mpx = ShardedMultiplexer(address, shards=2)
+    first, second = mpx.shards
+    # Channels owned by each shard.
+    names = [b"ch%d" % i for i in range(100)]
+    on_first = next(ch for ch in names if mpx.shard_for(ch) is first)
+    on_second = next(ch for ch in names if mpx.shard_for(ch) is second)
+
+    disconnected = []
+
+    def subscribe(name, channels):
+        sub = mpx.new_channel_subscription(lambda ch, msg: None,
+            lambda e: disconnected.append(name), None)
+        for channel in channels:
+            sub.add(channel)
+        return sub
+
+    subs = [
+        subscribe("first", [on_first]),
+        subscribe("second", [on_second]),
+        subscribe("both", [on_first, on_second]),
+        mpx.new_pattern_subscription("ch*", lambda ch, msg: None,
+            lambda e: disconnected.append("pattern"), None),
+    ]
+    # Patterns live on their own shard.
+    assert mpx.pattern_shard not in mpx.shards
+    assert set(mpx.pattern_shard.patterns) == {b"ch*"}
+    assert not first.patterns and not second.patterns
+    await wait_until(lambda: fake.subscriptions() == 3)
+
+    # Only the subscriptions that depend on the dropped shard hear about it.
+    first.connection.close()
+    await wait_until(lambda: disconnected)
+    await asyncio.sleep(0.05)
+    assert sorted(disconnected) == ["both", "first"]
+    await asyncio.wait_for(first.connected_event.wait(), 2)
+
+    disconnected.clear()
+    mpx.pattern_shard.connection.close()
+    await wait_until(lambda: disconnected)
+    await asyncio.sleep(0.05)
+    assert disconnected == ["pattern"]
+
+    for sub in subs:
+        sub.close()
+    mpx.close()
+    fake.close()
+
+class BufferedConnection:
+    def __init__(self, buffered_bytes):
+        self.buffered_bytes = buffered_bytes
+
+    def write_command(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+@pytest.mark.asyncio
+async def test_bulk_add_write_limit(make_multiplexer):
+    from redismpx import WriteStalled
+
+    mpx = make_multiplexer(ShardedMultiplexer, shards=2, write_buffer_limit=10)
+    first, second = mpx.shards
+    first.connection = BufferedConnection(0)
+    second.connection = BufferedConnection(100)
+    names = [b"ch%d" % i for i in range(100)]
+    on_first = next(ch for ch in names if mpx.shard_for(ch) is first)
+    on_second = next(ch for ch in names if mpx.shard_for(ch) is second)
+    sub = mpx.new_channel_subscription(lambda ch, msg: None, None, None)
+
+    # A stalled shard fails the whole change, before any shard takes it.
+    for change in (sub.add_many, sub.set_channels):
+        with pytest.raises(WriteStalled):
+            change([on_first, on_second])
+        assert not first.channels and not second.channels
+        assert not sub.channels
+
+    second.connection.buffered_bytes = 0
+    sub.set_channels([on_first])
+    second.connection.buffered_bytes = 100
+    # Nothing gets removed either.
+    with pytest.raises(WriteStalled):
+        sub.set_channels([on_second])
+    assert set(first.channels) == {on_first} and list(sub.channels) == [on_first]
+
+    second.connection.buffered_bytes = 0
+    sub.set_channels([on_first, on_second])
+    assert set(first.channels) == {on_first} and set(second.channels) == {on_second}
+    sub.close()
+    assert not first.channels and not second.channels
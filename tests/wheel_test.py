@@ -0,0 +1,42 @@
+import pytest
+import asyncio
+from redismpx.internal import TimingWheel
+
+@pytest.mark.asyncio
+async def test_timing_wheel():
+    expired = []
+    wheel = TimingWheel(expired.extend, tick=0.01, size=8)
+
+    # 0.2s is more than a full rotation of the wheel.
+    wheel.schedule(0.2, "late")
+    wheel.schedule(0.02, "early")
+    await asyncio.sleep(0.1)
+    assert expired == ["early"]
+
+    await asyncio.sleep(0.2)
+    assert expired == ["early", "late"]
+    assert wheel.count == 0
+
+    wheel.schedule(0.01, "cleared")
+    wheel.clear()
+    await asyncio.sleep(0.05)
+    assert expired == ["early", "late"]
+
+@pytest.mark.asyncio
+async def test_timing_wheel_mid_tick():
+    loop = asyncio.get_running_loop()
+    expired = []
+    wheel = TimingWheel(lambda items: expired.extend((item, loop.time()) for item in items), tick=0.05, size=8)
+
+    # Keeps the wheel running, then schedules near the end of a tick.
+    wheel.schedule(1, "running")
+    await asyncio.sleep(0.045)
+    start = loop.time()
+    wheel.schedule(0.05, 0.05)
+    wheel.schedule(0.06, 0.06)
+    await asyncio.sleep(0.2)
+
+    assert [delay for delay, _ in expired] == [0.05, 0.06]
+    for delay, when in expired:
+        assert delay <= when - start < delay + wheel.tick + 0.02
+    wheel.clear()